@@ -3,7 +3,7 @@ import threading
 import time
 import datetime as dt
 from pathlib import Path
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_socketio import SocketIO, emit
 
 from services import (
@@ -21,9 +21,15 @@ from services import (
     app_status,
     shutdown_app,
     rebuild_all_embeddings,
+    get_rebuild_status,
+    set_file_tags,
     upload_files,
-    rebuild_services
+    rebuild_services,
+    compact_history,
+    get_compute_status,
+    get_metrics
 )
+from modules.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from website import register_routes as core_routes
 
 socketio = SocketIO(cors_allowed_origins="*")
@@ -72,7 +78,22 @@ def register_admin_routes(app: Flask, *, config_path: str | Path = "config.yaml"
     @app.get("/api/files")
     def list_files_route():
         services = minimal_init_classes(cfg_file, socketio)
-        response, status = list_files(services)
+        try:
+            limit = int(request.args.get("limit", 100))
+            cursor = request.args.get("cursor")
+            cursor = int(cursor) if cursor else None
+        except ValueError:
+            return jsonify({"status": "error", "message": "Недопустимый лимит или курсор"}), 400
+        response, status = list_files(
+            services,
+            limit=limit,
+            cursor=cursor,
+            sort=request.args.get("sort", "id"),
+            order=request.args.get("order", "asc"),
+            file_type=request.args.get("type") or None,
+            splitter_method=request.args.get("splitter_method") or None,
+            name_prefix=request.args.get("name_prefix") or None,
+        )
         return jsonify(response), status
 
     @app.delete("/api/files/<path:filename>")
@@ -87,10 +108,23 @@ def register_admin_routes(app: Flask, *, config_path: str | Path = "config.yaml"
         response, status = rebuild_embeddings(filename, services, socketio)
         return jsonify(response), status
     
+    @app.put("/api/files/<path:filename>/tags")
+    def set_file_tags_route(filename):
+        services = minimal_init_classes(cfg_file, socketio)
+        data = request.get_json(silent=True) or {}
+        response, status = set_file_tags(filename, data.get("tags"), services)
+        return jsonify(response), status
+
     @app.post("/api/files/rebuild-all")
     def rebuild_all_embeddings_route():
         services = minimal_init_classes(cfg_file, socketio)
-        response, status = rebuild_all_embeddings(services, socketio)
+        force = request.args.get("force", "").lower() in ("1", "true", "yes")
+        response, status = rebuild_all_embeddings(services, socketio, force=force)
+        return jsonify(response), status
+
+    @app.get("/api/files/rebuild-all")
+    def rebuild_status_route():
+        response, status = get_rebuild_status()
         return jsonify(response), status
     
     @app.post("/api/files/upload")
@@ -99,13 +133,33 @@ def register_admin_routes(app: Flask, *, config_path: str | Path = "config.yaml"
         response, status = upload_files(request.files.getlist("files"), services, socketio)
         return jsonify(response), status
 
+    @app.post("/api/history/compact")
+    def compact_history_route():
+        services = full_init_classes(cfg_file, socketio)
+        response, status = compact_history(services)
+        return jsonify(response), status
+
+    @app.get("/metrics")
+    def metrics_route():
+        return Response(get_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+    @app.get("/api/compute")
+    def compute_status_route():
+        response, status = get_compute_status()
+        return jsonify(response), status
+
     @app.get("/api/logs")
     def get_logs_route():
         try:
             limit = int(request.args.get("limit", 100))
         except ValueError:
             return jsonify({"status": "error", "message": "Недопустимый лимит"}), 400
-        response, status = get_logs(cfg_file, limit)
+        try:
+            after = request.args.get("after")
+            after = int(after) if after is not None else None
+        except ValueError:
+            return jsonify({"status": "error", "message": "Недопустимый курсор"}), 400
+        response, status = get_logs(cfg_file, limit, after, request.args.get("level"))
         return jsonify(response), status
 
     @app.post("/api/app/start")
@@ -0,0 +1,82 @@
+"""
+Сравнение бэкендов EmbeddingHandler (PyTorch и ONNX Runtime) на текущем
+корпусе: фрагменты берутся из файлов, зарегистрированных в базе, и режутся
+настроенным разделителем. Печатает скорость (фрагментов/с) и косинусную
+близость ONNX-эмбеддингов к PyTorch.
+
+Запуск:
+    python -m benchmarks.embedding_backends --config config.yaml --chunks 2000
+"""
+import argparse
+import dataclasses
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config_loader import ConfigLoader
+from modules.db import DBManager
+from modules.document_manager import DocumentManager
+from modules.embedding_handler import EmbeddingHandler
+from modules.file_metadata_db import FileMetadataDB
+from modules.text_splitter import TextContextSplitter
+
+
+def load_corpus(cfg, limit: int) -> list:
+    db = DBManager(cfg.database)
+    metadata_db = FileMetadataDB(db.session_scope)
+    document_manager = DocumentManager(cfg.document_manager, metadata_db)
+    splitter = TextContextSplitter(cfg.splitter)
+    chunks = []
+    for rec in metadata_db.get_all_files():
+        if not Path(rec["path"]).is_file():
+            continue
+        text = document_manager.get_text(rec["path"])
+        if not text:
+            continue
+        chunks.extend(splitter.iter_split(text))
+        if len(chunks) >= limit:
+            break
+    return chunks[:limit]
+
+
+def run(handler: EmbeddingHandler, chunks: list, batch_size: int):
+    handler.get_batch_embeddings(chunks[:batch_size], batch_size)  # прогрев
+    t0 = time.perf_counter()
+    embeddings = handler.get_batch_embeddings(chunks, batch_size)
+    return np.stack(embeddings), time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    cfg = ConfigLoader(args.config).full
+    if cfg.splitter.method == "tokens":
+        # Для разбиения по токенам нужна модель; на сравнение это не влияет
+        cfg.splitter = dataclasses.replace(cfg.splitter, method="words")
+    chunks = load_corpus(cfg, args.chunks)
+    if not chunks:
+        raise SystemExit("В базе нет доступных файлов для корпуса")
+
+    results = {}
+    for backend in ("torch", "onnx"):
+        handler_cfg = dataclasses.replace(
+            cfg.embedding_handler, device="cpu", backend=backend, batching_enabled=False)
+        handler = EmbeddingHandler(handler_cfg)
+        if handler.backend != backend:
+            raise SystemExit(f"Бэкенд {backend} не загрузился, см. лог")
+        results[backend] = run(handler, chunks, args.batch_size)
+        print(f"{backend:<6} {len(chunks) / results[backend][1]:8.1f} фрагментов/с")
+
+    torch_emb, onnx_emb = results["torch"][0], results["onnx"][0]
+    cosine = (torch_emb * onnx_emb).sum(axis=1)
+    print(f"ускорение ONNX: x{results['torch'][1] / results['onnx'][1]:.2f}")
+    print(f"косинус с PyTorch: мин {cosine.min():.4f}, среднее {cosine.mean():.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Нагрузочный генератор для HTTP API на основе invoke_system.py.
+
+Гоняет /api/message, /api/history, /api/speech-to-text и /api/files/upload
+в заданной пропорции (--mix) с заданным параллелизмом. При --rate > 0
+запросы поступают по пуассоновскому потоку с этой средней частотой
+(открытая модель), при --rate 0 каждый поток шлёт следующий запрос сразу
+после ответа (закрытая модель). План запросов детерминирован по --seed.
+
+Цели:
+    по умолчанию     — Flask test_client в этом процессе;
+    --serve          — локальный сервер в этом процессе, запросы по HTTP;
+    --url URL        — уже запущенный сервер (генератор ответов — его собственный).
+В первых двух случаях AnswerGenerator заменяется детерминированной заглушкой,
+так что нагрузка идёт без LLM и на CPU (эмбеддинги, поиск, история — настоящие;
+устройства моделей задаются в --config).
+
+Печатает по каждому эндпоинту пропускную способность, p50/p95/p99 задержки
+и долю ошибок; --output сохраняет результат в JSON.
+
+Запуск:
+    python -m benchmarks.load --config config.yaml --requests 500 --concurrency 16 --rate 20 \
+        --mix message=70,history=20,speech=5,upload=5
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import math
+import random
+import statistics
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import invoke_system
+
+ENDPOINTS = ("message", "history", "speech", "upload")
+DEFAULT_QUESTIONS = [
+    "Какие сроки оплаты указаны в договоре?",
+    "Кто утверждает регламент закупок?",
+    "Сколько сотрудников в отделе качества?",
+    "What is the delivery deadline in the contract?",
+    "Where is the warehouse budget report?",
+    "Расскажи подробно о проекте",
+]
+
+
+class StubAnswerGenerator:
+    """Заглушка AnswerGenerator: ответ зависит только от запроса, модель не загружается"""
+
+    def __init__(self, config=None):
+        self.config = config
+
+    def update_config(self, new_config) -> None:
+        self.config = new_config
+
+    def generate_response(self, prompt: str) -> str:
+        digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=4).hexdigest()
+        return f"Тестовый ответ {digest}."
+
+
+def install_stub_generator() -> None:
+    """Подменить генератор ответов до первой инициализации сервисов."""
+    import services
+    services.AnswerGenerator = StubAnswerGenerator
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def parse_mix(raw: str) -> dict:
+    mix = {}
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Неизвестный эндпоинт в --mix: {name}")
+        mix[name] = float(weight or 1)
+    if sum(mix.values()) <= 0:
+        raise ValueError("Сумма весов --mix должна быть больше нуля")
+    return mix
+
+
+def tone_wav(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    """Моно WAV 16 бит с тоном 440 Гц — достаточно, чтобы прогнать распознавание."""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        frames += int(8000 * math.sin(2 * math.pi * 440 * i / rate)).to_bytes(2, "little", signed=True)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def build_plan(args, mix: dict, questions: list) -> list:
+    """Список (момент отправки, эндпоинт, аргументы); при rate 0 моменты не используются."""
+    rng = random.Random(args.seed)
+    names, weights = zip(*mix.items())
+    plan, at = [], 0.0
+    for i in range(args.requests):
+        if args.rate > 0:
+            at += rng.expovariate(args.rate)
+        endpoint = rng.choices(names, weights)[0]
+        user_id = f"load{rng.randrange(args.users)}"
+        if endpoint == "message":
+            params = {"user_id": user_id, "message": rng.choice(questions)}
+        elif endpoint == "upload":
+            words = " ".join(rng.choice(questions) for _ in range(5))
+            params = {"name": f"load_{args.seed}_{i}_{uuid.UUID(int=rng.getrandbits(128)).hex[:8]}.txt",
+                      "content": words.encode("utf-8")}
+        else:
+            params = {"user_id": user_id}
+        plan.append((at, endpoint, params))
+    return plan
+
+
+class LoadRunner:
+    def __init__(self, client_factory, audio: bytes):
+        self.client_factory = client_factory
+        self.audio = audio
+        self.results = []
+        self.uploaded = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.client_factory()
+        return self._local.client
+
+    def call(self, endpoint: str, params: dict):
+        client = self._client()
+        if endpoint == "message":
+            return invoke_system.send_message(client, params["user_id"], params["message"])
+        if endpoint == "history":
+            return invoke_system.send_get_history(client, params["user_id"])
+        if endpoint == "speech":
+            return invoke_system.send_speech_to_text(client, params["user_id"], self.audio)
+        return invoke_system.send_upload(client, [(params["content"], params["name"])])
+
+    def execute(self, endpoint: str, params: dict, scheduled: float | None = None) -> None:
+        """
+        Выполнить запрос и записать задержку. В открытой модели она считается
+        от *scheduled* — момента прибытия по плану, — чтобы время ожидания
+        свободного потока при перегрузке тоже попадало в замер.
+        """
+        t0 = time.perf_counter() if scheduled is None else scheduled
+        try:
+            status = self.call(endpoint, params).status_code
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.results.append((endpoint, elapsed, status))
+            if endpoint == "upload" and status == 200:
+                self.uploaded.append(params["name"])
+
+    def run(self, plan: list, concurrency: int, open_loop: bool) -> float:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as pool:
+            if open_loop:
+                for at, endpoint, params in plan:
+                    delay = start + at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.execute, endpoint, params, start + at)
+            else:
+                queue = iter(plan)
+                lock = threading.Lock()
+
+                def worker():
+                    while True:
+                        with lock:
+                            item = next(queue, None)
+                        if item is None:
+                            return
+                        self.execute(item[1], item[2])
+
+                for _ in range(concurrency):
+                    pool.submit(worker)
+        return time.perf_counter() - start
+
+    def cleanup(self) -> None:
+        client = self._client()
+        for name in self.uploaded:
+            client.delete(f"/api/files/{name}")
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    report = {}
+    for endpoint in ENDPOINTS:
+        rows = [(lat, status) for name, lat, status in results if name == endpoint]
+        if not rows:
+            continue
+        latencies = [lat for lat, _ in rows]
+        errors = [status for _, status in rows if status is None or status >= 400]
+        report[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / elapsed, 2),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 0.95), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "error_rate": round(len(errors) / len(rows), 4),
+            "error_statuses": {str(s): errors.count(s) for s in sorted(set(errors), key=str)},
+        }
+    return report
+
+
+def _serve(app, host: str, port: int):
+    from werkzeug.serving import make_server
+    # Журнал каждого запроса исказил бы замер
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--url", help="адрес запущенного сервера вместо test_client")
+    parser.add_argument("--serve", action="store_true", help="поднять локальный сервер и нагружать его по HTTP")
+    parser.add_argument("--port", type=int, default=8765, help="порт для --serve")
+    parser.add_argument("--requests", type=int, default=200, help="всего запросов")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="запросов в секунду (0 — закрытая модель)")
+    parser.add_argument("--mix", default="message=70,history=20,speech=5,upload=5")
+    parser.add_argument("--questions", type=Path, help="файл с вопросами, по одному в строке")
+    parser.add_argument("--audio", type=Path, help="WAV для /api/speech-to-text (по умолчанию — тон 1 с)")
+    parser.add_argument("--users", type=int, default=50, help="различных user_id")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep-uploads", action="store_true", help="не удалять загруженные файлы")
+    parser.add_argument("--output", type=Path, help="куда записать результат в JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        questions = [q.strip() for q in args.questions.read_text(encoding="utf-8").splitlines() if q.strip()]
+    audio = args.audio.read_bytes() if args.audio else tone_wav()
+    plan = build_plan(args, mix, questions)
+
+    server = None
+    if args.url:
+        target = args.url
+        client_factory = lambda: invoke_system.HttpClient(args.url)
+    else:
+        install_stub_generator()
+        from main import create_app
+        app = create_app(args.config)
+        if args.serve:
+            server = _serve(app, "127.0.0.1", args.port)
+            target = f"http://127.0.0.1:{args.port}"
+            client_factory = lambda: invoke_system.HttpClient(target)
+        else:
+            target = "test_client"
+            client_factory = lambda: app.test_client(use_cookies=False)
+
+    runner = LoadRunner(client_factory, audio)
+    # Прогрев: инициализация сервисов и загрузка моделей не попадают в замер
+    runner.call("message", {"user_id": "load_warmup", "message": questions[0]})
+    runner.call("history", {"user_id": "load_warmup"})
+    try:
+        elapsed = runner.run(plan, max(1, args.concurrency), args.rate > 0)
+    finally:
+        if not args.keep_uploads:
+            runner.cleanup()
+        if server is not None:
+            server.shutdown()
+
+    total_errors = sum(1 for _, _, s in runner.results if s is None or s >= 400)
+    result = {
+        "benchmark": "load",
+        "target": target,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()
+                   if k not in ("output", "url")},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(runner.results) / elapsed, 2),
+        "error_rate": round(total_errors / max(1, len(runner.results)), 4),
+        "endpoints": summarize(runner.results, elapsed),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
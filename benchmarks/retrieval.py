@@ -0,0 +1,246 @@
+"""
+Сквозной бенчмарк индексации и поиска на синтетическом многоязычном корпусе.
+
+Корпус (русский, английский, немецкий) генерируется детерминированно по --seed
+во временную папку и индексируется через services.process_single_file, вопросы
+проходят через DialogManager.answer_text с заглушкой генератора ответов
+(модель эмбеддингов и ChromaDB — настоящие, из конфигурации). Измеряются:
+скорость индексации (фрагментов/с), p50/p95/p99 задержки поиска и всего
+answer_text, recall@k поиска по индексу относительно точного перебора.
+
+Результат пишется в JSON (--output) вместе с версией кода; при --baseline
+печатается разница с прошлым прогоном.
+
+Запуск:
+    python -m benchmarks.retrieval --config config.yaml --docs 200 --queries 100 --output bench/retrieval.json
+"""
+import argparse
+import dataclasses
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import services
+from config_loader import ConfigLoader
+from modules.chunk_index import ChunkIndex
+from modules.compute import resources
+from modules.db import DBManager
+from modules.dialog_history import DialogHistory
+from modules.dialog_manager import DialogManager
+from modules.document_manager import DocumentManager
+from modules.embedding_handler import EmbeddingHandler
+from modules.embedding_storage import EmbeddingStorage
+from modules.file_metadata_db import FileMetadataDB
+from modules.text_splitter import TextContextSplitter
+
+LEXICON = {
+    "ru": ("отчёт договор поставка склад бюджет клиент сотрудник проект срок оплата счёт "
+           "компания отдел заявка проверка сервер данные приказ регламент качество закупка "
+           "был утверждён согласно требованиям в течение квартала после согласования с руководством").split(),
+    "en": ("report contract delivery warehouse budget customer employee project deadline payment "
+           "invoice company department request audit server data order policy quality purchase "
+           "was approved according to requirements during the quarter after review with management").split(),
+    "de": ("Bericht Vertrag Lieferung Lager Budget Kunde Mitarbeiter Projekt Frist Zahlung "
+           "Rechnung Firma Abteilung Antrag Prüfung Server Daten Anordnung Richtlinie Qualität Einkauf "
+           "wurde genehmigt gemäß den Anforderungen während des Quartals nach Abstimmung mit der Leitung").split(),
+}
+
+
+class StubGenerator:
+    """Заглушка AnswerGenerator: ответ без модели, чтобы мерить только поиск"""
+
+    def generate_response(self, prompt: str) -> str:
+        return f"Ответ по контексту длиной {len(prompt)} символов."
+
+
+class NullSocket:
+    def emit(self, *args, **kwargs):
+        pass
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def _latency(values) -> dict:
+    return {
+        "p50_ms": round(statistics.median(values) * 1000, 2),
+        "p95_ms": round(_percentile(values, 0.95), 2),
+        "p99_ms": round(_percentile(values, 0.99), 2),
+    }
+
+
+def _version() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate_corpus(folder: Path, docs: int, words: int, seed: int) -> list:
+    """Записать *docs* документов по ~*words* слов; возвращает их тексты (для вопросов)."""
+    rng = random.Random(seed)
+    languages = sorted(LEXICON)
+    texts = []
+    for i in range(docs):
+        lang = languages[i % len(languages)]
+        # У каждого документа своя «тема» — несколько редких меток, чтобы вопросы были различимы
+        topic = [f"{lang}{rng.randrange(10 ** 6):06d}" for _ in range(3)]
+        sentences = []
+        for _ in range(max(1, words // 12)):
+            sentence = rng.choices(LEXICON[lang], k=10) + rng.sample(topic, 2)
+            rng.shuffle(sentence)
+            sentences.append(" ".join(sentence).capitalize() + ".")
+        text = "\n".join(sentences)
+        (folder / f"doc_{i:05d}_{lang}.txt").write_text(text, encoding="utf-8")
+        texts.append(text)
+    return texts
+
+
+def generate_queries(texts: list, count: int, seed: int) -> list:
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(texts).split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+
+def exact_top_k(ids: list, matrix: np.ndarray, query: np.ndarray, k: int) -> list:
+    scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    top = np.argpartition(-scores, min(k, len(ids)) - 1)[:k]
+    return [ids[i] for i in top[np.argsort(-scores[top])]]
+
+
+def run(cfg, args, tmp: Path) -> dict:
+    docs_dir = tmp / "documents"
+    docs_dir.mkdir()
+    cfg = dataclasses.replace(
+        cfg,
+        documents_folder=str(docs_dir),
+        database=dataclasses.replace(cfg.database, url=f"sqlite:///{tmp / 'bench.db'}"),
+        # Порог сходства снят: recall сравнивается с точным top-k без отсечения
+        embedding_storage=dataclasses.replace(cfg.embedding_storage, db_path=str(tmp / "chroma"),
+                                              similarity_threshold=-1.0),
+        document_manager=dataclasses.replace(
+            cfg.document_manager,
+            text_cache=dataclasses.replace(cfg.document_manager.text_cache, cache_dir=str(tmp / "text_cache"))),
+    )
+    resources.configure(cfg.compute)
+    db = DBManager(cfg.database)
+    db.init_db()
+    metadata_db = FileMetadataDB(db.session_scope)
+    embedder = EmbeddingHandler(cfg.embedding_handler)
+    storage = EmbeddingStorage(cfg.embedding_storage)
+    chunk_index = ChunkIndex(metadata_db, storage, embedder)
+    svc = {
+        "config": cfg,
+        "metadata_db": metadata_db,
+        "document_manager": DocumentManager(cfg.document_manager, metadata_db),
+        "splitter": TextContextSplitter(cfg.splitter, embedder),
+        "embedder": embedder,
+        "embedding_storage": storage,
+        "chunk_index": chunk_index,
+    }
+    history = DialogHistory(db.session_scope, cfg.dialog_history)
+    dialog = DialogManager(embedder, storage, StubGenerator(), None, history, cfg.dialog_manager, chunk_index)
+
+    texts = generate_corpus(docs_dir, args.docs, args.words, args.seed)
+    queries = generate_queries(texts, args.queries, args.seed)
+
+    start = time.perf_counter()
+    for path in sorted(docs_dir.iterdir()):
+        services.process_single_file(path, svc, NullSocket())
+    ingest_s = time.perf_counter() - start
+    chunks = sum(len(metadata_db.get_chunks(rec["id"])) for rec in metadata_db.get_all_files())
+
+    ids, parts = [], []
+    for batch_ids, batch in storage.iter_embeddings():
+        ids.extend(batch_ids)
+        parts.append(batch)
+    matrix = np.vstack(parts)
+
+    search_lat, answer_lat, recalls = [], [], []
+    for i, question in enumerate(queries):
+        q_emb = embedder.get_text_embedding(question)
+        t0 = time.perf_counter()
+        found = [doc_id for doc_id, _ in storage.search_similar(q_emb, top_k=args.top_k)]
+        search_lat.append(time.perf_counter() - t0)
+        exact = exact_top_k(ids, matrix, q_emb, args.top_k)
+        recalls.append(len(set(found) & set(exact)) / len(exact))
+
+        t0 = time.perf_counter()
+        dialog.answer_text(f"bench{i % 16}", question, top_k=args.top_k)
+        answer_lat.append(time.perf_counter() - t0)
+
+    chunk_index.close()
+    history.close()
+    storage.close()
+    db.engine.dispose()
+    return {
+        "ingest": {
+            "files": args.docs,
+            "chunks": chunks,
+            "vectors": len(ids),
+            "seconds": round(ingest_s, 3),
+            "chunks_per_s": round(chunks / ingest_s, 1) if ingest_s else None,
+        },
+        "search": _latency(search_lat),
+        "answer_text": _latency(answer_lat),
+        f"recall@{args.top_k}": round(statistics.mean(recalls), 4),
+    }
+
+
+def compare(result: dict, baseline: dict) -> None:
+    for section in ("ingest", "search", "answer_text"):
+        for key, value in result[section].items():
+            old = baseline.get(section, {}).get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                print(f"{section}.{key}: {old} -> {value} ({(value - old) / old:+.1%})")
+    key = next(k for k in result if k.startswith("recall@"))
+    if key in baseline:
+        print(f"{key}: {baseline[key]} -> {result[key]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--docs", type=int, default=200, help="документов в корпусе")
+    parser.add_argument("--words", type=int, default=300, help="слов в документе")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="куда записать результат в JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    cfg = ConfigLoader(args.config).full
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = run(cfg, args, Path(tmp))
+    result = {
+        "benchmark": "retrieval",
+        "version": _version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("config", "output", "baseline")},
+        "embedding_model": cfg.embedding_handler.model_path,
+        **metrics,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.baseline and args.baseline.is_file():
+        compare(result, json.loads(args.baseline.read_text(encoding="utf-8")))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
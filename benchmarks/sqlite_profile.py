@@ -0,0 +1,108 @@
+"""
+Сравнение профилей SQLite: конкурентная запись истории диалогов
+и чтение страниц списка файлов.
+
+Запуск:
+    python -m benchmarks.sqlite_profile --writers 8 --readers 4 --ops 200
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from config_models import DatabaseConfig, SqliteTuningConfig
+from modules.db import DBManager
+from modules.dialog_history import DialogHistory
+from modules.file_metadata_db import FileMetadataDB
+
+PROFILES = {
+    # Поведение до введения профиля: журнал отката и полная синхронизация
+    "legacy": SqliteTuningConfig(
+        journal_mode="DELETE",
+        synchronous="FULL",
+        busy_timeout_ms=30000,
+        cache_size_kb=2000,
+        mmap_size_mb=0,
+        temp_store="DEFAULT",
+    ),
+    "tuned": SqliteTuningConfig(),
+}
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def run_profile(name: str, tuning: SqliteTuningConfig, writers: int, readers: int, ops: int, files: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBManager(DatabaseConfig(url=f"sqlite:///{Path(tmp) / 'bench.db'}", sqlite=tuning))
+        db.init_db()
+        metadata_db = FileMetadataDB(db.session_scope)
+        history = DialogHistory(db.session_scope)
+        for i in range(files):
+            metadata_db.add_file(f"/docs/file_{i:06d}.txt", file_type="text/plain", size=i, file_hash=f"{i:064x}")
+
+        write_lat, read_lat, errors = [], [], []
+        lock = threading.Lock()
+
+        def writer(idx):
+            for i in range(ops):
+                t0 = time.perf_counter()
+                try:
+                    history.save(f"user{idx}", f"question {i}", f"answer {i}")
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                with lock:
+                    write_lat.append(time.perf_counter() - t0)
+
+        def reader(_idx):
+            for i in range(ops):
+                t0 = time.perf_counter()
+                try:
+                    metadata_db.list_files(limit=50, after_id=(i * 50) % files or None)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                with lock:
+                    read_lat.append(time.perf_counter() - t0)
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        db.engine.dispose()
+
+    return {
+        "profile": name,
+        "elapsed_s": round(elapsed, 3),
+        "writes_per_s": round(len(write_lat) / elapsed, 1),
+        "reads_per_s": round(len(read_lat) / elapsed, 1),
+        "write_p50_ms": round(statistics.median(write_lat) * 1000, 2) if write_lat else None,
+        "write_p95_ms": round(_percentile(write_lat, 0.95), 2) if write_lat else None,
+        "read_p50_ms": round(statistics.median(read_lat) * 1000, 2) if read_lat else None,
+        "read_p95_ms": round(_percentile(read_lat, 0.95), 2) if read_lat else None,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200, help="операций на поток")
+    parser.add_argument("--files", type=int, default=5000, help="записей в таблице files")
+    args = parser.parse_args()
+    for name, tuning in PROFILES.items():
+        print(run_profile(name, tuning, args.writers, args.readers, args.ops, args.files))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Сравнение прежнего (три regex-прохода + список строк) и нового (смещения +
+ленивые строки) движков TextContextSplitter на многомегабайтном тексте.
+
+Запуск:
+    python -m benchmarks.text_splitter --mb 8
+"""
+import argparse
+import random
+import re
+import time
+import tracemalloc
+
+from config_models import TextSplitterConfig
+from modules.text_splitter import TextContextSplitter
+
+_VOCAB = ("документ поиск модель контекст ответ вопрос текст данные система "
+          "embedding vector index query chunk token paragraph sentence").split()
+
+
+def make_text(size_mb: float, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    parts, size = [], 0
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        sentences = []
+        for _ in range(rnd.randint(2, 6)):
+            words = " ".join(rnd.choice(_VOCAB) for _ in range(rnd.randint(5, 20)))
+            sentences.append(words.capitalize() + rnd.choice(".!?"))
+        paragraph = " ".join(sentences) + "\n\n"
+        parts.append(paragraph)
+        size += len(paragraph.encode("utf-8"))
+    return "".join(parts)
+
+
+def legacy_split(config: TextSplitterConfig, content: str) -> list:
+    """Прежняя реализация TextContextSplitter.split (для сравнения)."""
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    content = re.sub(r'([.!?])\s*\1+', r'\1', content)
+    content = re.sub(r'\s+', ' ', content).strip()
+    if config.method == "words":
+        wp, ow = config.words_per_context, config.overlap_words
+        words = content.split()
+        return [" ".join(words[max(0, i - ow):min(len(words), i + wp)])
+                for i in range(0, len(words), wp - ow)]
+    if config.method == "sentences":
+        sp, os_ = config.sentences_per_context, config.overlap_sentences
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", content) if s.strip()]
+        return [" ".join(sentences[max(0, i - os_):min(len(sentences), i + sp)])
+                for i in range(0, len(sentences), sp)]
+    pp, ol = config.paragraphs_per_context, config.overlap_lines
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", content.strip()) if p.strip()]
+    contexts = []
+    for i in range(0, len(paragraphs), pp):
+        chunk = paragraphs[i:i + pp]
+        if i > 0 and ol > 0:
+            chunk.insert(0, "\n".join(paragraphs[i - 1].split("\n")[-ol:]))
+        contexts.append("\n\n".join(chunk))
+    return contexts
+
+
+def _measure(fn):
+    # Время и память меряются отдельными прогонами: tracemalloc заметно замедляет аллокации
+    t0 = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=8.0, help="размер текста, МБ")
+    args = parser.parse_args()
+    text = make_text(args.mb)
+    for method in ("words", "sentences", "paragraphs"):
+        config = TextSplitterConfig(method=method, words_per_context=30, overlap_words=20,
+                                    sentences_per_context=3, overlap_sentences=1,
+                                    paragraphs_per_context=1, overlap_lines=1)
+        splitter = TextContextSplitter(config)
+
+        # Потребитель обрабатывает контексты по одному, как при индексации
+        def run_legacy():
+            return sum(1 for _ in legacy_split(config, text))
+
+        def run_new():
+            return sum(1 for _ in splitter.iter_split(text))
+
+        for name, fn in (("legacy", run_legacy), ("spans", run_new)):
+            count, elapsed, peak = _measure(fn)
+            print(f"{method:<10} {name:<7} chunks={count:<8} time={elapsed:6.2f}s peak={peak:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,16 @@ class GenerationConfig:
 class EmbeddingHandlerConfig:
     device: str
     model_path: str
+    # Микро-батчинг одиночных запросов из разных потоков
+    batching_enabled: bool = True
+    max_batch_size: int = 64
+    batch_max_wait_ms: float = 5.0
+    # torch | onnx (ONNX Runtime на CPU, модель экспортируется один раз)
+    backend: str = "torch"
+    onnx_cache_dir: str = "models/onnx"
+    onnx_quantize: bool = True
+    # Минимальная косинусная близость с PyTorch на контрольных текстах
+    onnx_min_cosine: float = 0.99
 
 
 @dataclass
@@ -70,6 +80,9 @@ class TextSplitterConfig:
     overlap_sentences: int
     paragraphs_per_context: int
     overlap_lines: int
+    # 0 — по max_seq_length модели эмбеддингов
+    tokens_per_context: int = 0
+    overlap_tokens: int = 32
 
 
 @dataclass
@@ -82,12 +95,24 @@ class DocumentProcessingConfig:
 class ImageCaptioningConfig:
     device: str
     model_name: str
+    # Изображений в одном вызове generate
+    batch_size: int = 8
+    # Потоков декодирования и ресайза изображений
+    decode_workers: int = 4
+
+
+@dataclass
+class TextCacheConfig:
+    enabled: bool = True
+    cache_dir: str = "data/text_cache"
+    compression: str = "gzip"  # gzip | zstd
 
 
 @dataclass
 class DocumentManagerConfig:
     processing: DocumentProcessingConfig
     captioning: ImageCaptioningConfig
+    text_cache: TextCacheConfig = field(default_factory=TextCacheConfig)
 
 
 @dataclass
@@ -96,6 +121,12 @@ class EmbeddingStorageConfig:
     collection_name: str
     embedding_dim: int
     similarity_threshold: float
+    # none | hash | time
+    shard_by: str = "none"
+    # Только для пустого хранилища: при других значениях на диске EmbeddingStorage не откроется
+    shard_count: int = 4
+    # Потоков для параллельного опроса шардов
+    search_workers: int = 4
 
 @dataclass
 class SpeechConfig:
@@ -128,10 +159,66 @@ class DialogManagerConfig:
     show_text_source_info: bool
     show_text_fragments: bool
     messages: DefaultMessages
+    near_duplicate_threshold: float = 0.0   # 0 — не схлопывать почти одинаковые фрагменты
+
+@dataclass
+class SqliteTuningConfig:
+    journal_mode: str = "WAL"          # WAL | DELETE | TRUNCATE | MEMORY
+    synchronous: str = "NORMAL"        # OFF | NORMAL | FULL
+    busy_timeout_ms: int = 5000
+    cache_size_kb: int = 65536
+    mmap_size_mb: int = 256
+    temp_store: str = "MEMORY"         # DEFAULT | FILE | MEMORY
+    cached_statements: int = 256
+
+
+@dataclass
+class DialogHistoryConfig:
+    write_behind: bool = True
+    flush_batch_size: int = 64
+    flush_interval_ms: int = 200
+    cache_turns: int = 30
+    cache_max_users: int = 10000
+    retention_max_turns_per_user: int = 0   # 0 — без ограничения
+    retention_max_age_days: int = 0         # 0 — без ограничения
+    archive_dir: str = "data/history_archive"
+    archive_compression: str = "gzip"       # gzip | zstd | none
+    compaction_interval_s: int = 3600
+    compaction_chunk_size: int = 500
+
 
 @dataclass
 class DatabaseConfig:
     url: str
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: float = 30.0
+    sqlite: SqliteTuningConfig = field(default_factory=SqliteTuningConfig)
+
+@dataclass
+class ComputeConfig:
+    # 0 — по числу ядер
+    total_threads: int = 0
+    interop_threads: int = 1
+    # Доля потоков для чата, остальные — для индексации документов
+    chat_share: float = 0.5
+    # Потоков на один вызов модели; 0 — весь бюджет нагрузки
+    embedding_threads: int = 2
+    generator_threads: int = 0
+    captioner_threads: int = 2
+
+
+@dataclass
+class RebuildConfig:
+    # Пересоздавать эмбеддинги всех файлов в фоне, не блокируя запрос
+    background: bool = True
+    # Файлов в одной порции (описания изображений считаются порцией)
+    batch_size: int = 32
+    # Пауза между файлами
+    pause_ms: int = 0
+    # Сколько ждать перед следующим файлом, пока выполняются запросы чата
+    yield_to_chat_ms: int = 2000
+
 
 @dataclass
 class AppConfig:
@@ -145,3 +232,6 @@ class AppConfig:
     dialog_manager: DialogManagerConfig
     logging: LoggingConfig
     database: DatabaseConfig
+    dialog_history: DialogHistoryConfig = field(default_factory=DialogHistoryConfig)
+    compute: ComputeConfig = field(default_factory=ComputeConfig)
+    rebuild: RebuildConfig = field(default_factory=RebuildConfig)
@@ -1,11 +1,97 @@
+import io
+import json
 import os
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
 
 
-def call_message(client, user_id: str, message: str, info: str = None):
+class HttpResponse:
+    """Ответ живого сервера с тем же интерфейсом, что у ответа Flask test_client"""
+
+    def __init__(self, status_code: int, data: bytes):
+        self.status_code = status_code
+        self.data = data
+
+    def get_json(self):
+        try:
+            return json.loads(self.data)
+        except ValueError:
+            return None
+
+    def get_data(self, as_text: bool = False):
+        return self.data.decode('utf-8', errors='replace') if as_text else self.data
+
+
+class HttpClient:
     """
-    Отправляет POST-запрос на /api/message и печатает JSON-ответ в консоль.
+    Клиент для запущенного сервера (например, http://127.0.0.1:8000)
+    с подмножеством интерфейса Flask test_client: get/post/put/delete
+    с аргументами json, query_string и data (поля формы и файлы как
+    (файл, имя) или список таких пар — отправляются multipart/form-data).
+    """
+
+    def __init__(self, base_url: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, path, **kwargs):
+        return self.open('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open('DELETE', path, **kwargs)
+
+    def open(self, method, path, json=None, query_string=None, data=None):
+        url = self.base_url + path
+        if query_string:
+            url += '?' + urllib.parse.urlencode(query_string)
+        body, headers = None, {}
+        if json is not None:
+            body = _json_dumps(json)
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body, headers['Content-Type'] = _multipart(data)
+        req = urllib.request.Request(url, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return HttpResponse(resp.status, resp.read())
+        except urllib.error.HTTPError as e:
+            return HttpResponse(e.code, e.read())
+
+
+def _json_dumps(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def _multipart(data: dict):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in data.items():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, tuple):
+                stream, filename = item
+                payload = stream.read()
+                header = f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n' \
+                         'Content-Type: application/octet-stream'
+            else:
+                payload = str(item).encode('utf-8')
+                header = f'Content-Disposition: form-data; name="{name}"'
+            parts.append(f'--{boundary}\r\n{header}\r\n\r\n'.encode('utf-8') + payload + b'\r\n')
+    body = b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def send_message(client, user_id: str, message: str, info: str = None):
+    """
+    POST /api/message; возвращает ответ.
 
-    client: Flask test_client
     info может быть:
       - 'source' для включения информации об источниках,
       - 'fragments' для включения текстовых фрагментов,
@@ -18,7 +104,37 @@ def call_message(client, user_id: str, message: str, info: str = None):
             payload['show_source_info'] = True
         if key in ('fragments', 'all'):
             payload['show_text_fragments'] = True
-    resp = client.post('/api/message', json=payload)
+    return client.post('/api/message', json=payload)
+
+
+def send_get_history(client, user_id: str):
+    """GET /api/history; возвращает ответ."""
+    return client.get('/api/history', query_string={'user_id': user_id})
+
+
+def send_speech_to_text(client, user_id: str, audio, filename: str = 'audio.wav'):
+    """POST /api/speech-to-text с файлом (поток или байты); возвращает ответ."""
+    if isinstance(audio, bytes):
+        audio = io.BytesIO(audio)
+    return client.post('/api/speech-to-text', data={'user_id': user_id, 'audio': (audio, filename)})
+
+
+def send_upload(client, files, tags: str = None):
+    """POST /api/files/upload; files — список пар (байты, имя файла). Возвращает ответ."""
+    data = {'files': [(io.BytesIO(content), name) for content, name in files]}
+    if tags:
+        data['tags'] = tags
+    return client.post('/api/files/upload', data=data)
+
+
+def call_message(client, user_id: str, message: str, info: str = None):
+    """
+    Отправляет POST-запрос на /api/message и печатает JSON-ответ в консоль.
+
+    client: Flask test_client или HttpClient
+    info — см. send_message.
+    """
+    resp = send_message(client, user_id, message, info)
     print('POST /api/message ->', resp.status_code)
     print(resp.get_json())
 
@@ -27,7 +143,7 @@ def call_get_history(client, user_id: str):
     """
     Отправляет GET-запрос на /api/history и печатает JSON-ответ в консоль.
     """
-    resp = client.get('/api/history', query_string={'user_id': user_id})
+    resp = send_get_history(client, user_id)
     print('GET /api/history ->', resp.status_code)
     print(resp.get_json())
 
@@ -50,8 +166,7 @@ def call_speech_to_text(client, user_id: str, audio_path: str):
         return
 
     with open(audio_path, 'rb') as f:
-        data = {'user_id': user_id, 'audio': (f, os.path.basename(audio_path))}
-        resp = client.post('/api/speech-to-text', data=data)
+        resp = send_speech_to_text(client, user_id, f, os.path.basename(audio_path))
         print('POST /api/speech-to-text ->', resp.status_code)
         print(resp.get_json())
 
@@ -91,10 +206,15 @@ def call_index(client, user_id: str = None):
 
 
 if __name__ == '__main__':
-    from main import create_app
-    # Создаём приложение и client только здесь
-    app = create_app()
-    client = app.test_client()
+    import sys
+    if len(sys.argv) > 1:
+        # Адрес запущенного сервера, например http://127.0.0.1:8000
+        client = HttpClient(sys.argv[1])
+    else:
+        from main import create_app
+        # Создаём приложение и client только здесь
+        app = create_app()
+        client = app.test_client()
 
     # Примеры использования:
     call_ping(client)
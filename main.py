@@ -2,10 +2,10 @@ from flask import Flask
 from flask_cors import CORS
 from admin_routes import register_admin_routes
 
-def create_app() -> Flask:
+def create_app(config_path: str = "config.yaml") -> Flask:
     app = Flask(__name__)
     CORS(app)
-    register_admin_routes(app, config_path="config.yaml")
+    register_admin_routes(app, config_path=config_path)
     return app
 
 if __name__ == "__main__":
@@ -11,6 +11,8 @@ from transformers import pipeline
 from config_models import AnswerGeneratorConfig
 from config_models import QuantizationMode
 from config_models import GenerationMode
+from .compute import resources
+from .metrics import STAGE_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -151,18 +153,20 @@ class AnswerGenerator:
 
     def generate_response(self, prompt):
         try:
-            self._adjust_max_new_tokens(prompt)
-            inputs = self.text_tokenizer(prompt, return_tensors="pt")
-            
-            inputs = {
-                k: v.to(dtype=torch.int64 if k == "input_ids" else torch.float32).to(self.device)
-                for k, v in inputs.items()
-            }
-            outputs = self.text_model.generate(
-                inputs["input_ids"], 
-                attention_mask=inputs["attention_mask"], 
-                **self.generation_config
-            )
+            with STAGE_SECONDS.time(stage="tokenize"):
+                self._adjust_max_new_tokens(prompt)
+                inputs = self.text_tokenizer(prompt, return_tensors="pt")
+
+                inputs = {
+                    k: v.to(dtype=torch.int64 if k == "input_ids" else torch.float32).to(self.device)
+                    for k, v in inputs.items()
+                }
+            with resources.slot("generator", device=self.device):
+                outputs = self.text_model.generate(
+                    inputs["input_ids"], 
+                    attention_mask=inputs["attention_mask"], 
+                    **self.generation_config
+                )
             input_len = inputs["input_ids"].shape[1]
             generated_ids = outputs[0][input_len:]
             answer = self.text_tokenizer.decode(generated_ids, skip_special_tokens=True).strip()
@@ -0,0 +1,433 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from datetime import timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .chunk_text_store import ChunkTextStore
+from .file_metadata_db import FileMetadataDB
+from .metrics import INGESTED_CHUNKS
+
+logger = logging.getLogger(__name__)
+
+# Параметры MinHash: 64 хэш-функции вида (a*x + b) mod p над 32-битными хэшами шинглов
+_MINHASH_PERMUTATIONS = 64
+_MINHASH_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(20240601)
+_MINHASH_A = _rng.integers(1, 2 ** 31, size=_MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _rng.integers(0, 2 ** 31, size=_MINHASH_PERMUTATIONS, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+_HASH_ID_RE = re.compile(r"[0-9a-f]{32}")
+_LEGACY_ID_RE = re.compile(r"_chunk(\d+)$")
+# Имена однократных миграций: векторы, записанные до таблицы chunks, и метаданные владельца
+LEGACY_MIGRATION = "legacy_vectors"
+OWNER_MIGRATION = "vector_owners"
+# Префикс ключей тегов в метаданных вектора: {"tag:<тег>": True}
+TAG_PREFIX = "tag:"
+# Сколько общих векторов, попавших в область только через «чужой» файл,
+# перебирается точно за один поиск; остальные в этом поиске не участвуют
+SHARED_SEARCH_LIMIT = 2000
+
+
+def chunk_hash(text: str) -> str:
+    """Хэш текста фрагмента (128 бит, hex)."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def minhash_signature(text: str, shingle_size: int = 3) -> np.ndarray:
+    """MinHash-подпись текста по шинглам из *shingle_size* слов (регистр и пунктуация не учитываются)."""
+    words = _WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    x = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=4).digest(), "little") for sh in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    return ((np.outer(x, _MINHASH_A) + _MINHASH_B) % _MINHASH_PRIME).min(axis=0)
+
+
+def estimate_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Оценка сходства Жаккара по двум MinHash-подписям."""
+    return float(np.mean(a == b))
+
+
+def build_filters(
+    *,
+    file_ids: Optional[Iterable[int]] = None,
+    mime_types: Optional[Iterable[str]] = None,
+    tags: Optional[Iterable[str]] = None,
+    uploaded_after: Optional[float] = None,
+    uploaded_before: Optional[float] = None,
+) -> Optional[dict]:
+    """
+    Область поиска для ChunkIndex.search: фрагменты из любого из *file_ids*,
+    с любым из *tags* и *mime_types*, загруженные в интервале (unix-время).
+    Условия разных видов объединяются через «и»; None — искать везде.
+    """
+    scope = {}
+    if file_ids:
+        scope["file_ids"] = sorted({int(i) for i in file_ids})
+    if mime_types:
+        scope["mime_types"] = sorted(set(mime_types))
+    if tags:
+        normalized = FileMetadataDB.split_tags(FileMetadataDB.join_tags(tags))
+        if normalized:
+            scope["tags"] = normalized
+    if uploaded_after is not None:
+        scope["uploaded_after"] = float(uploaded_after)
+    if uploaded_before is not None:
+        scope["uploaded_before"] = float(uploaded_before)
+    return scope or None
+
+
+def scope_where(scope: dict) -> dict:
+    """
+    Фильтр Chroma для области *scope* (см. build_filters) по метаданным
+    владельца вектора. Условие на uploaded_at отсекает шарды режима time.
+    """
+    conditions = []
+    if scope.get("file_ids"):
+        conditions.append({"file_id": {"$in": scope["file_ids"]}})
+    if scope.get("mime_types"):
+        conditions.append({"mime_type": {"$in": scope["mime_types"]}})
+    tags = [{TAG_PREFIX + t: {"$eq": True}} for t in scope.get("tags", ())]
+    if tags:
+        conditions.append(tags[0] if len(tags) == 1 else {"$or": tags})
+    if scope.get("uploaded_after") is not None:
+        conditions.append({"uploaded_at": {"$gte": scope["uploaded_after"]}})
+    if scope.get("uploaded_before") is not None:
+        conditions.append({"uploaded_at": {"$lte": scope["uploaded_before"]}})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _legacy_position(vector_id: str) -> Tuple[int, str]:
+    match = _LEGACY_ID_RE.search(vector_id)
+    return (int(match.group(1)) if match else 0, vector_id)
+
+
+class ChunkIndex:
+    """
+    Индексация документа по фрагментам с учётом уже сохранённого.
+
+    Таблица chunks хранит для каждого файла порядок фрагментов, хэши их
+    текста и id векторов. id вектора — хэш текста, поэтому одинаковый
+    фрагмент (колонтитул, юридическая оговорка, шаблонная страница) хранится
+    в векторном хранилище один раз, а список документов, где он встречается,
+    — это строки chunks с тем же vector_id. Эмбеддинг считается только для
+    текста, которого ещё нет ни в одном документе; вектор удаляется, когда
+    на него не ссылается ни один фрагмент.
+
+    Каждая индексация файла пишет фрагменты новым поколением: сначала
+    в хранилище добавляются недостающие векторы, затем одной транзакцией
+    вставляются строки поколения и переключается File.active_generation.
+    Поиск видит либо старый набор фрагментов, либо новый, и не видит
+    документ пустым ни в какой момент. Старое поколение удаляет фоновый
+    сборщик мусора: строки chunks по (file_id, generation) и векторы по
+    списку id, на которые больше никто не ссылается, — без сканирования
+    метаданных хранилища.
+
+    Текст фрагмента хранится в ChunkTextStore под id вектора, в векторном
+    хранилище его нет. В метаданных вектора лежат имя, id, время загрузки,
+    тип и теги его владельца — файла с наименьшим id среди ссылающихся
+    на фрагмент активными поколениями. Они переписываются, когда владелец
+    меняется (индексация и удаление файлов) или меняются его теги (set_tags).
+    Область поиска (см. build_filters) проверяется фильтром Chroma по этим
+    метаданным внутри поиска по индексу; общие векторы, которые попадают
+    в область только через другой файл, search добирает точным перебором
+    по списку из таблицы chunks (не более SHARED_SEARCH_LIMIT).
+    """
+
+    def __init__(self, metadata_db, storage, embedder, background_gc: bool = True,
+                 text_store: Optional[ChunkTextStore] = None):
+        self.metadata_db = metadata_db
+        self.storage = storage
+        self.embedder = embedder
+        self.text_store = text_store or ChunkTextStore(metadata_db.session_factory)
+        self._gc_queue: Set[int] = set()
+        self._gc_cond = threading.Condition()
+        self._gc_stopped = False
+        self._gc_thread = None
+        # Решение «вектор больше не нужен» и появление новых ссылок на него не должны пересекаться
+        self._refs_lock = threading.Lock()
+        if background_gc:
+            # Поколения, оставшиеся после прерванной работы, собираются при старте
+            self._gc_queue.update(self.metadata_db.get_files_with_stale_chunks())
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="chunk-gc", daemon=True)
+            self._gc_thread.start()
+
+    @staticmethod
+    def vector_id(h: str) -> str:
+        return h
+
+    def index_document(self, file_id: int, source: str, chunks: Iterable[str],
+                       reembed: bool = False, fingerprint: Optional[str] = None) -> Dict[str, int]:
+        """
+        Записать *chunks* новым активным поколением файла.
+
+        При *reembed* эмбеддинги пересчитываются для всех фрагментов
+        (например, после смены модели). *fingerprint* сохраняется в записи
+        файла в той же транзакции, что и переключение поколения. Возвращает число добавленных
+        и сохранённых векторов и число векторов, выведенных из документа.
+        """
+        old_ids = {vid for _, _, vid in self.metadata_db.get_chunks(file_id)}
+        rec = self.metadata_db.get_file_record(file_id) or {"id": file_id, "name": source}
+
+        rows = []
+        texts = {}
+        for position, chunk in enumerate(chunks):
+            h = chunk_hash(chunk)
+            vid = self.vector_id(h)
+            rows.append((position, h, vid))
+            texts.setdefault(vid, chunk)
+
+        existing = set() if reembed else self.metadata_db.get_referenced_vectors(texts)
+        # Все новые фрагменты ставятся в очередь сразу, чтобы эмбеддер считал их пачками
+        pending = {
+            vid: (chunk, self.embedder.embed_async(chunk))
+            for vid, chunk in texts.items() if vid not in existing
+        }
+
+        base = self._owner_metadata(rec)
+        ids = list(pending)
+        self._store(base, ids, [chunk for chunk, _ in pending.values()],
+                    [future.result() for _, future in pending.values()])
+        with self._refs_lock:
+            # Пока считались эмбеддинги, сборщик мусора мог удалить вектор,
+            # на который ссылалось только старое поколение другого файла
+            reused = texts.keys() - pending.keys()
+            lost = sorted(reused - self.metadata_db.get_referenced_vectors(reused))
+            if lost:
+                self._store(base, lost, [texts[vid] for vid in lost],
+                            [self.embedder.embed_async(texts[vid]).result() for vid in lost])
+                ids.extend(lost)
+            generation = self.metadata_db.add_chunk_generation(file_id, rows, fingerprint)
+            # Файл мог стать владельцем общих векторов или перестать им быть,
+            # а у его собственных — смениться тип и теги
+            self._sync_owners(texts.keys() | old_ids)
+        self.schedule_gc(file_id)
+
+        stats = {"added": len(ids), "kept": len(texts) - len(ids), "retired": len(old_ids - texts.keys())}
+        for state, count in stats.items():
+            INGESTED_CHUNKS.inc(count, state=state)
+        logger.info("Индексация %s (поколение %d): %s", source, generation, stats)
+        return stats
+
+    def delete_document(self, file_id: int, source: str) -> int:
+        """Удалить векторы и фрагменты файла; возвращает число удалённых векторов."""
+        with self._refs_lock:
+            ids = set(self.metadata_db.delete_chunks(file_id))
+            removed = self._unreferenced(ids)
+            self._delete_vectors(removed)
+            self._sync_owners(ids.difference(removed))
+        return len(removed)
+
+    def set_tags(self, file_id: int, tags: Iterable[str]) -> List[str]:
+        """Заменить теги файла и в метаданных векторов, которыми он владеет; возвращает нормализованный список."""
+        with self._refs_lock:
+            tags = self.metadata_db.set_file_tags(file_id, tags)
+            self._sync_owners(vid for _, _, vid in self.metadata_db.get_chunks(file_id))
+        return tags
+
+    def migrate(self) -> None:
+        """Однократные миграции данных индекса (при запуске)."""
+        self.migrate_legacy_vectors()
+        self.migrate_owner_metadata()
+
+    def migrate_legacy_vectors(self) -> None:
+        """
+        Однократно привязать к таблице chunks векторы, записанные до её появления.
+
+        Такие векторы (id вида ``<имя>_chunk<i>``, текст в метаданных) находятся
+        только сканированием метаданных хранилища, поэтому скан выполняется один
+        раз: векторы документа записываются фрагментами его активного поколения,
+        тексты переносятся в ChunkTextStore, и дальше векторы выводятся обычной
+        переиндексацией, удалением и сборкой мусора.
+        Векторы без файла и векторы с id-хэшем, на которые не ссылается ни один
+        фрагмент (остатки прерванной индексации), удаляются.
+        """
+        if self.metadata_db.is_migration_applied(LEGACY_MIGRATION):
+            return
+        by_source: Dict[str, List[str]] = {}
+        contents: Dict[str, str] = {}
+        orphans: List[str] = []
+        for ids, metadatas in self.storage.iter_metadata():
+            known = self.metadata_db.get_referenced_vectors(ids)
+            for vid, meta in zip(ids, metadatas):
+                if vid in known:
+                    continue
+                if _HASH_ID_RE.fullmatch(vid):
+                    orphans.append(vid)
+                else:
+                    by_source.setdefault(meta.get("source") or "", []).append(vid)
+                    if meta.get("content"):
+                        contents[vid] = meta["content"]
+        adopted = 0
+        for source, ids in by_source.items():
+            rec = self.metadata_db.get_file_by_name(source) if source else None
+            if rec is None:
+                orphans.extend(ids)
+                continue
+            self.text_store.put({vid: contents[vid] for vid in ids if vid in contents})
+            self.metadata_db.adopt_chunks(rec["id"], sorted(ids, key=_legacy_position))
+            adopted += len(ids)
+        with self._refs_lock:
+            self._delete_vectors(self._unreferenced(orphans))
+        self.metadata_db.mark_migration_applied(LEGACY_MIGRATION)
+        logger.info("Миграция векторов старой схемы: привязано %d, удалено %d", adopted, len(orphans))
+
+    def migrate_owner_metadata(self) -> None:
+        """Однократно записать тип и теги владельца в метаданные векторов, сохранённых без них."""
+        if self.metadata_db.is_migration_applied(OWNER_MIGRATION):
+            return
+        updated = 0
+        with self._refs_lock:
+            for batch in self.metadata_db.iter_active_vector_ids():
+                updated += self._sync_owners(batch)
+        self.metadata_db.mark_migration_applied(OWNER_MIGRATION)
+        logger.info("Миграция метаданных владельцев: обновлено векторов %d", updated)
+
+    def search(self, query_embedding: np.ndarray, top_k: int, scope: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        Поиск ближайших фрагментов в области *scope* (см. build_filters).
+        Векторы, владелец которых подходит под область, ищутся по индексу
+        с фильтром scope_where. Общие векторы, подходящие только через другой
+        файл, выбираются из таблиц chunks и files и перебираются точно.
+        """
+        if not scope:
+            return self.storage.search_similar(query_embedding, top_k=top_k)
+        hits = self.storage.search_similar(query_embedding, top_k=top_k, filters=scope_where(scope))
+        shared = self.metadata_db.get_shared_scope_vectors(
+            file_ids=scope.get("file_ids"),
+            mime_types=scope.get("mime_types"),
+            tags=scope.get("tags"),
+            uploaded_after=scope.get("uploaded_after"),
+            uploaded_before=scope.get("uploaded_before"),
+            limit=SHARED_SEARCH_LIMIT + 1,
+        )
+        if len(shared) > SHARED_SEARCH_LIMIT:
+            logger.warning("Общих векторов в области поиска больше %d, часть не просматривается",
+                           SHARED_SEARCH_LIMIT)
+        ids = list(shared)[:SHARED_SEARCH_LIMIT]
+        if ids:
+            # Метаданные владельца указывают шард каждого вектора
+            hits = hits + self.storage.search_among(
+                query_embedding, top_k, ids, [self._owner_metadata(shared[vid]) for vid in ids])
+        best: Dict[str, float] = {}
+        for vid, score in hits:
+            best[vid] = max(score, best.get(vid, score))
+        return sorted(best.items(), key=lambda hit: -hit[1])[:top_k]
+
+    @property
+    def gc_depth(self) -> int:
+        """Файлов в очереди фоновой сборки мусора."""
+        with self._gc_cond:
+            return len(self._gc_queue)
+
+    def schedule_gc(self, file_id: int) -> None:
+        """Поставить неактивные поколения файла в очередь на удаление."""
+        if self._gc_thread is None:
+            self.collect(file_id)
+            return
+        with self._gc_cond:
+            self._gc_queue.add(file_id)
+            self._gc_cond.notify()
+
+    def collect(self, file_id: int) -> int:
+        """Удалить неактивные поколения файла и осиротевшие векторы; возвращает число векторов."""
+        with self._refs_lock:
+            stale = set(self.metadata_db.delete_stale_chunks(file_id))
+            removed = self._unreferenced(stale)
+            self._delete_vectors(removed)
+        if removed:
+            logger.debug("Сборка мусора файла %s: удалено векторов %d", file_id, len(removed))
+        return len(removed)
+
+    def close(self) -> None:
+        """Остановить сборщик мусора, дождавшись очереди."""
+        with self._gc_cond:
+            self._gc_stopped = True
+            self._gc_cond.notify()
+        if self._gc_thread is not None and self._gc_thread is not threading.current_thread():
+            self._gc_thread.join(timeout=30.0)
+
+    def _gc_loop(self) -> None:
+        while True:
+            with self._gc_cond:
+                while not self._gc_queue and not self._gc_stopped:
+                    self._gc_cond.wait()
+                if not self._gc_queue:
+                    return
+                file_id = self._gc_queue.pop()
+            try:
+                self.collect(file_id)
+            except Exception as e:
+                logger.error("Ошибка сборки мусора для файла %s: %s", file_id, e)
+
+    def texts(self, vector_ids: Iterable[str]) -> Dict[str, str]:
+        """Полные тексты фрагментов одним запросом; id без записи в результат не попадают."""
+        return self.text_store.get(vector_ids)
+
+    def sources(self, vector_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Имена файлов, в активных поколениях которых есть каждый из фрагментов.
+        Пустой список — фрагмент остался только в старом поколении и ещё
+        не удалён сборщиком мусора; такие результаты поиска пропускаются.
+        """
+        return self.metadata_db.get_chunk_sources(vector_ids)
+
+    @staticmethod
+    def _owner_metadata(rec: dict) -> dict:
+        """Метаданные вектора, которым владеет файл *rec* (запись FileMetadataDB)."""
+        created = rec.get("created_at")
+        metadata = {
+            "source": rec["name"],
+            "file_id": rec["id"],
+            # created_at пишется SQLite в UTC без часового пояса
+            "uploaded_at": created.replace(tzinfo=timezone.utc).timestamp() if created else time.time(),
+            "mime_type": rec.get("file_type") or "unknown",
+        }
+        metadata.update({TAG_PREFIX + tag: True for tag in rec.get("tags", ())})
+        return metadata
+
+    def _sync_owners(self, vector_ids: Iterable[str]) -> int:
+        """
+        Переписать метаданные векторов, у которых сменился владелец или его
+        данные; возвращает число переписанных. Векторы без активных ссылок
+        не трогаются — их удалит сборщик мусора.
+        """
+        vector_ids = sorted(set(vector_ids))
+        updated = 0
+        for i in range(0, len(vector_ids), 1000):
+            owners = self.metadata_db.get_vector_owners(vector_ids[i:i + 1000])
+            current = self.storage.get_metadatas(list(owners))
+            ids, metadatas = [], []
+            for vid, rec in owners.items():
+                meta = current.get(vid)
+                if meta is None:
+                    continue
+                desired = self._owner_metadata(rec)
+                # Chroma не удаляет ключи при обновлении: теги прежнего состава сбрасываются в False
+                desired.update({k: False for k, v in meta.items()
+                                if k.startswith(TAG_PREFIX) and v and k not in desired})
+                if any(meta.get(k) != v for k, v in desired.items()):
+                    ids.append(vid)
+                    metadatas.append(desired)
+            self.storage.update_metadata(ids, metadatas)
+            updated += len(ids)
+        return updated
+
+    def _store(self, base: dict, ids: List[str], chunks: List[str], embeddings: list) -> None:
+        # Текст пишется раньше вектора: найденный поиском вектор всегда имеет текст
+        self.text_store.put(dict(zip(ids, chunks)))
+        self.storage.add_embeddings(ids, embeddings, [base] * len(ids))
+
+    def _delete_vectors(self, vector_ids: List[str]) -> None:
+        self.storage.delete_embeddings(vector_ids)
+        self.text_store.delete(vector_ids)
+
+    def _unreferenced(self, vector_ids: Iterable[str]) -> List[str]:
+        vector_ids = set(vector_ids)
+        return sorted(vector_ids - self.metadata_db.get_referenced_vectors(vector_ids))
@@ -0,0 +1,65 @@
+import logging
+import zlib
+from typing import Dict, Iterable
+
+from sqlalchemy import insert
+
+from .models import ChunkText
+
+logger = logging.getLogger(__name__)
+
+# Короткие фрагменты сжатие не уменьшает, их хранят как есть
+_MIN_COMPRESS_BYTES = 256
+
+
+class ChunkTextStore:
+    """
+    Тексты фрагментов в таблице chunk_texts, ключ — id вектора.
+
+    В векторном хранилище остаются только id и поля для фильтрации; текст
+    найденных фрагментов читается отсюда одним запросом на весь top-k.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def put(self, texts: Dict[str, str]) -> None:
+        rows = [self._encode(vid, text) for vid, text in texts.items()]
+        if not rows:
+            return
+        with self.session_factory() as session:
+            # Замена существующих записей: удаление и вставка в одной транзакции
+            for i in range(0, len(rows), 500):
+                batch = rows[i:i + 500]
+                (session.query(ChunkText)
+                 .filter(ChunkText.vector_id.in_([r["vector_id"] for r in batch]))
+                 .delete(synchronize_session=False))
+                session.execute(insert(ChunkText), batch)
+
+    def get(self, vector_ids: Iterable[str]) -> Dict[str, str]:
+        vector_ids = list(set(vector_ids))
+        result: Dict[str, str] = {}
+        with self.session_factory() as session:
+            for i in range(0, len(vector_ids), 500):
+                rows = (session.query(ChunkText.vector_id, ChunkText.compressed, ChunkText.data)
+                        .filter(ChunkText.vector_id.in_(vector_ids[i:i + 500])))
+                for vid, compressed, data in rows:
+                    result[vid] = (zlib.decompress(data) if compressed else data).decode("utf-8")
+        return result
+
+    def delete(self, vector_ids: Iterable[str]) -> None:
+        vector_ids = list(set(vector_ids))
+        with self.session_factory() as session:
+            for i in range(0, len(vector_ids), 500):
+                (session.query(ChunkText)
+                 .filter(ChunkText.vector_id.in_(vector_ids[i:i + 500]))
+                 .delete(synchronize_session=False))
+
+    @staticmethod
+    def _encode(vector_id: str, text: str) -> dict:
+        raw = text.encode("utf-8")
+        if len(raw) >= _MIN_COMPRESS_BYTES:
+            packed = zlib.compress(raw, 6)
+            if len(packed) < len(raw):
+                return {"vector_id": vector_id, "compressed": True, "data": packed}
+        return {"vector_id": vector_id, "compressed": False, "data": raw}
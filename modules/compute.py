@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from config_models import ComputeConfig
+
+logger = logging.getLogger(__name__)
+
+try:
+    import torch
+except ModuleNotFoundError:
+    torch = None
+
+WORKLOADS = ("chat", "ingestion")
+MODELS = ("embedding", "generator", "captioner")
+
+
+class _ThreadPool:
+    """Счётчик потоков одного бюджета: вызов модели занимает n потоков или ждёт."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.in_use = 0
+        self.active_calls = 0
+        self.waits = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int) -> None:
+        with self._cond:
+            if self.in_use + n > self.size:
+                self.waits += 1
+                while self.in_use + n > self.size:
+                    self._cond.wait()
+            self.in_use += n
+            self.active_calls += 1
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self.in_use -= n
+            self.active_calls -= 1
+            self._cond.notify_all()
+
+
+class ComputeResources:
+    """
+    Распределяет процессорные потоки между моделями и видами нагрузки.
+
+    Потоки машины (*total_threads*) делятся на бюджеты чата и индексации.
+    Каждый вызов модели (см. slot) занимает в бюджете своей нагрузки
+    столько потоков, сколько выделено модели; если бюджет исчерпан, вызов
+    ждёт. torch.set_num_threads — настройка всего процесса (действует
+    значение последнего вызова), поэтому она лишь подсказка, а ограничение
+    обеспечивает сам допуск вызовов по бюджету. Так сумма
+    потоков одновременно работающих моделей не превышает число ядер.
+    Нагрузка задаётся контекстом workload() в потоке, по умолчанию — чат.
+    """
+
+    def __init__(self, config: Optional[ComputeConfig] = None):
+        self._local = threading.local()
+        self._set_config(config or ComputeConfig())
+
+    def configure(self, config: ComputeConfig) -> None:
+        """Применить настройки из config.yaml, в том числе к пулам потоков torch."""
+        self._set_config(config)
+        self._apply_torch_settings()
+        logger.info(
+            "Потоки CPU: всего %d, чат %d, индексация %d, модели %s",
+            self.total_threads, self.budgets["chat"], self.budgets["ingestion"], self.model_threads,
+        )
+
+    def _set_config(self, config: ComputeConfig) -> None:
+        self.config = config
+        self.total_threads = config.total_threads or os.cpu_count() or 1
+        chat = min(self.total_threads, max(1, round(self.total_threads * config.chat_share)))
+        self.budgets = {
+            "chat": chat,
+            "ingestion": max(1, self.total_threads - chat),
+        }
+        self._pools = {name: _ThreadPool(size) for name, size in self.budgets.items()}
+        self.model_threads = {
+            "embedding": config.embedding_threads,
+            "generator": config.generator_threads,
+            "captioner": config.captioner_threads,
+        }
+
+    def _apply_torch_settings(self) -> None:
+        if torch is None:
+            return
+        try:
+            # Межоперационный пул можно задать только до первой параллельной операции
+            torch.set_num_interop_threads(max(1, self.config.interop_threads))
+        except RuntimeError as e:
+            logger.debug("Межоперационные потоки torch уже заданы: %s", e)
+        torch.set_num_threads(self.budgets["chat"])
+
+    def threads_for(self, model: str, workload: Optional[str] = None) -> int:
+        budget = self.budgets[workload or self.current_workload()]
+        wanted = self.model_threads.get(model, 0)
+        return min(wanted, budget) if wanted > 0 else budget
+
+    def busy(self, workload: str) -> bool:
+        """Выполняется ли сейчас хотя бы один вызов модели в нагрузке *workload*."""
+        return self._pools[workload].active_calls > 0
+
+    def current_workload(self) -> str:
+        return getattr(self._local, "workload", "chat")
+
+    @contextmanager
+    def workload(self, name: str) -> Iterator[None]:
+        """Отнести вызовы моделей в этом потоке к нагрузке *name*."""
+        if name not in self.budgets:
+            raise ValueError(f"Неизвестный вид нагрузки: {name}")
+        previous = self.current_workload()
+        self._local.workload = name
+        try:
+            yield
+        finally:
+            self._local.workload = previous
+
+    @contextmanager
+    def slot(self, model: str, workload: Optional[str] = None, device=None) -> Iterator[int]:
+        """Выполнить вызов *model* в пределах бюджета; отдаёт число потоков."""
+        if device is not None and str(device).startswith("cuda"):
+            # Модели на GPU процессорный бюджет не расходуют
+            yield 0
+            return
+        workload = workload or self.current_workload()
+        n = self.threads_for(model, workload)
+        pool = self._pools[workload]
+        pool.acquire(n)
+        try:
+            if torch is not None:
+                # Глобально для процесса: параллельный вызов другой нагрузки может перезаписать
+                torch.set_num_threads(n)
+            yield n
+        finally:
+            pool.release(n)
+
+    def report(self) -> Dict[str, object]:
+        """Настроенные бюджеты и фактическая занятость потоков."""
+        return {
+            "cpu_count": os.cpu_count(),
+            "total_threads": self.total_threads,
+            "interop_threads": torch.get_num_interop_threads() if torch is not None else None,
+            "models": {model: {w: self.threads_for(model, w) for w in WORKLOADS} for model in MODELS},
+            "workloads": {
+                name: {
+                    "budget": pool.size,
+                    "threads_in_use": pool.in_use,
+                    "active_calls": pool.active_calls,
+                    "max_parallel_calls": {m: pool.size // self.threads_for(m, name) for m in MODELS},
+                    "waits": pool.waits,
+                }
+                for name, pool in self._pools.items()
+            },
+        }
+
+
+resources = ComputeResources()
@@ -1,29 +1,145 @@
 import os
-from sqlalchemy import create_engine
+import logging
+from pathlib import Path
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from contextlib import contextmanager
 from .models import Base
+from config_models import SqliteTuningConfig
+
+logger = logging.getLogger(__name__)
+
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORE = {"DEFAULT", "FILE", "MEMORY"}
+
+
+def sqlite_pragmas(tuning: SqliteTuningConfig) -> list[str]:
+    """Собрать список PRAGMA для профиля производительности SQLite."""
+    journal_mode = tuning.journal_mode.upper()
+    synchronous = tuning.synchronous.upper()
+    temp_store = tuning.temp_store.upper()
+    if journal_mode not in _JOURNAL_MODES:
+        raise ValueError(f"Недопустимый journal_mode: {tuning.journal_mode}")
+    if synchronous not in _SYNCHRONOUS:
+        raise ValueError(f"Недопустимый synchronous: {tuning.synchronous}")
+    if temp_store not in _TEMP_STORE:
+        raise ValueError(f"Недопустимый temp_store: {tuning.temp_store}")
+    return [
+        f"PRAGMA journal_mode={journal_mode}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA busy_timeout={int(tuning.busy_timeout_ms)}",
+        # Отрицательное значение cache_size задаётся в KiB, а не в страницах
+        f"PRAGMA cache_size={-int(tuning.cache_size_kb)}",
+        f"PRAGMA mmap_size={int(tuning.mmap_size_mb) * 1024 * 1024}",
+        f"PRAGMA temp_store={temp_store}",
+    ]
+
 
 class DBManager:
     def __init__(self, db_config, echo: bool = False):
         database_url = db_config.url
+        is_sqlite = database_url.startswith("sqlite")
+        is_memory = is_sqlite and (
+            database_url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in database_url
+        )
 
         # Если SQLite — гарантируем наличие каталога
-        if database_url.startswith("sqlite:///"):
+        if database_url.startswith("sqlite:///") and not is_memory:
             db_path = database_url.replace("sqlite:///", "")
             db_dir = os.path.dirname(db_path)
             if db_dir:
                 os.makedirs(db_dir, exist_ok=True)
 
+        tuning = getattr(db_config, "sqlite", None) or SqliteTuningConfig()
+        connect_args = {}
+        engine_kwargs = {}
+        if is_sqlite:
+            connect_args = {
+                "check_same_thread": False,
+                "timeout": tuning.busy_timeout_ms / 1000,
+                "cached_statements": tuning.cached_statements,
+            }
+        if not is_memory:
+            # Для in-memory SQLite используется SingletonThreadPool без этих параметров
+            engine_kwargs = {
+                "pool_size": getattr(db_config, "pool_size", 10),
+                "max_overflow": getattr(db_config, "max_overflow", 20),
+                "pool_timeout": getattr(db_config, "pool_timeout", 30.0),
+                "pool_pre_ping": not is_sqlite,
+            }
+
         self.engine = create_engine(
             database_url,
-            connect_args={"check_same_thread": False} if database_url.startswith("sqlite") else {},
-            echo=echo
+            connect_args=connect_args,
+            echo=echo,
+            **engine_kwargs
         )
+        if is_sqlite:
+            pragmas = sqlite_pragmas(tuning)
+
+            @event.listens_for(self.engine, "connect")
+            def _apply_pragmas(dbapi_conn, _record):
+                cursor = dbapi_conn.cursor()
+                try:
+                    for pragma in pragmas:
+                        cursor.execute(pragma)
+                finally:
+                    cursor.close()
+
+            logger.info("SQLite профиль: %s", ", ".join(p.split(" ", 1)[1] for p in pragmas))
         self.Session = scoped_session(sessionmaker(bind=self.engine))
 
     def init_db(self):
         Base.metadata.create_all(bind=self.engine)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        """
+        Дополняет таблицы, созданные старыми версиями, новыми колонками и индексами.
+        create_all не изменяет существующие таблицы, поэтому делаем это вручную.
+        """
+        columns = {c["name"] for c in inspect(self.engine).get_columns("files")}
+        with self.engine.begin() as conn:
+            if "name" not in columns:
+                conn.execute(text("ALTER TABLE files ADD COLUMN name VARCHAR"))
+                logger.info("Добавлена колонка files.name")
+            for column in ("name", "file_type", "size", "splitter_method", "created_at"):
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_files_{column} ON files ({column})"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_dialogs_user_id_id ON dialogs (user_id, id)"))
+            if "active_generation" not in columns:
+                conn.execute(text("ALTER TABLE files ADD COLUMN active_generation INTEGER NOT NULL DEFAULT 0"))
+                logger.info("Добавлена колонка files.active_generation")
+            if "index_fingerprint" not in columns:
+                conn.execute(text("ALTER TABLE files ADD COLUMN index_fingerprint VARCHAR"))
+                logger.info("Добавлена колонка files.index_fingerprint")
+            if "tags" not in columns:
+                conn.execute(text("ALTER TABLE files ADD COLUMN tags VARCHAR"))
+                logger.info("Добавлена колонка files.tags")
+            chunk_columns = {c["name"] for c in inspect(self.engine).get_columns("chunks")}
+            if "generation" not in chunk_columns:
+                conn.execute(text("ALTER TABLE chunks ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"))
+                logger.info("Добавлена колонка chunks.generation")
+            conn.execute(text("DROP INDEX IF EXISTS ix_chunks_file_id_position"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_chunks_file_id_generation_position "
+                "ON chunks (file_id, generation, position)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chunks_vector_id ON chunks (vector_id)"))
+            image_columns = {c["name"] for c in inspect(self.engine).get_columns("images")}
+            for column, ddl in (("file_hash", "VARCHAR(64)"), ("caption_model", "VARCHAR")):
+                if column not in image_columns:
+                    conn.execute(text(f"ALTER TABLE images ADD COLUMN {column} {ddl}"))
+                    logger.info("Добавлена колонка images.%s", column)
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_images_file_hash_caption_model ON images (file_hash, caption_model)"))
+            rows = conn.execute(text("SELECT id, path FROM files WHERE name IS NULL")).fetchall()
+            for file_id, path in rows:
+                conn.execute(
+                    text("UPDATE files SET name = :name WHERE id = :id"),
+                    {"name": Path(path).name, "id": file_id},
+                )
+            if rows:
+                logger.info("Заполнено имя для %d записей files", len(rows))
 
     @contextmanager
     def session_scope(self):
@@ -1,27 +1,239 @@
+import atexit
+import datetime as dt
+import hashlib
 import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from .metrics import cache_lookup
 from .models import Dialog
+from config_models import DialogHistoryConfig
 
 logger = logging.getLogger(__name__)
 
+
+class HistoryWriteBuffer:
+    """
+    Буфер отложенной записи истории: записи копятся в памяти и сбрасываются
+    фоновым потоком одной многострочной вставкой каждые *flush_batch_size*
+    записей или *flush_interval_ms* миллисекунд.
+    """
+
+    def __init__(self, session_factory, config: DialogHistoryConfig):
+        self.session_factory = session_factory
+        self.batch_size = max(1, config.flush_batch_size)
+        self.interval = max(1, config.flush_interval_ms) / 1000
+        self._pending: List[dict] = []
+        self._inflight: List[dict] = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._worker_loop, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, record: dict) -> None:
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Буфер истории остановлен")
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def snapshot(self, user_id: str) -> List[dict]:
+        """Несохранённые записи пользователя в порядке добавления."""
+        with self._cond:
+            return [r for r in self._inflight + self._pending if r["user_id"] == user_id]
+
+    def flush(self) -> int:
+        """Синхронно записать всё накопленное. Возвращает число записей."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+                self._inflight = batch
+            if not batch:
+                return 0
+            try:
+                with self.session_factory() as session:
+                    session.execute(insert(Dialog), batch)
+            except Exception:
+                with self._cond:
+                    # Возвращаем записи в начало очереди, чтобы повторить позже
+                    self._pending = batch + self._pending
+                    self._inflight = []
+                raise
+            with self._cond:
+                self._inflight = []
+            logger.debug("Сохранено %d записей диалога", len(batch))
+            return len(batch)
+
+    def close(self) -> None:
+        """Остановить фоновый поток и сбросить остаток буфера."""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout=5.0)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("Не удалось сохранить историю при остановке: %s", e)
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending) + len(self._inflight)
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.interval)
+                stopped = self._stopped
+            if stopped:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Ошибка фоновой записи истории: %s", e)
+                with self._cond:
+                    self._cond.wait(self.interval)
+
+
+class RecentHistoryCache:
+    """
+    LRU-кэш последних реплик: для каждого пользователя — кольцевой буфер
+    из *turns* записей. Пополняется при сохранении только для уже
+    закэшированных пользователей; остальные подгружаются из БД при чтении.
+    """
+
+    def __init__(self, turns: int, max_users: int):
+        self.turns = turns
+        self.max_users = max(1, max_users)
+        self._users: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Защита от гонки «чтение из БД — сохранение — запись в кэш»
+        self._seq = 0
+        self._loading: Dict[str, int] = {}
+        self._changed: Dict[str, int] = {}
+
+    def get(self, user_id: str) -> Optional[List[dict]]:
+        with self._lock:
+            turns = self._users.get(user_id)
+            if turns is None:
+                return None
+            self._users.move_to_end(user_id)
+            return list(turns)
+
+    def begin_load(self, user_id: str) -> int:
+        with self._lock:
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            return self._seq
+
+    def finish_load(self, user_id: str, entries: List[dict], token: int) -> None:
+        with self._lock:
+            stale = self._changed.get(user_id, 0) > token
+            self._loading[user_id] -= 1
+            if not self._loading[user_id]:
+                del self._loading[user_id]
+                self._changed.pop(user_id, None)
+            if stale or user_id in self._users:
+                return
+            self._users[user_id] = deque(entries[-self.turns:], maxlen=self.turns)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def append(self, user_id: str, entry: dict) -> None:
+        with self._lock:
+            self._mark_changed(user_id)
+            turns = self._users.get(user_id)
+            if turns is not None:
+                turns.append(entry)
+
+    def reset(self, user_id: str) -> None:
+        """Пометить историю пользователя пустой (после удаления)."""
+        with self._lock:
+            self._mark_changed(user_id)
+            if user_id in self._users:
+                self._users[user_id].clear()
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._mark_changed(user_id)
+            self._users.pop(user_id, None)
+
+    def _mark_changed(self, user_id: str) -> None:
+        self._seq += 1
+        if user_id in self._loading:
+            self._changed[user_id] = self._seq
+
+
 class DialogHistory:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, config: Optional[DialogHistoryConfig] = None):
         """
         session_factory — функция, возвращающая контекстный менеджер SQLAlchemy-сессии.
         Обычно это DBManager.session_scope
+        config — настройки отложенной записи и кэша; без них запись синхронная, без кэша.
         """
         self.session_factory = session_factory
+        self.config = config
+        self.buffer = (
+            HistoryWriteBuffer(session_factory, config)
+            if config is not None and config.write_behind else None
+        )
+        self.cache = (
+            RecentHistoryCache(config.cache_turns, config.cache_max_users)
+            if config is not None and config.cache_turns > 0 else None
+        )
 
     def save(self, user_id: str, user_text: str, assistant_text: str) -> None:
-        with self.session_factory() as session:
-            dialog = Dialog(
-                user_id=user_id.strip(),
-                user_text=user_text.strip(),
-                assistant_text=assistant_text.strip()
-            )
-            session.add(dialog)
-            logger.debug("Сохранён диалог: %s -> %s", user_text.strip(), assistant_text.strip())
+        record = {
+            "user_id": user_id.strip(),
+            # Время задаём сами (UTC, как CURRENT_TIMESTAMP), чтобы запись из буфера
+            # совпадала со строкой в БД после сброса
+            "timestamp": dt.datetime.now(dt.timezone.utc).replace(tzinfo=None),
+            "user_text": user_text.strip(),
+            "assistant_text": assistant_text.strip(),
+        }
+        if self.buffer is not None:
+            self.buffer.append(record)
+        else:
+            with self.session_factory() as session:
+                session.add(Dialog(**record))
+        if self.cache is not None:
+            self.cache.append(record["user_id"], self._to_entry(record))
+        logger.debug("Сохранён диалог: %s -> %s", record["user_text"], record["assistant_text"])
 
     def fetch_latest(self, user_id: str, limit: int = 30) -> list[dict]:
+        if self.cache is None or limit > self.cache.turns:
+            return self._fetch_from_db(user_id, limit)
+        entries = self.cache.get(user_id)
+        cache_lookup("history", entries is not None)
+        if entries is None:
+            token = self.cache.begin_load(user_id)
+            try:
+                entries = self._fetch_from_db(user_id, self.cache.turns)
+            finally:
+                self.cache.finish_load(user_id, entries if entries is not None else [], token)
+        return entries[-limit:] if limit > 0 else []
+
+    def fetch_latest_with_etag(self, user_id: str, limit: int = 30) -> Tuple[list[dict], str]:
+        """Вернуть последние записи и ETag, зависящий только от их содержимого."""
+        entries = self.fetch_latest(user_id, limit)
+        digest = hashlib.sha1()
+        for e in entries:
+            digest.update(f"{e['timestamp']}\x1f{e['user']}\x1f{e['assistant']}\x1e".encode("utf-8"))
+        return entries, digest.hexdigest()
+
+    def _fetch_from_db(self, user_id: str, limit: int) -> list[dict]:
+        # Снимок буфера берём до запроса к БД: запись, сброшенная между ними,
+        # окажется в обоих источниках и будет отброшена как дубликат, но не потеряна
+        pending = self.buffer.snapshot(user_id) if self.buffer is not None else []
         with self.session_factory() as session:
             rows = (session.query(Dialog)
                     .filter(Dialog.user_id == user_id)
@@ -29,12 +241,37 @@ class DialogHistory:
                     .limit(limit)
                     .all())
             logger.debug("Получено %d записей диалога для пользователя %s", len(rows), user_id)
-            return [
+            entries = [
                 {"timestamp": r.timestamp, "user": r.user_text, "assistant": r.assistant_text}
                 for r in reversed(rows)
             ]
+        if pending:
+            stored = {(e["timestamp"], e["user"], e["assistant"]) for e in entries}
+            entries += [
+                self._to_entry(r)
+                for r in pending
+                if (r["timestamp"], r["user_text"], r["assistant_text"]) not in stored
+            ]
+        return entries[-limit:] if limit > 0 else []
 
     def clear_user_history(self, user_id: str) -> None:
+        if self.buffer is not None:
+            # Иначе записи из буфера вернутся в БД уже после удаления
+            self.buffer.flush()
         with self.session_factory() as session:
             deleted = session.query(Dialog).filter(Dialog.user_id == user_id).delete()
-            logger.info("Удалено %d записей истории для пользователя %s", deleted, user_id)
\ No newline at end of file
+            logger.info("Удалено %d записей истории для пользователя %s", deleted, user_id)
+        if self.cache is not None:
+            self.cache.reset(user_id)
+
+    def flush(self) -> None:
+        if self.buffer is not None:
+            self.buffer.flush()
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.buffer.close()
+
+    @staticmethod
+    def _to_entry(record: dict) -> dict:
+        return {"timestamp": record["timestamp"], "user": record["user_text"], "assistant": record["assistant_text"]}
@@ -4,13 +4,15 @@ import logging
 import time
 import uuid
 from io import BytesIO
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from modules.embedding_handler import EmbeddingHandler
 from modules.embedding_storage import EmbeddingStorage
 from modules.answer_generator import AnswerGenerator
 from modules.speech_processor import SpeechProcessor
 from modules.dialog_history import DialogHistory
+from modules.chunk_index import ChunkIndex, estimate_jaccard, minhash_signature
+from modules.metrics import ANSWER_SECONDS, STAGE_SECONDS
 from config_models import DialogManagerConfig
 
 logger = logging.getLogger(__name__)
@@ -23,23 +25,26 @@ class DialogManager:
         generator: AnswerGenerator,
         speech: SpeechProcessor,
         history: DialogHistory,
-        config: DialogManagerConfig
+        config: DialogManagerConfig,
+        chunk_index: Optional[ChunkIndex] = None,
     ) -> None:
         self.embedder  = embedder
         self.storage   = storage
         self.generator = generator
         self.speech    = speech
         self.history   = history
+        self.chunk_index = chunk_index
 
         self.config                 = config
         self.prompt_template        = config.prompt_template
         self.show_text_source_info  = config.show_text_source_info
         self.show_text_fragments    = config.show_text_fragments
+        self.near_duplicate_threshold = config.near_duplicate_threshold
 
         self._msg_empty  = config.messages.empty_storage
         self._msg_no_ctx = config.messages.no_contexts_found
 
-    def answer_text(self, user_id: str, question: str, *, top_k: int = 3, request_source_info: Optional[bool] = None, request_fragments: Optional[bool] = None) -> dict:
+    def answer_text(self, user_id: str, question: str, *, top_k: int = 3, request_source_info: Optional[bool] = None, request_fragments: Optional[bool] = None, filters: Optional[Dict] = None) -> dict:
         req_id = uuid.uuid4().hex[:8]
         start = time.perf_counter()
         
@@ -49,31 +54,72 @@ class DialogManager:
         
         emb_start = time.perf_counter()
         q_emb = self.embedder.get_text_embedding(question)
-        logger.debug("[%s] Embedding generated in %.2f s", req_id, time.perf_counter() - emb_start)
+        elapsed = time.perf_counter() - emb_start
+        STAGE_SECONDS.observe(elapsed, stage="embed")
+        logger.debug("[%s] Embedding generated in %.2f s", req_id, elapsed)
         
         search_start = time.perf_counter()
-        hits: List[Tuple[str, float]] = self.storage.search_similar(q_emb, top_k=top_k)
-        logger.debug("[%s] Search completed in %.2f s", req_id, time.perf_counter() - search_start)
+        # С запасом: часть найденного может оказаться почти дубликатами
+        fetch_k = top_k * 2 if self.near_duplicate_threshold > 0 else top_k
+        hits: List[Tuple[str, float]]
+        if filters and self.chunk_index:
+            # Область поиска (см. chunk_index.build_filters) проверяется внутри поиска по индексу
+            hits = self.chunk_index.search(q_emb, fetch_k, filters)
+        else:
+            hits = self.storage.search_similar(q_emb, top_k=fetch_k)
+        elapsed = time.perf_counter() - search_start
+        STAGE_SECONDS.observe(elapsed, stage="search")
+        logger.debug("[%s] Search completed in %.2f s", req_id, elapsed)
         
         if not hits:
             return {"answer": self._msg_no_ctx}
         
-        contexts: List[str] = []
-        sources: List[str] = []
+        fetch_start = time.perf_counter()
+        # Одинаковый текст хранится одним вектором; документы, где он встречается, — в таблице chunks
+        hit_ids = [doc_id for doc_id, _ in hits]
+        refs = self.chunk_index.sources(hit_ids) if self.chunk_index else {}
+        texts = self.chunk_index.texts(hit_ids) if self.chunk_index else {}
+        kept: List[Tuple[str, str, Optional[str]]] = []
+        signatures = []
         for doc_id, _ in hits:
-            _, meta = self.storage.get_embedding_with_metadata(doc_id)
-            if meta and meta.get("content"):
-                contexts.append(meta["content"])
-            if meta and meta.get("source"):
-                sources.append(meta["source"])
+            if refs.get(doc_id) == []:
+                # Фрагмент остался только в старом поколении документа и ждёт сборки мусора
+                continue
+            content, source = texts.get(doc_id), None
+            if content is None:
+                # Векторы, записанные до хранилища текстов, держат начало текста в метаданных
+                _, meta = self.storage.get_embedding_with_metadata(doc_id)
+                if not meta or not meta.get("content"):
+                    continue
+                content, source = meta["content"], meta.get("source")
+            if self.near_duplicate_threshold > 0:
+                sig = minhash_signature(content)
+                if any(estimate_jaccard(sig, s) >= self.near_duplicate_threshold for s in signatures):
+                    continue
+                signatures.append(sig)
+            kept.append((doc_id, content, source))
+            if len(kept) == top_k:
+                break
+
+        contexts: List[str] = [content for _, content, _ in kept]
+        sources: List[str] = []
+        for doc_id, _, source in kept:
+            for name in refs.get(doc_id) or [source]:
+                if name and name not in sources:
+                    sources.append(name)
+        STAGE_SECONDS.observe(time.perf_counter() - fetch_start, stage="metadata_fetch")
         
         if not contexts:
             return {"answer": self._msg_no_ctx}
         
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            prompt = self.prompt_template.format(context="\n\n".join(contexts), question=question.strip())
         gen_start = time.perf_counter()
-        prompt = self.prompt_template.format(context="\n\n".join(contexts), question=question.strip())
+        # Включает токенизацию, которую генератор учитывает отдельно как этап tokenize
         answer = self._trim(self.generator.generate_response(prompt))
-        logger.debug("[%s] Response generated in %.2f s", req_id, time.perf_counter() - gen_start)
+        elapsed = time.perf_counter() - gen_start
+        STAGE_SECONDS.observe(elapsed, stage="generate")
+        logger.debug("[%s] Response generated in %.2f s", req_id, elapsed)
         
         response = {"answer": answer}
         if self.show_text_fragments and (request_fragments is not False):
@@ -81,8 +127,11 @@ class DialogManager:
         if self.show_text_source_info and (request_source_info is not False):
             response["sources"] = sources
         
-        self.history.save(user_id=user_id, user_text=question, assistant_text=answer)
-        logger.info("[%s] answered in %.2f s", req_id, time.perf_counter() - start)
+        with STAGE_SECONDS.time(stage="history_save"):
+            self.history.save(user_id=user_id, user_text=question, assistant_text=answer)
+        elapsed = time.perf_counter() - start
+        ANSWER_SECONDS.observe(elapsed)
+        logger.info("[%s] answered in %.2f s", req_id, elapsed)
         
         return response
     
@@ -132,7 +181,8 @@ class DialogManager:
         storage: EmbeddingStorage = None,
         generator: AnswerGenerator = None,
         speech: SpeechProcessor = None,
-        config: DialogManagerConfig = None
+        config: DialogManagerConfig = None,
+        chunk_index: ChunkIndex = None,
     ) -> None:
         if embedder:
             self.embedder = embedder
@@ -142,11 +192,14 @@ class DialogManager:
             self.generator = generator
         if speech:
             self.speech = speech
+        if chunk_index:
+            self.chunk_index = chunk_index
         if config:
             self.config                 = config
             self.prompt_template        = config.prompt_template
             self.show_text_source_info  = config.show_text_source_info
             self.show_text_fragments    = config.show_text_fragments
+            self.near_duplicate_threshold = config.near_duplicate_threshold
             self._msg_empty  = config.messages.empty_storage
             self._msg_no_ctx = config.messages.no_contexts_found
 
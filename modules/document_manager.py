@@ -4,11 +4,13 @@ import logging
 import mimetypes
 import time
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Union
 
-from .file_processor import FileProcessor
-from .image_captioner import ImageCaptioner
+from .file_processor import EXTRACTOR_VERSION, FileProcessor
+from .image_captioner import ImageCaptioner, bare_caption, with_filename
 from .file_metadata_db import FileMetadataDB
+from .text_cache import ExtractedTextCache
+from .metrics import CACHE_REQUESTS, cache_lookup
 from config_models import DocumentManagerConfig
 
 logger = logging.getLogger(__name__)
@@ -33,12 +35,83 @@ class DocumentManager:
     def get_files(self, extension: Optional[str] = None) -> List[str]:
         return self.db.get_files_by_extension(extension)
 
-    def get_text(self, file_path: Union[str, Path]) -> Optional[str]:
+    @property
+    def caption_model(self) -> Optional[str]:
+        captioner = self.processor.image_processor
+        return captioner.model_name if captioner is not None else None
+
+    def _is_captioned_image(self, file_path: Union[str, Path]) -> bool:
+        return (self.processor.image_processor is not None
+                and self.config.processing.image_enabled
+                and self.processor.is_image(file_path))
+
+    def get_text(self, file_path: Union[str, Path], file_hash: Optional[str] = None) -> Optional[str]:
+        if self._is_captioned_image(file_path):
+            # Описание изображения берём из кэша (таблица images), если модель та же
+            file_hash = file_hash or self.get_hash(file_path)
+            cached = self.db.get_cached_captions([file_hash], self.caption_model).get(file_hash)
+            cache_lookup("caption", cached is not None)
+            if cached is not None:
+                logger.debug("Описание %s взято из кэша", file_path)
+                return with_filename(Path(file_path).name, bare_caption(cached))
+        elif self.text_cache is not None:
+            # Разобранный текст документа — из дискового кэша, без повторного парсинга
+            file_hash = file_hash or self.get_hash(file_path)
+            cached = self.text_cache.get(file_hash) if file_hash else None
+            cache_lookup("text", cached is not None)
+            if cached is not None:
+                logger.debug("Текст %s взят из кэша", file_path)
+                return cached
         start = time.perf_counter()
         text = self.processor.extract_text(file_path)
         logger.debug("extract_text(%s) — %.3f s", file_path, time.perf_counter() - start)
+        if text and file_hash and self.text_cache is not None and not self._is_captioned_image(file_path):
+            self.text_cache.put(file_hash, text)
         return text
 
+    def forget_text(self, file_hash: Optional[str]) -> None:
+        """Удалить извлечённый текст файла из кэша."""
+        if file_hash and self.text_cache is not None:
+            self.text_cache.discard(file_hash)
+
+    def get_image_texts(self, file_paths: Iterable[Union[str, Path]],
+                        hashes: Optional[Dict[Path, str]] = None) -> Dict[Path, Optional[str]]:
+        """Описания изображений: из кэша, остальные — одним пакетом через модель."""
+        images = [Path(p) for p in file_paths if self._is_captioned_image(p)]
+        if not images:
+            return {}
+        hashes = hashes or {}
+        image_hashes = {p: hashes.get(p) or self.get_hash(p) for p in images}
+        cached = self.db.get_cached_captions(image_hashes.values(), self.caption_model)
+        # В кэше — описание без имени: то же изображение могло быть загружено под другим именем
+        texts: Dict[Path, Optional[str]] = {
+            p: with_filename(p.name, bare_caption(cached[h])) for p, h in image_hashes.items() if h in cached
+        }
+        missing = [p for p in images if p not in texts]
+        CACHE_REQUESTS.inc(len(texts), cache="caption", result="hit")
+        CACHE_REQUESTS.inc(len(missing), cache="caption", result="miss")
+        start = time.perf_counter()
+        texts.update(self.processor.extract_image_texts(missing))
+        logger.debug("extract_image_texts: %d из кэша, %d описано за %.3f s",
+                     len(images) - len(missing), len(missing), time.perf_counter() - start)
+        return texts
+
+    def remember_caption(self, file_id: int, file_path: Union[str, Path], file_hash: str,
+                         caption: Optional[str]) -> None:
+        """Сохранить описание изображения (без имени файла) и миниатюру в кэш (таблица images)."""
+        if not caption or not file_hash or not self._is_captioned_image(file_path):
+            return
+        caption = bare_caption(caption)
+        model = self.caption_model
+        if self.db.get_cached_captions([file_hash], model).get(file_hash) == caption:
+            return
+        try:
+            info = self.processor.image_processor.image_info(file_path)
+        except Exception as e:
+            logger.warning("Не удалось построить миниатюру %s: %s", file_path, e)
+            info = {}
+        self.db.save_image_caption(file_id, file_hash=file_hash, caption_model=model, caption=caption, **info)
+
     def get_metadata(self, file_path: Union[str, Path]) -> dict:
         return self.processor.get_metadata(file_path)
 
@@ -61,6 +134,11 @@ class DocumentManager:
         logger.info("DocumentManager: config updated")
 
     def _build_processor(self, cfg: DocumentManagerConfig) -> None:
+        cache_cfg = cfg.text_cache
+        self.text_cache = (
+            ExtractedTextCache(cache_cfg.cache_dir, EXTRACTOR_VERSION, cache_cfg.compression)
+            if cache_cfg.enabled else None
+        )
         image_proc = None
         if cfg.processing.image_enabled:
             image_proc = ImageCaptioner(cfg.captioning)
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# encode(texts, normalize, workload)
+EncodeFn = Callable[[List[str], bool, str], Sequence[np.ndarray]]
+
+
+def _length_bucket(text: str) -> int:
+    # Границы корзин — степени двойки длины текста: в одном batch тексты
+    # различаются по длине не больше чем вдвое, паддинг невелик
+    return len(text).bit_length()
+
+
+class _Lane:
+    """Очередь и поток-диспетчер одного вида нагрузки."""
+
+    def __init__(self, encode: EncodeFn, workload: str, max_batch_size: int, max_wait: float):
+        self.encode = encode
+        self.workload = workload
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._buckets: Dict[Tuple[bool, int], List[Tuple[str, Future]]] = {}
+        self._depth = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._worker_loop, name=f"embedding-batcher-{workload}", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, normalize: bool) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Сервис эмбеддингов остановлен")
+            bucket = self._buckets.setdefault((normalize, _length_bucket(text)), [])
+            bucket.append((text, future))
+            self._depth += 1
+            if self._depth == 1 or len(bucket) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def join(self) -> None:
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=30.0)
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return self._depth
+
+    def _take_ready(self) -> List[Tuple[bool, List[Tuple[str, Future]]]]:
+        """Ждать заполнения корзины или истечения окна, затем забрать корзины."""
+        with self._cond:
+            while not self._depth and not self._stopped:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while not self._stopped:
+                if any(len(b) >= self.max_batch_size for b in self._buckets.values()):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            ready = []
+            for (normalize, _), items in sorted(self._buckets.items()):
+                for i in range(0, len(items), self.max_batch_size):
+                    ready.append((normalize, items[i:i + self.max_batch_size]))
+            self._buckets = {}
+            self._depth = 0
+            return ready
+
+    def _run_batch(self, normalize: bool, items: List[Tuple[str, Future]]) -> None:
+        items = [(text, f) for text, f in items if f.set_running_or_notify_cancel()]
+        if not items:
+            return
+        try:
+            embeddings = self.encode([text for text, _ in items], normalize, self.workload)
+        except Exception as e:
+            logger.error("Ошибка вычисления эмбеддингов для batch из %d текстов: %s", len(items), e)
+            for _, f in items:
+                f.set_exception(e)
+            return
+        for (_, f), emb in zip(items, embeddings):
+            f.set_result(emb)
+
+    def _worker_loop(self) -> None:
+        while True:
+            batches = self._take_ready()
+            if not batches:
+                return
+            for normalize, items in batches:
+                self._run_batch(normalize, items)
+            logger.debug("Эмбеддинги (%s): %d batch, размеры %s",
+                         self.workload, len(batches), [len(b) for _, b in batches])
+
+
+class EmbeddingBatcher:
+    """
+    Микро-батчинг запросов эмбеддингов из разных потоков.
+
+    Вызывающие потоки получают Future. У каждого вида нагрузки (чат,
+    индексация) своя очередь и свой поток-диспетчер: он ждёт новые запросы
+    до *max_wait_ms* миллисекунд после первого, раскладывает их по корзинам
+    длины и для каждой корзины выполняет один вызов *encode*. Корзина,
+    набравшая *max_batch_size* запросов, отправляется сразу. Так вызов,
+    ждущий потоков в бюджете чата (например, пока идёт генерация ответа),
+    не задерживает batch индексации, и наоборот.
+    """
+
+    def __init__(self, encode: EncodeFn, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.encode = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._lanes: Dict[str, _Lane] = {}
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def submit(self, text: str, normalize: bool = True, workload: str = "chat") -> Future:
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("Сервис эмбеддингов остановлен")
+            lane = self._lanes.get(workload)
+            if lane is None:
+                lane = self._lanes[workload] = _Lane(self.encode, workload, self.max_batch_size, self.max_wait)
+        return lane.submit(text, normalize)
+
+    def close(self) -> None:
+        """Остановить диспетчеры; оставшиеся запросы будут выполнены."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            lanes = list(self._lanes.values())
+        for lane in lanes:
+            lane.stop()
+        for lane in lanes:
+            lane.join()
+
+    @property
+    def depth(self) -> int:
+        with self._lock:
+            lanes = list(self._lanes.values())
+        return sum(lane.depth for lane in lanes)
@@ -2,10 +2,13 @@ import torch
 import numpy as np
 import logging
 
+from concurrent.futures import Future
 from sentence_transformers import SentenceTransformer
 from typing import List, Union
 
 from config_models import EmbeddingHandlerConfig
+from .compute import resources
+from .embedding_batcher import EmbeddingBatcher
 
 logger = logging.getLogger(__name__)
 
@@ -15,11 +18,16 @@ class EmbeddingHandler:
         self.model_path = config.model_path
         self.device = self._get_device(config.device)
         self.model = self._load_model()
+        self.batcher = self._create_batcher()
 
     def update_config(self, new_config: EmbeddingHandlerConfig) -> None:
+        old_config = self.config
         if (
-            self.config.model_path != new_config.model_path or
-            self.config.device     != new_config.device
+            self.config.model_path     != new_config.model_path or
+            self.config.device         != new_config.device or
+            self.config.backend        != new_config.backend or
+            self.config.onnx_quantize  != new_config.onnx_quantize or
+            self.config.onnx_cache_dir != new_config.onnx_cache_dir
         ):
             self.config     = new_config
             self.model_path = new_config.model_path
@@ -27,35 +35,119 @@ class EmbeddingHandler:
             self.model      = self._load_model()
         else:
             self.config = new_config
+        if (
+            old_config.batching_enabled   != new_config.batching_enabled or
+            old_config.max_batch_size     != new_config.max_batch_size or
+            old_config.batch_max_wait_ms  != new_config.batch_max_wait_ms
+        ):
+            old_batcher  = self.batcher
+            self.batcher = self._create_batcher()
+            if old_batcher is not None:
+                old_batcher.close()
+
+    def close(self) -> None:
+        """Остановить диспетчер batch-запросов."""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def _create_batcher(self) -> Union[EmbeddingBatcher, None]:
+        if not self.config.batching_enabled:
+            return None
+        return EmbeddingBatcher(self._encode, self.config.max_batch_size, self.config.batch_max_wait_ms)
 
     def _get_device(self, device: Union[str, None]) -> torch.device:
         if device:
             return torch.device(device)
         return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    def _load_model(self) -> SentenceTransformer:
+    def _load_model(self):
         model = SentenceTransformer(self.model_path)
+        if self.config.backend == "onnx":
+            return self._load_onnx(model)
         model.to(self.device)
         logger.info("Загружена модель эмбеддингов %s на %s", self.model_path, self.device)
         return model
 
+    def _load_onnx(self, source: SentenceTransformer):
+        """
+        ONNX Runtime (CPU) вместо PyTorch. Если экспорт не удался или
+        эмбеддинги расходятся с PyTorch-моделью сильнее onnx_min_cosine,
+        остаётся PyTorch-модель.
+        """
+        source.to("cpu")
+        try:
+            from .onnx_encoder import PARITY_PROBES, OnnxSentenceEncoder, parity
+            encoder = OnnxSentenceEncoder(
+                source, self.model_path, self.config.onnx_cache_dir, self.config.onnx_quantize,
+                num_threads=resources.threads_for("embedding", "chat"))
+            with torch.no_grad():
+                reference = source.encode(PARITY_PROBES, convert_to_numpy=True, normalize_embeddings=True)
+            score = parity(reference, encoder.encode(PARITY_PROBES))
+        except Exception as e:
+            logger.error("ONNX-бэкенд недоступен (%s), используется PyTorch", e)
+            source.to(self.device)
+            return source
+        if score < self.config.onnx_min_cosine:
+            logger.error(
+                "ONNX-модель расходится с PyTorch: косинус %.4f < %.4f, используется PyTorch",
+                score, self.config.onnx_min_cosine)
+            source.to(self.device)
+            return source
+        self.device = torch.device("cpu")
+        logger.info("Загружена ONNX-модель эмбеддингов %s (косинус с PyTorch %.4f)", self.model_path, score)
+        return encoder
+
+    @property
+    def backend(self) -> str:
+        """Фактический бэкенд: "onnx" или "torch" (в т.ч. после отката)."""
+        return "torch" if isinstance(self.model, SentenceTransformer) else "onnx"
+
+    @property
+    def tokenizer(self):
+        """Токенизатор модели (для разбиения текста по токенам)."""
+        return self.model.tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.max_seq_length
+
+    def embed_async(self, text: str, normalize: bool = True) -> Future:
+        """Поставить текст в очередь микро-батчинга; результат — в Future."""
+        if self.batcher is None:
+            future: Future = Future()
+            future.set_result(self._encode_single(text, normalize))
+            return future
+        return self.batcher.submit(text, normalize, resources.current_workload())
+
     def get_text_embedding(self, text: str, normalize: bool = True) -> np.ndarray:
-        with torch.no_grad():
-            embedding = self.model.encode(
-                text,
-                convert_to_tensor=True,
-                device=self.device,
-                normalize_embeddings=normalize
-            )
-            return embedding.cpu().numpy()
+        if self.batcher is not None:
+            return self.batcher.submit(text, normalize, resources.current_workload()).result()
+        return self._encode_single(text, normalize)
+
+    def _encode_single(self, text: str, normalize: bool) -> np.ndarray:
+        return self._run_encode(text, 32, normalize)
 
     def get_batch_embeddings(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        return list(self._run_encode(texts, batch_size, True))
+
+    def _encode(self, texts: List[str], normalize: bool, workload: str) -> List[np.ndarray]:
+        # Тексты одной корзины близки по длине, поэтому весь список — один batch
+        return list(self._run_encode(texts, len(texts), normalize, workload))
+
+    def _run_encode(self, texts: Union[str, List[str]], batch_size: int, normalize: bool,
+                    workload: Union[str, None] = None) -> np.ndarray:
+        with resources.slot("embedding", workload, self.device):
+            if self.backend == "onnx":
+                return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=normalize)
+            return self._torch_encode(texts, batch_size, normalize)
+
+    def _torch_encode(self, texts: Union[str, List[str]], batch_size: int, normalize: bool) -> np.ndarray:
         with torch.no_grad():
             embeddings = self.model.encode(
                 texts,
                 batch_size=batch_size,
                 convert_to_tensor=True,
                 device=self.device,
-                normalize_embeddings=True
+                normalize_embeddings=normalize
             )
-            return [emb.cpu().numpy() for emb in embeddings]
+            return embeddings.cpu().numpy()
@@ -1,114 +1,384 @@
 import chromadb
+import heapq
 import numpy as np
 import logging
+import threading
 import time
+import zlib
 
 from chromadb.config import Settings
 from chromadb.errors import InvalidCollectionException
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict
+from typing import Any, Iterator, List, Tuple, Optional, Dict
 
 from config_models import EmbeddingStorageConfig
+from .shard_pruning import key_conditions, month_matches, month_start
 
 logger = logging.getLogger(__name__)
 
+SHARD_MODES = ("none", "hash", "time")
+# Метка времени загрузки документа (unix-время) в метаданных вектора
+TIME_KEY = "uploaded_at"
+
+
 class EmbeddingStorage:
+    """
+    Векторное хранилище на ChromaDB, при необходимости разбитое на шарды.
+
+    Шард — отдельная коллекция Chroma. Режимы (shard_by):
+    none — одна коллекция collection_name; hash — shard_count коллекций,
+    шард определяется по id вектора; time — по месяцу TIME_KEY. Поиск
+    рассылается по шардам в пуле потоков, частичные top-k сливаются кучей;
+    шарды, которые не могут удовлетворить фильтру по TIME_KEY, не
+    опрашиваются. Каждый шард можно пересоздать независимо.
+
+    Число шардов режима hash нельзя менять на заполненном хранилище: id
+    попадут в другие коллекции, и прежние векторы не будут найдены ни
+    поиском, ни удалением. При расхождении с коллекциями на диске
+    хранилище не открывается.
+    """
+
     def __init__(self, config: EmbeddingStorageConfig):
         self.config = config
         self.db_path = Path(config.db_path)
         self.collection_name = config.collection_name
         self.embedding_dim = config.embedding_dim
         self.similarity_threshold = config.similarity_threshold
+        self.shard_by = config.shard_by
+        if self.shard_by not in SHARD_MODES:
+            raise ValueError(f"Неизвестный режим шардирования: {self.shard_by}")
 
         self.db_path.mkdir(parents=True, exist_ok=True)
         self.client = chromadb.PersistentClient(
             path=str(self.db_path),
             settings=Settings(allow_reset=True)
         )
+        self._shards_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
         self._init_collection()
-        logger.info("EmbeddingStorage готов: %s/%s", self.db_path, self.collection_name)
+        logger.info("EmbeddingStorage готов: %s/%s, шардов %d (%s)",
+                    self.db_path, self.collection_name, len(self._shards), self.shard_by)
 
     def update_config(self, new_config: EmbeddingStorageConfig) -> None:
         if new_config != self.config:
+            self.close()
             self.__init__(new_config)
         else:
             self.config = new_config
 
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
     def _init_collection(self) -> None:
+        # имя коллекции -> (коллекция, значение ключа шарда)
+        self._shards: Dict[str, Tuple[Any, Any]] = {}
+        if self.shard_by == "none":
+            self._open_shard(self.collection_name, None)
+        elif self.shard_by == "hash":
+            self._check_hash_shards()
+            for i in range(max(1, self.config.shard_count)):
+                self._open_shard(f"{self.collection_name}__h{i}", i)
+        else:
+            prefix = self._shard_prefix()
+            for name in self.client.list_collections():
+                name = getattr(name, "name", name)
+                if name.startswith(prefix):
+                    collection = self.client.get_collection(name)
+                    self._shards[name] = (collection, (collection.metadata or {}).get("shard_value"))
+            if not self._shards:
+                # Пустое хранилище: одна коллекция по умолчанию, чтобы было что опрашивать
+                self._shard_for_value(self._default_value())
+        # Основная коллекция (при шардировании — первый шард) для служебных скриптов
+        self.collection = next(iter(self._shards.values()))[0]
+
+    def _check_hash_shards(self) -> None:
+        # Шард вектора — crc32(id) % числа шардов, поэтому любое изменение числа меняет шард
+        prefix = f"{self.collection_name}__h"
+        on_disk = [
+            name for name in (getattr(c, "name", c) for c in self.client.list_collections())
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        ]
+        expected = {f"{prefix}{i}" for i in range(max(1, self.config.shard_count))}
+        if set(on_disk) == expected:
+            return
+        if any(self.client.get_collection(name).count() for name in on_disk):
+            raise ValueError(
+                f"В {self.db_path} векторы разложены по {len(on_disk)} шардам режима hash, а shard_count = "
+                f"{self.config.shard_count}: верните прежнее значение или удалите коллекции и пересоздайте "
+                f"эмбеддинги (rebuild ?force=1)"
+            )
+        # Хранилище пусто: лишние коллекции прежнего числа шардов не должны мешать следующему запуску
+        for name in set(on_disk) - expected:
+            self.client.delete_collection(name)
+
+    def _shard_prefix(self) -> str:
+        return f"{self.collection_name}__t_"
+
+    def _default_value(self) -> Any:
+        return month_start(time.time()).timestamp()
+
+    def _open_shard(self, name: str, value: Any) -> None:
         try:
-            self.collection = self.client.get_collection(self.collection_name)
+            collection = self.client.get_collection(name)
         except InvalidCollectionException:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={
-                    "hnsw:space": "cosine",
-                    "embedding_dim": str(self.embedding_dim)
-                }
-            )
-            logger.info("Коллекция '%s' создана", self.collection_name)
+            metadata = {"hnsw:space": "cosine", "embedding_dim": str(self.embedding_dim)}
+            if value is not None:
+                metadata["shard_value"] = value
+            collection = self.client.create_collection(name=name, metadata=metadata)
+            logger.info("Коллекция '%s' создана", name)
+        self._shards[name] = (collection, value)
+
+    def _time_shard_name(self, value: float) -> str:
+        return f"{self._shard_prefix()}{month_start(value):%Y%m}"
+
+    def _shard_for_value(self, value: Any) -> str:
+        name = self._time_shard_name(value)
+        value = month_start(value).timestamp()
+        with self._shards_lock:
+            if name not in self._shards:
+                self._open_shard(name, value)
+        return name
+
+    def _shard_for(self, doc_id: str, metadata: dict) -> str:
+        """Имя шарда, в который попадает вектор."""
+        if self.shard_by == "none":
+            return self.collection_name
+        if self.shard_by == "hash":
+            return f"{self.collection_name}__h{zlib.crc32(doc_id.encode('utf-8')) % len(self._shards)}"
+        return self._shard_for_value(metadata.get(TIME_KEY) or time.time())
+
+    def _collection(self, name: str) -> Any:
+        with self._shards_lock:
+            return self._shards[name][0]
+
+    def _collections(self) -> List[Any]:
+        with self._shards_lock:
+            return [collection for collection, _ in self._shards.values()]
+
+    def _ids_by_shard(self, doc_ids: List[str], metadatas: Optional[List[dict]] = None) -> Dict[str, List[str]]:
+        """
+        Сгруппировать id по шардам. В режиме time шард определяется по TIME_KEY
+        из *metadatas*; без них шард по id не определить — все шарды.
+        """
+        if self.shard_by in ("none", "hash"):
+            groups: Dict[str, List[str]] = {}
+            for doc_id in doc_ids:
+                groups.setdefault(self._shard_for(doc_id, {}), []).append(doc_id)
+            return groups
+        with self._shards_lock:
+            names = list(self._shards)
+            if metadatas is None:
+                return {name: list(doc_ids) for name in names}
+            groups = {}
+            for doc_id, metadata in zip(doc_ids, metadatas):
+                value = metadata.get(TIME_KEY)
+                name = self._time_shard_name(value) if value is not None else None
+                # Шарда месяца нет — вектора с такой меткой в хранилище тоже нет
+                for target in ([name] if name else names):
+                    if target in self._shards:
+                        groups.setdefault(target, []).append(doc_id)
+            return groups
+
+    def _prune(self, filters: Optional[Dict]) -> List[Any]:
+        """Шарды, в которых могут найтись векторы, удовлетворяющие *filters*."""
+        if self.shard_by in ("none", "hash"):
+            return self._collections()
+        conditions = key_conditions(filters, TIME_KEY)
+        with self._shards_lock:
+            shards = list(self._shards.values())
+        if not conditions:
+            return [collection for collection, _ in shards]
+        return [collection for collection, value in shards if month_matches(value, conditions)]
 
     def add_embedding(self, doc_id: str, embedding: np.ndarray, metadata: dict = None) -> None:
         if not isinstance(doc_id, str):
             raise TypeError("doc_id должен быть строкой")
+        self.add_embeddings([doc_id], [embedding], [metadata or {}])
 
-        if embedding.shape != (self.embedding_dim,):
-            raise ValueError(f"Неверная размерность вектора: {embedding.shape}. Ожидается: ({self.embedding_dim},)")
-
-        metadata = metadata or {}
-        metadata.setdefault("source", "unknown")
-
-        self.collection.upsert(
-            ids=[doc_id],
-            embeddings=[embedding.tolist()],
-            metadatas=[metadata]
-        )
+    def add_embeddings(self, doc_ids: List[str], embeddings: List[np.ndarray], metadatas: List[dict]) -> None:
+        """Пакетный upsert векторов."""
+        if not doc_ids:
+            return
+        for embedding in embeddings:
+            if embedding.shape != (self.embedding_dim,):
+                raise ValueError(f"Неверная размерность вектора: {embedding.shape}. Ожидается: ({self.embedding_dim},)")
+        groups: Dict[str, Tuple[list, list, list]] = {}
+        for doc_id, embedding, metadata in zip(doc_ids, embeddings, metadatas):
+            metadata = {"source": "unknown", **metadata}
+            ids, embs, metas = groups.setdefault(self._shard_for(doc_id, metadata), ([], [], []))
+            ids.append(doc_id)
+            embs.append(embedding.tolist())
+            metas.append(metadata)
+        if self.shard_by == "time":
+            # Вектор мог раньше попасть в другой шард: удаляем его там по id
+            with self._shards_lock:
+                names = list(self._shards)
+            for name in names:
+                stale = [i for target, (ids, _, _) in groups.items() if target != name for i in ids]
+                if stale:
+                    self._collection(name).delete(ids=stale)
+        for name, (ids, embs, metas) in groups.items():
+            self._collection(name).upsert(ids=ids, embeddings=embs, metadatas=metas)
 
     def search_similar(self, query_embedding: np.ndarray, top_k: int = 5, filters: Optional[Dict] = None) -> List[Tuple[str, float]]:
         start_time = time.time()
         query = query_embedding.tolist()
-        results = self.collection.query(
-            query_embeddings=[query],
-            n_results=min(top_k, self.collection.count()),
-            where=filters,
-            include=["distances"]
-        )
-        logger.debug("Поиск в ChromaDB занял %.2f секунд", time.time() - start_time)
+        shards = self._prune(filters)
+
+        def search_shard(collection) -> List[Tuple[float, str]]:
+            count = collection.count()
+            if count == 0:
+                return []
+            results = collection.query(
+                query_embeddings=[query],
+                n_results=min(top_k, count),
+                where=filters,
+                include=["distances"]
+            )
+            return list(zip(results["distances"][0], results["ids"][0]))
+
+        if len(shards) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.config.search_workers), thread_name_prefix="vector-search")
+            partial = list(self._executor.map(search_shard, shards))
+        else:
+            partial = [search_shard(collection) for collection in shards]
+        merged = heapq.nsmallest(top_k, (hit for hits in partial for hit in hits))
+        logger.debug("Поиск в ChromaDB (%d из %d шардов) занял %.2f секунд",
+                     len(shards), len(self._shards), time.time() - start_time)
         threshold = self.similarity_threshold
         return [
             (doc_id, 1 - distance)
-            for doc_id, distance in zip(results["ids"][0], results["distances"][0])
+            for distance, doc_id in merged
             if (1 - distance) >= threshold
         ]
 
+    def search_among(self, query_embedding: np.ndarray, top_k: int, doc_ids: List[str],
+                     metadatas: Optional[List[dict]] = None) -> List[Tuple[str, float]]:
+        """
+        Точный поиск перебором только среди *doc_ids*: векторы читаются по id,
+        поэтому время растёт с длиной списка, и ограничивать его — забота
+        вызывающего. *metadatas* (с TIME_KEY) указывают шард каждого вектора
+        в режиме time, иначе id ищутся во всех шардах.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scored: List[Tuple[float, str]] = []
+        for name, ids in self._ids_by_shard(list(doc_ids), metadatas).items():
+            collection = self._collection(name)
+            for i in range(0, len(ids), 1000):
+                page = collection.get(ids=ids[i:i + 1000], include=["embeddings"])
+                if not page["ids"]:
+                    continue
+                matrix = np.asarray(page["embeddings"], dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1)
+                norms[norms == 0] = 1.0
+                scores = matrix @ query / norms
+                scored = heapq.nlargest(top_k, scored + list(zip(scores.tolist(), page["ids"])))
+        threshold = self.similarity_threshold
+        return [(doc_id, score) for score, doc_id in scored if score >= threshold]
+
     def get_embedding(self, doc_id: str) -> Optional[np.ndarray]:
-        result = self.collection.get(
-            ids=[doc_id],
-            include=["embeddings"]
-        )
-        return np.array(result["embeddings"][0]) if result["embeddings"] else None
+        embedding, _ = self.get_embedding_with_metadata(doc_id)
+        return embedding
 
     def delete_embedding(self, doc_id: str) -> None:
-        self.collection.delete(ids=[doc_id])
+        self.delete_embeddings([doc_id])
+
+    def delete_embeddings(self, doc_ids: List[str]) -> None:
+        if doc_ids:
+            for name, ids in self._ids_by_shard(doc_ids).items():
+                self._collection(name).delete(ids=ids)
+
+    def get_metadatas(self, doc_ids: List[str]) -> Dict[str, dict]:
+        """Метаданные векторов по id; отсутствующих id в результате нет."""
+        result: Dict[str, dict] = {}
+        for name, ids in self._ids_by_shard(doc_ids).items():
+            collection = self._collection(name)
+            for i in range(0, len(ids), 1000):
+                page = collection.get(ids=ids[i:i + 1000], include=["metadatas"])
+                result.update(zip(page["ids"], (meta or {} for meta in page["metadatas"])))
+        return result
+
+    def update_metadata(self, doc_ids: List[str], metadatas: List[dict]) -> None:
+        """
+        Заменить метаданные векторов (ключи, которых нет в новых, Chroma
+        сохраняет). В режиме time вектор переносится в шард новой метки TIME_KEY.
+        """
+        if not doc_ids:
+            return
+        if self.shard_by != "time":
+            by_id = dict(zip(doc_ids, metadatas))
+            for name, ids in self._ids_by_shard(doc_ids).items():
+                self._collection(name).update(ids=ids, metadatas=[by_id[i] for i in ids])
+            return
+        found: Dict[str, np.ndarray] = {}
+        for name, ids in self._ids_by_shard(doc_ids).items():
+            page = self._collection(name).get(ids=ids, include=["embeddings"])
+            found.update(zip(page["ids"], np.asarray(page["embeddings"], dtype=np.float32)))
+        keep = [(doc_id, meta) for doc_id, meta in zip(doc_ids, metadatas) if doc_id in found]
+        self.add_embeddings([doc_id for doc_id, _ in keep], [found[doc_id] for doc_id, _ in keep],
+                            [meta for _, meta in keep])
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """Все векторы хранилища порциями (id, матрица) — для точного поиска перебором."""
+        for collection in self._collections():
+            offset = 0
+            while True:
+                page = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+                if not page["ids"]:
+                    break
+                yield page["ids"], np.asarray(page["embeddings"], dtype=np.float32)
+                offset += len(page["ids"])
+
+    def iter_metadata(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], List[dict]]]:
+        """Метаданные всех векторов порциями — полный скан, только для однократных миграций."""
+        for collection in self._collections():
+            offset = 0
+            while True:
+                page = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    break
+                yield page["ids"], [meta or {} for meta in page["metadatas"]]
+                offset += len(page["ids"])
 
     def reset_storage(self) -> None:
         self.client.reset()
         self._init_collection()
 
+    def reset_shard(self, name: str) -> None:
+        """Очистить один шард (например, перед его пересозданием)."""
+        with self._shards_lock:
+            collection, value = self._shards[name]
+            self.client.delete_collection(name)
+            del self._shards[name]
+            self._open_shard(name, value)
+        if collection is self.collection:
+            self.collection = self._shards[name][0]
+
     def get_collection_stats(self) -> Dict:
+        with self._shards_lock:
+            counts = {name: collection.count() for name, (collection, _) in self._shards.items()}
         return {
-            "count": self.collection.count(),
+            "count": sum(counts.values()),
             "dimension": self.embedding_dim,
-            "space": "cosine"
+            "space": "cosine",
+            "shards": counts,
         }
 
     def get_embedding_with_metadata(self, doc_id: str) -> Optional[Tuple[np.ndarray, Dict]]:
-        result = self.collection.get(
-            ids=[doc_id],
-            include=["embeddings", "metadatas"]
-        )
-        embeddings = result.get("embeddings", [])
-        metadatas = result.get("metadatas", [])
+        for name in self._ids_by_shard([doc_id]):
+            result = self._collection(name).get(
+                ids=[doc_id],
+                include=["embeddings", "metadatas"]
+            )
+            embeddings = result.get("embeddings", [])
+            metadatas = result.get("metadatas", [])
 
-        if len(embeddings) > 0 and len(metadatas) > 0:
-            return np.array(embeddings[0]), metadatas[0]
+            if len(embeddings) > 0 and len(metadatas) > 0:
+                return np.array(embeddings[0]), metadatas[0]
         return None, None
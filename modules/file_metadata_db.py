@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 import logging
+import math
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional, Callable, ContextManager
+from typing import Dict, Iterable, Iterator, List, Optional, Callable, ContextManager, Tuple
 
-from sqlalchemy import func
+from sqlalchemy import String, and_, distinct, func, insert, literal, not_, or_, tuple_, type_coerce, update
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
-from .models import File, Image
+from .models import Chunk, File, Image, Migration
 
 logger = logging.getLogger(__name__)
 
@@ -31,16 +34,19 @@ class FileMetadataDB:
         size: int,
         file_hash: str,
         splitter_method: Optional[str] = None,
+        tags: Optional[Iterable[str]] = None,
     ) -> Optional[int]:
         path = str(path)
         with self.session_factory() as session:
             try:
                 new_file = File(
                     path=path,
+                    name=Path(path).name,
                     file_type=file_type,
                     size=size,
                     hash=file_hash,
-                    splitter_method=splitter_method
+                    splitter_method=splitter_method,
+                    tags=self.join_tags(tags),
                 )
                 session.add(new_file)
                 session.flush()
@@ -63,6 +69,299 @@ class FileMetadataDB:
         with self.session_factory() as session:
             return session.query(File).filter_by(hash=file_hash).first()
 
+    def get_file_by_name(self, name: str) -> Optional[dict]:
+        """Вернуть запись о файле по имени (без каталога), используя индекс ``name``."""
+        with self.session_factory() as session:
+            file = (
+                session.query(File)
+                .filter(File.name == name)
+                .order_by(File.id)
+                .first()
+            )
+            return self._to_dict(file) if file else None
+
+    def get_files_by_hashes(self, hashes: Iterable[str]) -> Dict[str, dict]:
+        """Вернуть словарь ``hash -> запись`` для уже известных хэшей одним запросом."""
+        hashes = list({h for h in hashes if h})
+        result: Dict[str, dict] = {}
+        with self.session_factory() as session:
+            # Ограничение SQLite на число параметров — запрашиваем порциями
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                for f in session.query(File).filter(File.hash.in_(batch)):
+                    result[f.hash] = self._to_dict(f)
+        return result
+
+    def update_file_content(self, file_id: int, *, file_hash: str, size: int, file_type: str) -> None:
+        """Обновить запись о файле, содержимое которого изменилось (тот же путь, новый хэш)."""
+        with self.session_factory() as session:
+            file = session.get(File, file_id)
+            if file is None:
+                raise KeyError(file_id)
+            file.hash = file_hash
+            file.size = size
+            file.file_type = file_type
+
+    def get_chunks(self, file_id: int) -> List[Tuple[int, str, str]]:
+        """Фрагменты активного поколения файла по порядку: ``(position, chunk_hash, vector_id)``."""
+        with self.session_factory() as session:
+            return [
+                (row.position, row.chunk_hash, row.vector_id)
+                for row in session.query(Chunk.position, Chunk.chunk_hash, Chunk.vector_id)
+                .join(File, File.id == Chunk.file_id)
+                .filter(Chunk.file_id == file_id, Chunk.generation == File.active_generation)
+                .order_by(Chunk.position)
+            ]
+
+    def add_chunk_generation(self, file_id: int, chunks: Iterable[Tuple[int, str, str]],
+                             fingerprint: Optional[str] = None) -> int:
+        """
+        Записать новое поколение фрагментов файла и сделать его активным.
+
+        Вставка строк и переключение File.active_generation выполняются одной
+        транзакцией: читатели видят либо прежний набор фрагментов, либо новый.
+        Вместе с поколением сохраняется отпечаток настроек *fingerprint* — он
+        служит контрольной точкой пересоздания индекса. Возвращает номер
+        нового поколения.
+        """
+        values = {"active_generation": File.active_generation + 1}
+        if fingerprint is not None:
+            values["index_fingerprint"] = fingerprint
+        with self.session_factory() as session:
+            # Номер поколения берётся инкрементом в самой БД первым оператором
+            # транзакции: он захватывает блокировку записи, и две одновременные
+            # индексации файла не получат один номер
+            result = session.execute(update(File).where(File.id == file_id).values(**values))
+            if not result.rowcount:
+                raise KeyError(file_id)
+            generation = session.query(File.active_generation).filter(File.id == file_id).scalar()
+            rows = [
+                {"file_id": file_id, "generation": generation, "position": pos, "chunk_hash": h, "vector_id": vid}
+                for pos, h, vid in chunks
+            ]
+            if rows:
+                session.execute(insert(Chunk), rows)
+            return generation
+
+    def adopt_chunks(self, file_id: int, vector_ids: List[str]) -> None:
+        """
+        Записать векторы старой схемы id фрагментами активного поколения файла
+        (с пустым chunk_hash): дальше они выводятся обычной индексацией и удалением.
+        """
+        with self.session_factory() as session:
+            generation = session.query(File.active_generation).filter(File.id == file_id).scalar()
+            if generation is None:
+                raise KeyError(file_id)
+            start = session.query(func.count(Chunk.id)).filter(
+                Chunk.file_id == file_id, Chunk.generation == generation).scalar()
+            rows = [
+                {"file_id": file_id, "generation": generation, "position": start + i, "chunk_hash": "",
+                 "vector_id": vid}
+                for i, vid in enumerate(vector_ids)
+            ]
+            if rows:
+                session.execute(insert(Chunk), rows)
+
+    def is_migration_applied(self, name: str) -> bool:
+        with self.session_factory() as session:
+            return session.get(Migration, name) is not None
+
+    def mark_migration_applied(self, name: str) -> None:
+        with self.session_factory() as session:
+            if session.get(Migration, name) is None:
+                session.add(Migration(name=name))
+
+    def delete_stale_chunks(self, file_id: int) -> List[str]:
+        """Удалить неактивные поколения фрагментов файла; возвращает их vector_id."""
+        with self.session_factory() as session:
+            active = session.query(File.active_generation).filter(File.id == file_id).scalar()
+            query = session.query(Chunk).filter(Chunk.file_id == file_id)
+            if active is not None:
+                query = query.filter(Chunk.generation != active)
+            vector_ids = [vid for vid, in query.with_entities(Chunk.vector_id).distinct()]
+            query.delete(synchronize_session=False)
+            return vector_ids
+
+    def delete_chunks(self, file_id: int) -> List[str]:
+        """Удалить все фрагменты файла; возвращает их vector_id."""
+        with self.session_factory() as session:
+            query = session.query(Chunk).filter(Chunk.file_id == file_id)
+            vector_ids = [vid for vid, in query.with_entities(Chunk.vector_id).distinct()]
+            query.delete(synchronize_session=False)
+            return vector_ids
+
+    def get_files_with_stale_chunks(self) -> List[int]:
+        """id файлов, у которых остались неактивные поколения фрагментов."""
+        with self.session_factory() as session:
+            rows = (session.query(Chunk.file_id)
+                    .outerjoin(File, File.id == Chunk.file_id)
+                    .filter((File.id.is_(None)) | (Chunk.generation != File.active_generation))
+                    .distinct())
+            return [file_id for file_id, in rows]
+
+    def get_referenced_vectors(self, vector_ids: Iterable[str]) -> set:
+        """Какие из *vector_ids* упоминаются хотя бы одним фрагментом (любого поколения) какого-либо файла."""
+        vector_ids = list(set(vector_ids))
+        found = set()
+        with self.session_factory() as session:
+            for i in range(0, len(vector_ids), 500):
+                rows = (session.query(Chunk.vector_id)
+                        .filter(Chunk.vector_id.in_(vector_ids[i:i + 500]))
+                        .distinct())
+                found.update(vid for vid, in rows)
+        return found
+
+    def get_chunk_sources(self, vector_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Вернуть ``vector_id -> имена файлов``, в активных поколениях которых
+        встречается фрагмент, в порядке добавления файлов. Фрагменты, известные
+        только по неактивным поколениям, получают пустой список; id, которых
+        в таблице chunks нет вовсе, в результат не попадают.
+        """
+        vector_ids = list(set(vector_ids))
+        result: Dict[str, List[str]] = {}
+        with self.session_factory() as session:
+            for i in range(0, len(vector_ids), 500):
+                rows = (session.query(Chunk.vector_id, File.name, Chunk.generation == File.active_generation)
+                        .join(File, File.id == Chunk.file_id)
+                        .filter(Chunk.vector_id.in_(vector_ids[i:i + 500]))
+                        .distinct()
+                        .order_by(File.id))
+                for vid, name, active in rows:
+                    names = result.setdefault(vid, [])
+                    if active and name not in names:
+                        names.append(name)
+        return result
+
+    def get_file_record(self, file_id: int) -> Optional[dict]:
+        """Вернуть запись о файле по id в виде словаря."""
+        with self.session_factory() as session:
+            file = session.get(File, file_id)
+            return self._to_dict(file) if file else None
+
+    def set_file_tags(self, file_id: int, tags: Iterable[str]) -> List[str]:
+        """Заменить теги файла; возвращает нормализованный список."""
+        with self.session_factory() as session:
+            file = session.get(File, file_id)
+            if file is None:
+                raise KeyError(file_id)
+            file.tags = self.join_tags(tags)
+            return self.split_tags(file.tags)
+
+    def get_vector_owners(self, vector_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Вернуть ``vector_id -> запись файла-владельца``. Владелец — файл
+        с наименьшим id среди тех, в активных поколениях которых встречается
+        фрагмент; по нему заполняются метаданные вектора. id без активных
+        ссылок в результат не попадают.
+        """
+        vector_ids = list(set(vector_ids))
+        result: Dict[str, dict] = {}
+        with self.session_factory() as session:
+            for i in range(0, len(vector_ids), 500):
+                owners = (session.query(Chunk.vector_id, func.min(File.id))
+                          .join(File, and_(File.id == Chunk.file_id, Chunk.generation == File.active_generation))
+                          .filter(Chunk.vector_id.in_(vector_ids[i:i + 500]))
+                          .group_by(Chunk.vector_id)
+                          .all())
+                files = {f.id: self._to_dict(f)
+                         for f in session.query(File).filter(File.id.in_({fid for _, fid in owners}))}
+                result.update({vid: files[fid] for vid, fid in owners})
+        return result
+
+    def get_shared_scope_vectors(
+        self,
+        file_ids: Optional[Iterable[int]] = None,
+        mime_types: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+        uploaded_after: Optional[float] = None,
+        uploaded_before: Optional[float] = None,
+        limit: int = 2000,
+    ) -> Dict[str, dict]:
+        """
+        Общие векторы, которые попадают в область поиска только через
+        «чужой» файл: ``vector_id -> запись владельца`` для фрагментов
+        активных поколений файлов, подходящих под условия (любой из
+        *file_ids*, *mime_types*, *tags*, время загрузки в интервале, unix-время;
+        виды условий объединяются через «и»), если сам владелец вектора
+        (см. get_vector_owners) под условия не подходит. Не более *limit* записей.
+        """
+        with self.session_factory() as session:
+            matching = (session.query(Chunk.vector_id)
+                        .join(File, and_(File.id == Chunk.file_id, Chunk.generation == File.active_generation))
+                        .filter(*self._scope_conditions(File, file_ids, mime_types, tags,
+                                                        uploaded_after, uploaded_before)))
+            owners = (session.query(Chunk.vector_id.label("vector_id"), func.min(File.id).label("owner_id"))
+                      .join(File, and_(File.id == Chunk.file_id, Chunk.generation == File.active_generation))
+                      .filter(Chunk.vector_id.in_(matching.scalar_subquery()))
+                      .group_by(Chunk.vector_id)
+                      .having(func.count(distinct(File.id)) > 1)
+                      .subquery())
+            owner = aliased(File)
+            rows = (session.query(owners.c.vector_id, owner)
+                    .join(owner, owner.id == owners.c.owner_id)
+                    .filter(not_(and_(*self._scope_conditions(owner, file_ids, mime_types, tags,
+                                                              uploaded_after, uploaded_before))))
+                    .limit(limit))
+            return {vid: self._to_dict(f) for vid, f in rows}
+
+    def iter_active_vector_ids(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        """id векторов активных поколений всех файлов порциями, по возрастанию."""
+        last = ""
+        while True:
+            with self.session_factory() as session:
+                batch = [vid for vid, in (session.query(Chunk.vector_id)
+                                          .join(File, and_(File.id == Chunk.file_id,
+                                                           Chunk.generation == File.active_generation))
+                                          .filter(Chunk.vector_id > last)
+                                          .distinct()
+                                          .order_by(Chunk.vector_id)
+                                          .limit(batch_size))]
+            if not batch:
+                return
+            yield batch
+            last = batch[-1]
+
+    @classmethod
+    def _scope_conditions(cls, file, file_ids, mime_types, tags, uploaded_after, uploaded_before) -> list:
+        """
+        Условия области поиска на таблицу *file* (File или её псевдоним).
+        Ни одно условие не даёт NULL, поэтому их отрицание тоже однозначно.
+        """
+        conditions = []
+        if file_ids:
+            conditions.append(file.id.in_([int(i) for i in file_ids]))
+        if mime_types:
+            conditions.append(file.file_type.in_(list(mime_types)))
+        normalized = cls.split_tags(cls.join_tags(tags))
+        if normalized:
+            # Теги хранятся одной строкой через запятую: ищем «,тег,» в «,теги,»
+            wrapped = literal(",") + func.coalesce(file.tags, "") + literal(",")
+            conditions.append(or_(*[wrapped.contains(f",{t},", autoescape=True) for t in normalized]))
+        # created_at сравнивается как строка в формате CURRENT_TIMESTAMP: datetime
+        # привязывается строкой с микросекундами и сравнивается неверно
+        created = type_coerce(file.created_at, String)
+        if uploaded_after is not None:
+            conditions.append(file.created_at.isnot(None) & (created >= cls._stored_time(math.ceil(uploaded_after))))
+        if uploaded_before is not None:
+            conditions.append(file.created_at.isnot(None) & (created <= cls._stored_time(math.floor(uploaded_before))))
+        return conditions
+
+    @staticmethod
+    def _stored_time(ts: int) -> str:
+        """Unix-время в виде, в котором SQLite хранит CURRENT_TIMESTAMP (UTC, до секунды)."""
+        return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    @staticmethod
+    def join_tags(tags: Optional[Iterable[str]]) -> Optional[str]:
+        # Запятая — разделитель, поэтому внутри тега не допускается
+        normalized = sorted({t.strip().lower().replace(",", " ") for t in tags or () if t and t.strip()})
+        return ",".join(normalized) or None
+
+    @staticmethod
+    def split_tags(tags: Optional[str]) -> List[str]:
+        return tags.split(",") if tags else []
+
     def get_file_by_id(self, file_id: int) -> Optional[File]:
         """Вернуть объект *File* по его первичному ключу."""
         with self.session_factory() as session:
@@ -91,12 +390,19 @@ class FileMetadataDB:
             return True
 
     def upsert_metadata(self, path: str | Path, metadata: dict) -> int:
+        """
+        Создать или обновить запись о файле по пути. Хэш существующей записи
+        не меняется: он описывает проиндексированное содержимое, и новый хэш
+        записывает только индексация, иначе изменённый файл сочли бы уже
+        обработанным.
+        """
         path = str(path)
         with self.session_factory() as session:
             file = session.query(File).filter_by(path=path).first()
             if file is None:
                 file = File(
                     path=path,
+                    name=Path(path).name,
                     file_type=metadata.get("mime_type", "unknown"),
                     size=metadata.get("size", 0),
                     hash=metadata.get("hash", ""),
@@ -109,8 +415,6 @@ class FileMetadataDB:
                     file.file_type = mime
                 if (size := metadata.get("size")) is not None:
                     file.size = size
-                if (h := metadata.get("hash")):
-                    file.hash = h
                 if (method := metadata.get("splitter_method")):
                     file.splitter_method = method
             return file.id
@@ -138,24 +442,139 @@ class FileMetadataDB:
             session.add(image)
             return True
 
+    def save_image_caption(
+        self,
+        file_id: int,
+        *,
+        file_hash: str,
+        caption_model: str,
+        caption: str,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        thumbnail: Optional[bytes] = None,
+    ) -> None:
+        """Сохранить описание изображения (и миниатюру), заменив прежнее."""
+        with self.session_factory() as session:
+            image = session.get(Image, file_id)
+            if image is None:
+                image = Image(file_id=file_id)
+                session.add(image)
+            image.file_hash = file_hash
+            image.caption_model = caption_model
+            image.caption = caption
+            if width is not None:
+                image.width, image.height, image.thumbnail = width, height, thumbnail
+
+    def get_cached_captions(self, hashes: Iterable[str], caption_model: str) -> Dict[str, str]:
+        """Вернуть ``hash -> описание`` для изображений, уже описанных моделью *caption_model*."""
+        hashes = list({h for h in hashes if h})
+        result: Dict[str, str] = {}
+        with self.session_factory() as session:
+            for i in range(0, len(hashes), 500):
+                rows = (session.query(Image.file_hash, Image.caption)
+                        .filter(Image.file_hash.in_(hashes[i:i + 500]),
+                                Image.caption_model == caption_model,
+                                Image.caption.isnot(None)))
+                result.update({h: caption for h, caption in rows})
+        return result
+
     def get_image_metadata(self, file_id: int) -> Optional[Image]:
         """Вернуть объект *Image* по *file_id*."""
         with self.session_factory() as session:
             return session.get(Image, file_id)
 
+    def get_files_to_rebuild(self, fingerprint: str) -> List[dict]:
+        """Файлы, индекс которых построен не с настройками *fingerprint* (по возрастанию id)."""
+        with self.session_factory() as session:
+            rows = (session.query(File)
+                    .filter((File.index_fingerprint.is_(None)) | (File.index_fingerprint != fingerprint))
+                    .order_by(File.id))
+            return [self._to_dict(f) for f in rows]
+
+    def clear_index_fingerprints(self) -> None:
+        """Сбросить контрольные точки: следующее пересоздание обработает все файлы."""
+        with self.session_factory() as session:
+            session.query(File).update({File.index_fingerprint: None}, synchronize_session=False)
+
     def get_all_files(self):
         with self.session_factory() as session:
-            return [
-                {
-                    "path": f.path,
-                    "size": f.size,
-                    "created_at": f.created_at,
-                    "splitter_method": f.splitter_method,
-                    "file_type": f.file_type,
-                    "file_hash": f.hash,
-                }
-                for f in session.query(File).all()
-            ]
+            return [self._to_dict(f) for f in session.query(File).all()]
+
+    SORTABLE_COLUMNS = {
+        "id": File.id,
+        "name": File.name,
+        "size": File.size,
+        "created_at": File.created_at,
+    }
+
+    def list_files(
+        self,
+        *,
+        limit: int = 100,
+        after_id: Optional[int] = None,
+        sort: str = "id",
+        descending: bool = False,
+        file_type: Optional[str] = None,
+        splitter_method: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        with_total: bool = False,
+    ) -> Tuple[List[dict], Optional[int], Optional[int]]:
+        """Вернуть страницу файлов с keyset-пагинацией по ``id``.
+
+        Сортировка идёт по паре (*sort*, id), поэтому курсор *after_id* однозначно
+        задаёт позицию и для неуникальных колонок. Возвращает кортеж
+        ``(записи, курсор следующей страницы, общее число записей)``;
+        общее число считается только при *with_total*.
+        """
+        column = self.SORTABLE_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Недопустимое поле сортировки: {sort}")
+        with self.session_factory() as session:
+            query = session.query(File)
+            if file_type:
+                query = query.filter(File.file_type == file_type)
+            if splitter_method:
+                query = query.filter(File.splitter_method == splitter_method)
+            if name_prefix:
+                # Диапазон вместо LIKE, чтобы использовался индекс по name
+                query = query.filter(File.name >= name_prefix, File.name < name_prefix + "\uffff")
+
+            total = query.order_by(None).count() if with_total else None
+
+            if after_id is not None:
+                if column is File.id:
+                    query = query.filter(File.id < after_id if descending else File.id > after_id)
+                else:
+                    query = query.filter(self._after_anchor(session, column, after_id, descending))
+
+            order = [column.desc(), File.id.desc()] if descending else [column.asc(), File.id.asc()]
+            if column is File.id:
+                order = order[:1]
+            rows = query.order_by(*order).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = rows[-1].id if has_more and rows else None
+            return [self._to_dict(f) for f in rows], next_cursor, total
+
+    @staticmethod
+    def _after_anchor(session, column, after_id: int, descending: bool):
+        """Условие «строго после файла *after_id*» в порядке (*column*, id).
+
+        Значение колонки курсора берётся подзапросом, а не читается в Python:
+        иначе datetime привязывается строкой другого формата, чем хранит
+        CURRENT_TIMESTAMP, и сравнение идёт по несовпадающим строкам.
+        NULL SQLite ставит первым при возрастании и последним при убывании.
+        """
+        row = session.query(column).filter(File.id == after_id).first()
+        if row is None:
+            raise ValueError(f"Курсор {after_id} не найден: файл удалён, начните с первой страницы")
+        if row[0] is None:
+            same = and_(column.is_(None), File.id < after_id if descending else File.id > after_id)
+            return same if descending else or_(same, column.isnot(None))
+        anchor = session.query(column).filter(File.id == after_id).scalar_subquery()
+        cmp = tuple_(column, File.id)
+        bound = tuple_(anchor, after_id)
+        return or_(cmp < bound, column.is_(None)) if descending else cmp > bound
 
     def get_files_by_extension(self, extension: str | None = None) -> List[str]:
         """Вернуть пути файлов с указанным расширением (регистр не учитывается).
@@ -169,3 +588,18 @@ class FileMetadataDB:
                 pattern = f'%.{ext}'
                 return [row[0] for row in query.filter(File.path.ilike(pattern))]
             return [row[0] for row in query]
+
+    @staticmethod
+    def _to_dict(f: File) -> dict:
+        return {
+            "id": f.id,
+            "path": f.path,
+            "name": f.name,
+            "size": f.size,
+            "created_at": f.created_at,
+            "splitter_method": f.splitter_method,
+            "file_type": f.file_type,
+            "file_hash": f.hash,
+            "index_fingerprint": f.index_fingerprint,
+            "tags": FileMetadataDB.split_tags(f.tags),
+        }
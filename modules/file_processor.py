@@ -3,7 +3,7 @@ import hashlib
 import logging
 
 from pathlib import Path
-from typing import Optional, Union, Dict
+from typing import Optional, Union, Dict, Iterable
 
 from PyPDF2 import PdfReader
 from docx import Document
@@ -12,6 +12,9 @@ from config_models import DocumentManagerConfig
 
 logger = logging.getLogger(__name__)
 
+# Увеличивать при изменении логики извлечения текста: записи кэша прежней версии не используются
+EXTRACTOR_VERSION = "1"
+
 class FileProcessor:
     """
     Обрабатывает файлы разных типов:
@@ -71,6 +74,22 @@ class FileProcessor:
             logger.error("Ошибка обработки файла %s: %s", file_path, e, exc_info=True)
             return None
 
+    def extract_image_texts(self, file_paths: Iterable[Union[str, Path]]) -> Dict[Path, Optional[str]]:
+        """
+        Описания всех изображений из *file_paths* одним пакетным вызовом
+        image_processor.caption_batch. Остальные файлы пропускаются.
+        """
+        if not (self.image_processor and self.config.image_enabled):
+            return {}
+        images = [Path(p) for p in file_paths if Path(p).exists() and self.is_image(p)]
+        if not images:
+            return {}
+        logger.debug("Пакетная генерация описаний для %d изображений", len(images))
+        return dict(zip(images, self.image_processor.caption_batch(images)))
+
+    def is_image(self, file_path: Union[str, Path]) -> bool:
+        return self._get_mime_type(Path(file_path)).startswith('image/')
+
     def get_metadata(self, file_path: Union[str, Path]) -> Dict:
         """
         Возвращает метаданные файла: путь, размер, время создания/модификации, MIME-тип.
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import datetime as dt
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from .models import Dialog
+from config_models import DialogHistoryConfig
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+
+class HistoryArchive:
+    """
+    Помесячные архивы истории в формате JSONL (dialogs-YYYY-MM.jsonl[.gz|.zst]).
+    Каждая порция дописывается отдельным сжатым фрагментом: и gzip, и zstd
+    читают такие склеенные файлы как один поток.
+    """
+
+    def __init__(self, archive_dir: str | Path, compression: str = "gzip"):
+        self.archive_dir = Path(archive_dir)
+        compression = compression.lower()
+        if compression == "zstd" and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, архив истории сжимается gzip")
+            compression = "gzip"
+        if compression not in ("gzip", "zstd", "none"):
+            raise ValueError(f"Неизвестное сжатие архива: {compression}")
+        self.compression = compression
+
+    def write(self, rows: List[dict]) -> List[Path]:
+        """Дописать строки в архивы соответствующих месяцев и сбросить их на диск."""
+        by_month: Dict[str, List[dict]] = defaultdict(list)
+        for row in rows:
+            ts = row["timestamp"]
+            by_month[ts.strftime("%Y-%m") if ts else "unknown"].append(row)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        written = []
+        for month, items in by_month.items():
+            payload = "".join(json.dumps(self._serialize(r), ensure_ascii=False) + "\n" for r in items).encode("utf-8")
+            path = self.archive_dir / f"dialogs-{month}.jsonl{self._suffix()}"
+            with open(path, "ab") as f:
+                f.write(self._compress(payload))
+                f.flush()
+                os.fsync(f.fileno())
+            written.append(path)
+        return written
+
+    def read(self, path: str | Path) -> List[dict]:
+        path = Path(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        if path.suffix == ".gz":
+            data = gzip.decompress(data)
+        elif path.suffix == ".zst":
+            reader = zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True)
+            data = reader.read()
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+
+    def _suffix(self) -> str:
+        return {"gzip": ".gz", "zstd": ".zst", "none": ""}[self.compression]
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "gzip":
+            return gzip.compress(payload)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(payload)
+        return payload
+
+    @staticmethod
+    def _serialize(row: dict) -> dict:
+        row = dict(row)
+        if row.get("timestamp") is not None:
+            row["timestamp"] = row["timestamp"].isoformat()
+        return row
+
+
+class HistoryRetention:
+    """
+    Ограничивает таблицу dialogs: переносит в архив реплики старше
+    *retention_max_age_days* и сверх *retention_max_turns_per_user* на пользователя.
+    Удаление идёт короткими транзакциями по *compaction_chunk_size* строк,
+    чтобы не блокировать запись истории из чата.
+    """
+
+    def __init__(self, session_factory, config: DialogHistoryConfig, history=None):
+        self.session_factory = session_factory
+        self.config = config
+        self.history = history
+        self.archive = HistoryArchive(config.archive_dir, config.archive_compression)
+        self.chunk_size = max(1, config.compaction_chunk_size)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.retention_max_age_days > 0 or self.config.retention_max_turns_per_user > 0
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._worker_loop, name="history-retention", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Фоновое уплотнение истории: возраст=%d дн., лимит=%d реплик, период=%d с",
+            self.config.retention_max_age_days, self.config.retention_max_turns_per_user,
+            self.config.compaction_interval_s,
+        )
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def compact_once(self) -> Dict[str, int]:
+        """Выполнить один проход уплотнения. Возвращает число архивированных строк."""
+        with self._lock:
+            if self.history is not None:
+                # Записи из буфера должны попасть в БД до подсчёта лимитов
+                self.history.flush()
+            stats = {"expired": 0, "over_limit": 0}
+            if self.config.retention_max_age_days > 0:
+                stats["expired"] = self._compact_expired()
+            if self.config.retention_max_turns_per_user > 0:
+                stats["over_limit"] = self._compact_over_limit()
+            if stats["expired"] or stats["over_limit"]:
+                logger.info("Уплотнение истории: %s", stats)
+            return stats
+
+    def _compact_expired(self) -> int:
+        cutoff = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None) - dt.timedelta(
+            days=self.config.retention_max_age_days)
+        total = 0
+        while not self._stop_event.is_set():
+            # id растёт вместе со временем, поэтому старые строки — в начале первичного ключа
+            with self.session_factory() as session:
+                rows = (session.query(Dialog.id, Dialog.timestamp)
+                        .order_by(Dialog.id)
+                        .limit(self.chunk_size)
+                        .all())
+            ids = [r.id for r in rows if r.timestamp is not None and r.timestamp < cutoff]
+            if not ids:
+                break
+            total += self._archive_and_delete(ids)
+            if len(ids) < len(rows):
+                break
+        return total
+
+    def _compact_over_limit(self) -> int:
+        cap = self.config.retention_max_turns_per_user
+        with self.session_factory() as session:
+            users = [
+                row[0] for row in
+                session.query(Dialog.user_id)
+                .group_by(Dialog.user_id)
+                .having(func.count(Dialog.id) > cap)
+                .all()
+            ]
+        total = 0
+        for user_id in users:
+            if self._stop_event.is_set():
+                break
+            with self.session_factory() as session:
+                # id самой старой из сохраняемых реплик — по индексу (user_id, id)
+                boundary = (session.query(Dialog.id)
+                            .filter(Dialog.user_id == user_id)
+                            .order_by(Dialog.id.desc())
+                            .offset(cap - 1)
+                            .limit(1)
+                            .scalar())
+            if boundary is None:
+                continue
+            while not self._stop_event.is_set():
+                with self.session_factory() as session:
+                    ids = [row[0] for row in
+                           session.query(Dialog.id)
+                           .filter(Dialog.user_id == user_id, Dialog.id < boundary)
+                           .order_by(Dialog.id)
+                           .limit(self.chunk_size)
+                           .all()]
+                if not ids:
+                    break
+                total += self._archive_and_delete(ids)
+        return total
+
+    def _archive_and_delete(self, ids: List[int]) -> int:
+        with self.session_factory() as session:
+            rows = [
+                {
+                    "id": d.id,
+                    "user_id": d.user_id,
+                    "timestamp": d.timestamp,
+                    "user_text": d.user_text,
+                    "assistant_text": d.assistant_text,
+                }
+                for d in session.query(Dialog).filter(Dialog.id.in_(ids)).order_by(Dialog.id)
+            ]
+        if not rows:
+            return 0
+        # Сначала архив на диске, затем удаление: при сбое возможен дубль в архиве, но не потеря
+        self.archive.write(rows)
+        with self.session_factory() as session:
+            session.query(Dialog).filter(Dialog.id.in_(ids)).delete(synchronize_session=False)
+        if self.history is not None and self.history.cache is not None:
+            for user_id in {r["user_id"] for r in rows}:
+                self.history.cache.invalidate(user_id)
+        return len(rows)
+
+    def _worker_loop(self) -> None:
+        while not self._stop_event.wait(self.config.compaction_interval_s):
+            try:
+                self.compact_once()
+            except Exception as e:
+                logger.error("Ошибка уплотнения истории: %s", e, exc_info=True)
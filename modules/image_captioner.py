@@ -1,16 +1,33 @@
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, Union
+from typing import Dict, List, Optional, Sequence, Union
 
 import torch
 from PIL import Image
 from transformers import BlipProcessor, BlipForConditionalGeneration
 
 from config_models import ImageCaptioningConfig
+from .compute import resources
 
 logger = logging.getLogger(__name__)
 
+_FILENAME_PREFIX = "Image: "
+
+
+def with_filename(name: str, caption: str) -> str:
+    """Текст изображения для индекса: имя файла и описание."""
+    return f"{_FILENAME_PREFIX}{name}\n{caption}"
+
+
+def bare_caption(text: str) -> str:
+    """Описание без строки с именем файла (обратное к with_filename)."""
+    if text.startswith(_FILENAME_PREFIX) and "\n" in text:
+        return text.split("\n", 1)[1]
+    return text
+
+
 class ImageCaptioner:
     """
     Генерирует текстовое описание (caption) для изображений с помощью BLIP.
@@ -32,16 +49,70 @@ class ImageCaptioner:
         """
         image_path = Path(image_path)
         logger.debug("Начало генерации описания для %s", image_path)
+        caption = self._generate([self._load_image(image_path)])[0]
+        return self._with_filename(image_path, caption)
 
+    def caption_batch(self, paths: Sequence[Union[str, Path]]) -> List[Optional[str]]:
+        """
+        Описания для списка изображений (в том же порядке; None — при ошибке).
+        Изображения декодируются в пуле потоков, следующий batch готовится,
+        пока модель обрабатывает текущий; generate вызывается на batch
+        из *batch_size* изображений.
+        """
+        paths = [Path(p) for p in paths]
+        results: List[Optional[str]] = [None] * len(paths)
+        if not paths:
+            return results
+        batch_size = max(1, self.config.batch_size)
+        starts = list(range(0, len(paths), batch_size))
+        with ThreadPoolExecutor(max_workers=max(1, self.config.decode_workers),
+                                thread_name_prefix="caption-decode") as pool:
+            def submit(start: int) -> List[Future]:
+                return [pool.submit(self._load_image, p) for p in paths[start:start + batch_size]]
+
+            pending = submit(starts[0])
+            for n, start in enumerate(starts):
+                decoded = pending
+                if n + 1 < len(starts):
+                    pending = submit(starts[n + 1])
+                images, indices = [], []
+                for i, future in enumerate(decoded, start):
+                    try:
+                        images.append(future.result())
+                        indices.append(i)
+                    except Exception as e:
+                        logger.error("Не удалось открыть изображение %s: %s", paths[i], e)
+                if not images:
+                    continue
+                try:
+                    captions = self._generate(images)
+                except Exception as e:
+                    logger.error("Ошибка генерации описаний для %d изображений: %s", len(images), e, exc_info=True)
+                    continue
+                for i, caption in zip(indices, captions):
+                    results[i] = self._with_filename(paths[i], caption)
+        logger.debug("Сгенерированы описания для %d из %d изображений",
+                     sum(r is not None for r in results), len(paths))
+        return results
+
+    @staticmethod
+    def _load_image(image_path: Path) -> Image.Image:
         img = Image.open(image_path).convert("RGB")
-        img_resized = img.resize((512, 512), Image.LANCZOS)
-
-        inputs = self.processor(images=img_resized, return_tensors="pt").to(self.device)
-        out = self.model.generate(**inputs)
-        caption = self.processor.decode(out[0], skip_special_tokens=True).strip()
-
+        return img.resize((512, 512), Image.LANCZOS)
+
+    def _generate(self, images: List[Image.Image]) -> List[str]:
+        # Все изображения приведены к 512×512, поэтому batch однороден;
+        # выходные последовательности разной длины дополняются паддингом
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+        with resources.slot("captioner", device=self.device):
+            with torch.no_grad():
+                out = self.model.generate(**inputs)
+        return [c.strip() for c in self.processor.batch_decode(out, skip_special_tokens=True)]
+
+    @staticmethod
+    def _with_filename(image_path: Path, caption: str) -> str:
         # Добавляем название файла к описанию
-        caption_with_filename = f"Image: {image_path.name}\n{caption}"
+        caption_with_filename = with_filename(image_path.name, caption)
         logger.debug("Сгенерировано описание для %s: %s", image_path, caption_with_filename)
         return caption_with_filename
 
@@ -54,7 +125,14 @@ class ImageCaptioner:
         """
         image_path = Path(image_path)
         logger.debug("Извлечение metadata для %s", image_path)
+        info = self.image_info(image_path)
+        # генерируем caption
+        info["caption"] = self.extract_text(image_path)
+        return info
 
+    def image_info(self, image_path: Union[str, Path]) -> Dict:
+        """Размер изображения и PNG-миниатюра 128×128, без запуска модели."""
+        image_path = Path(image_path)
         img = Image.open(image_path).convert("RGB")
         width, height = img.size
 
@@ -65,15 +143,11 @@ class ImageCaptioner:
         thumb.save(buf, format="PNG")
         thumbnail_bytes = buf.getvalue()
 
-        # генерируем caption
-        caption = self.extract_text(image_path)
-
         logger.debug(
             "Metadata для %s: width=%d, height=%d, thumbnail_size=%d bytes",
             image_path, width, height, len(thumbnail_bytes)
         )
         return {
-            "caption": caption,
             "width": width,
             "height": height,
             "thumbnail": thumbnail_bytes
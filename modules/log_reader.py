@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_RECORD_RE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (\w+)\s+(.*)$")
+_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+class LogReader:
+    """
+    Читает хвост лог-файла, не загружая его целиком.
+
+    Последние записи ищутся чтением блоков от конца файла, поэтому стоимость
+    запроса пропорциональна *limit*, а не размеру файла. Курсор — смещение
+    в байтах, до которого файл уже прочитан клиентом.
+    """
+
+    def __init__(self, log_file: str | Path, block_size: int = 64 * 1024):
+        self.log_file = Path(log_file)
+        self.block_size = block_size
+
+    def tail(self, limit: int = 100, level: Optional[str] = None) -> Tuple[List[dict], int]:
+        """Вернуть последние *limit* записей (не ниже *level*) и курсор конца файла."""
+        min_level = self._min_level(level)
+        records: List[dict] = []   # от новых к старым
+        pending: List[str] = []    # строки-продолжения, чья заголовочная строка ещё не прочитана
+        with self.log_file.open("rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = pos = f.tell()
+            remainder = b""
+            while pos > 0 and len(records) < limit:
+                read = min(self.block_size, pos)
+                pos -= read
+                f.seek(pos)
+                lines = (f.read(read) + remainder).split(b"\n")
+                # Первая строка блока может быть обрезана — доберём её со следующим блоком
+                remainder = lines.pop(0) if pos > 0 else b""
+                for raw in reversed(lines):
+                    text = raw.decode("utf-8", errors="ignore").rstrip("\r")
+                    if not text:
+                        continue
+                    record = self._parse_line(text)
+                    if record is None:
+                        pending.append(text)
+                        continue
+                    if pending:
+                        record["message"] += "\n" + "\n".join(reversed(pending))
+                        pending.clear()
+                    if self._passes(record, min_level):
+                        records.append(record)
+                        if len(records) >= limit:
+                            break
+        records.reverse()
+        return records, end
+
+    def read_after(self, cursor: int, limit: int = 100, level: Optional[str] = None) -> Tuple[List[dict], int]:
+        """
+        Вернуть записи, появившиеся после *cursor*, и новый курсор.
+        Если файл был ротирован (стал короче курсора), возвращает хвост.
+        """
+        min_level = self._min_level(level)
+        size = self.log_file.stat().st_size
+        if cursor < 0 or cursor > size:
+            logger.debug("Курсор %d за пределами файла (%d байт), читаем хвост", cursor, size)
+            return self.tail(limit, level)
+        records: List[dict] = []
+        current: Optional[dict] = None
+        with self.log_file.open("rb") as f:
+            f.seek(cursor)
+            new_cursor = cursor
+            while True:
+                line = f.readline()
+                # Недописанную строку оставляем до следующего запроса
+                if not line.endswith(b"\n"):
+                    break
+                text = line.decode("utf-8", errors="ignore").rstrip("\r\n")
+                record = self._parse_line(text)
+                if record is None:
+                    if current is not None:
+                        current["message"] += "\n" + text
+                    new_cursor = f.tell()
+                    continue
+                if len(records) >= limit:
+                    break
+                new_cursor = f.tell()
+                current = record
+                if self._passes(record, min_level):
+                    records.append(record)
+        return records, new_cursor
+
+    @staticmethod
+    def _parse_line(line: str) -> Optional[dict]:
+        match = _RECORD_RE.match(line)
+        if not match:
+            return None
+        ts, lvl, msg = match.groups()
+        return {"timestamp": ts, "level": lvl, "message": msg}
+
+    @staticmethod
+    def _passes(record: dict, min_level: int) -> bool:
+        return _LEVELS.get(record["level"], 0) >= min_level
+
+    @staticmethod
+    def _min_level(level: Optional[str]) -> int:
+        if not level:
+            return 0
+        key = level.upper()
+        if key not in _LEVELS:
+            raise ValueError(f"Неизвестный уровень логирования: {level}")
+        return _LEVELS[key]
@@ -0,0 +1,220 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Сборщик: вызывается только при выдаче метрик и возвращает
+# [(имя, описание, [(метки, значение), ...]), ...] — значения типа gauge;
+# четвёртый элемент "counter" отмечает монотонный счётчик, который ведёт сам компонент
+Collector = Callable[[], Iterable[tuple]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return f"{{{body}}}" if body else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames) or not all(n in labels for n in self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонный счётчик с метками."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._series)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = self._header()
+        for key, value in series:
+            lines.append(f"{self.name}{_labels(zip(self.labelnames, key))} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами: наблюдение — поиск корзины
+    и увеличение счётчика под коротким замком, кумулятивные суммы
+    считаются только при выдаче.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [счётчики корзин (последняя — +Inf), сумма, число наблюдений]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._series.items())
+        lines = self._header()
+        for key, (counts, total, n) in series:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в текстовом формате Prometheus.
+
+    Счётчики и гистограммы обновляются там, где происходят события, и стоят
+    одной операции под замком. Всё, что можно прочитать из состояния
+    компонентов (глубины очередей, память моделей), не копится заранее,
+    а снимается сборщиками только при запросе /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def register_collector(self, collector: Collector) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                # Сбой одного источника не должен лишать остальных метрик
+                logger.exception("Ошибка сборщика метрик %r", collector)
+                continue
+            for name, help, samples, *kind in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind[0] if kind else 'gauge'}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(sorted(labels.items()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "assistant_stage_seconds", "Длительность этапов ответа на вопрос", ("stage",))
+ANSWER_SECONDS = registry.histogram(
+    "assistant_answer_seconds", "Полное время ответа на текстовый вопрос")
+INGESTION_SECONDS = registry.histogram(
+    "assistant_ingestion_stage_seconds", "Длительность этапов индексации файла", ("stage",))
+INGESTED_FILES = registry.counter(
+    "assistant_ingested_files_total", "Файлы, прошедшие индексацию, по результату", ("result",))
+INGESTED_CHUNKS = registry.counter(
+    "assistant_ingested_chunks_total", "Фрагменты при индексации: новые, сохранённые, выведенные", ("state",))
+CACHE_REQUESTS = registry.counter(
+    "assistant_cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _cache_hit_ratio():
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), value in CACHE_REQUESTS.snapshot().items():
+        totals.setdefault(cache, [0, 0])[result == "hit"] += value
+    samples = [({"cache": cache}, hits / (hits + misses)) for cache, (misses, hits) in sorted(totals.items())]
+    return [("assistant_cache_hit_ratio", "Доля попаданий в кэш с запуска процесса", samples)]
+
+
+registry.register_collector(_cache_hit_ratio)
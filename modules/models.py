@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary, func
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary, Index, func
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -8,29 +8,78 @@ class File(Base):
 
     id = Column(Integer, primary_key=True)
     path = Column(String, unique=True, nullable=False)
-    file_type = Column(String, nullable=False)
-    size = Column(Integer, nullable=False)
+    name = Column(String, index=True)
+    file_type = Column(String, nullable=False, index=True)
+    size = Column(Integer, nullable=False, index=True)
     hash = Column(String(64), unique=True, nullable=False)
     processed = Column(Boolean, default=False)
-    splitter_method = Column(String, nullable=True)
-    created_at = Column(DateTime, default=func.now())
+    splitter_method = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime, default=func.now(), index=True)
+    # Поколение фрагментов, видимое поиску (см. Chunk.generation)
+    active_generation = Column(Integer, nullable=False, default=0, server_default="0")
+    # Отпечаток настроек (модель эмбеддингов и разбиение), с которыми построен индекс файла
+    index_fingerprint = Column(String, nullable=True)
+    # Пользовательские теги через запятую (нормализованные, по алфавиту)
+    tags = Column(String, nullable=True)
 
     image = relationship("Image", back_populates="file", uselist=False, cascade="all, delete-orphan")
+    chunks = relationship("Chunk", back_populates="file", cascade="all, delete-orphan")
 
 class Image(Base):
     __tablename__ = 'images'
+    __table_args__ = (Index("ix_images_file_hash_caption_model", "file_hash", "caption_model"),)
 
     file_id = Column(Integer, ForeignKey('files.id', ondelete="CASCADE"), primary_key=True)
     width = Column(Integer)
     height = Column(Integer)
     thumbnail = Column(LargeBinary)
     caption = Column(String)
+    # Ключ кэша описаний: содержимое файла и модель, которой построено описание
+    file_hash = Column(String(64))
+    caption_model = Column(String)
 
     file = relationship("File", back_populates="image")
 
 
+class Chunk(Base):
+    """Фрагмент документа: позиция в тексте, хэш содержимого и id вектора в хранилище.
+
+    Каждая индексация файла пишет новое поколение фрагментов; поиску видно
+    только File.active_generation, прежние поколения удаляет сборщик мусора.
+    """
+    __tablename__ = 'chunks'
+    __table_args__ = (Index("ix_chunks_file_id_generation_position", "file_id", "generation", "position"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_id = Column(Integer, ForeignKey('files.id', ondelete="CASCADE"), nullable=False)
+    generation = Column(Integer, nullable=False, default=0, server_default="0")
+    position = Column(Integer, nullable=False)
+    chunk_hash = Column(String(32), nullable=False, index=True)
+    vector_id = Column(String, nullable=False, index=True)
+
+    file = relationship("File", back_populates="chunks")
+
+
+class ChunkText(Base):
+    """Полный текст фрагмента по id вектора; сжимается zlib, если это уменьшает размер."""
+    __tablename__ = 'chunk_texts'
+
+    vector_id = Column(String, primary_key=True)
+    compressed = Column(Boolean, nullable=False, default=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class Migration(Base):
+    """Однократные миграции данных (не схемы), уже выполненные на этой базе."""
+    __tablename__ = 'migrations'
+
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=func.now())
+
+
 class Dialog(Base):
     __tablename__ = 'dialogs'
+    __table_args__ = (Index("ix_dialogs_user_id_id", "user_id", "id"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(String, nullable=False)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# Версия ONNX opset при экспорте; входит в ключ кэша экспортированной модели
+EXPORT_OPSET = 14
+
+# Тексты для сверки ONNX-модели с исходной PyTorch-моделью
+PARITY_PROBES = [
+    "Как загрузить документ в систему поиска?",
+    "Семантический поиск находит фрагменты, близкие по смыслу к вопросу.",
+    "The quarterly report lists revenue by region and product line.",
+    "ok",
+]
+
+
+class OnnxSentenceEncoder:
+    """
+    CPU-инференс модели sentence-transformers через ONNX Runtime.
+
+    Трансформер экспортируется в ONNX один раз и кэшируется в *cache_dir*
+    (при *quantize* — ещё и с динамической int8-квантизацией весов) под
+    отпечатком файлов модели и настроек экспорта: при замене весов по тому же
+    пути или смене opset/версий библиотек модель экспортируется заново;
+    пулинг и нормализация выполняются в numpy по настройкам исходной модели.
+    Интерфейс encode/tokenizer/max_seq_length совпадает с SentenceTransformer
+    в той части, что использует EmbeddingHandler.
+    """
+
+    def __init__(self, source: SentenceTransformer, model_path: str, cache_dir: str | Path,
+                 quantize: bool = True, num_threads: int = 0):
+        self.tokenizer = source.tokenizer
+        self.max_seq_length = source.max_seq_length
+        self.pooling = self._pooling_mode(source)
+        self.onnx_path = self._prepare(source, model_path, Path(cache_dir), quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(self.onnx_path), options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        logger.info("ONNX-модель эмбеддингов: %s (пулинг %s)", self.onnx_path, self.pooling)
+
+    def encode(self, texts: List[str] | str, batch_size: int = 32, normalize_embeddings: bool = True) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        # Сортировка по длине, как в SentenceTransformer.encode: меньше паддинга в batch
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        result = [None] * len(texts)
+        for b in range(0, len(texts), max(1, batch_size)):
+            idx = order[b:b + batch_size]
+            embeddings = self._encode_batch([texts[i] for i in idx], normalize_embeddings)
+            for i, emb in zip(idx, embeddings):
+                result[i] = emb
+        stacked = np.stack(result) if result else np.zeros((0, 0), dtype=np.float32)
+        return stacked[0] if single else stacked
+
+    def _encode_batch(self, texts: List[str], normalize: bool) -> np.ndarray:
+        features = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        inputs = {k: v.astype(np.int64) for k, v in features.items() if k in self._input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = features["attention_mask"].astype(np.float32)[..., None]
+        if self.pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        elif self.pooling == "max":
+            pooled = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        else:
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    @staticmethod
+    def _pooling_mode(source: SentenceTransformer) -> str:
+        for module in source:
+            if hasattr(module, "get_pooling_mode_str"):
+                mode = module.get_pooling_mode_str()
+                if mode in ("mean", "cls", "max"):
+                    return mode
+                raise ValueError(f"Неподдерживаемый режим пулинга для ONNX: {mode}")
+        return "mean"
+
+    @staticmethod
+    def _prepare(source: SentenceTransformer, model_path: str, cache_dir: Path, quantize: bool) -> Path:
+        fingerprint = OnnxSentenceEncoder._fingerprint(source, model_path)
+        target = cache_dir / re.sub(r"[^\w.-]+", "_", model_path) / fingerprint
+        fp32_path = target / "model.onnx"
+        int8_path = target / "model.int8.onnx"
+        if not fp32_path.exists():
+            target.mkdir(parents=True, exist_ok=True)
+            partial = target / "model.onnx.partial"
+            logger.info("Экспорт модели %s в ONNX: %s", model_path, fp32_path)
+            transformer = source[0].auto_model.to("cpu").eval()
+            sample = source.tokenizer(["export"], return_tensors="pt")
+            names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+            dynamic = {n: {0: "batch", 1: "sequence"} for n in names}
+            dynamic["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+            class _Wrapper(torch.nn.Module):
+                def __init__(self, model):
+                    super().__init__()
+                    self.model = model
+
+                def forward(self, *args):
+                    return self.model(**dict(zip(names, args)))[0]
+
+            with torch.no_grad():
+                torch.onnx.export(
+                    _Wrapper(transformer),
+                    tuple(sample[n] for n in names),
+                    str(partial),
+                    input_names=names,
+                    output_names=["token_embeddings"],
+                    dynamic_axes=dynamic,
+                    opset_version=EXPORT_OPSET,
+                )
+            # Прерванный экспорт не должен остаться в кэше под итоговым именем
+            partial.replace(fp32_path)
+        if not quantize:
+            return fp32_path
+        if not int8_path.exists():
+            logger.info("Динамическая int8-квантизация ONNX-модели: %s", int8_path)
+            partial = target / "model.int8.onnx.partial"
+            quantize_dynamic(str(fp32_path), str(partial), weight_type=QuantType.QInt8)
+            partial.replace(int8_path)
+        return int8_path
+
+    @staticmethod
+    def _fingerprint(source: SentenceTransformer, model_path: str) -> str:
+        """
+        Отпечаток весов и настроек экспорта. Для локальной папки модели — имена,
+        размеры и время изменения её файлов; для модели из хаба — ревизия
+        (commit), с которой она загружена; если ни того ни другого нет — хэш
+        самих весов.
+        """
+        transformer = source[0].auto_model
+        settings = {
+            "opset": EXPORT_OPSET,
+            "torch": torch.__version__,
+            "onnxruntime": ort.__version__,
+            "quant_type": "QInt8",
+            "pooling": OnnxSentenceEncoder._pooling_mode(source),
+        }
+        digest = hashlib.blake2b(json.dumps(settings, sort_keys=True).encode("utf-8"), digest_size=8)
+        local = Path(model_path)
+        revision = getattr(transformer.config, "_commit_hash", None)
+        if local.is_dir():
+            for path in sorted(p for p in local.rglob("*") if p.is_file()):
+                stat = path.stat()
+                digest.update(f"{path.relative_to(local)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+        elif revision:
+            digest.update(revision.encode("utf-8"))
+        else:
+            for name, tensor in transformer.state_dict().items():
+                digest.update(name.encode("utf-8"))
+                digest.update(tensor.detach().cpu().float().contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+
+def parity(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Минимальная косинусная близость построчно."""
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float((ref * cand).sum(axis=1).min())
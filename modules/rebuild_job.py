@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config_models import RebuildConfig
+
+logger = logging.getLogger(__name__)
+
+# rebuild_one(запись файла, заранее извлечённый текст или None) -> (ответ, статус)
+RebuildFn = Callable[[dict, Optional[str]], Tuple[dict, int]]
+# prefetch(порция записей) -> {путь: текст} (описания изображений одним пакетом)
+PrefetchFn = Callable[[List[dict]], Dict[str, str]]
+
+
+class RebuildJob:
+    """
+    Пересоздание эмбеддингов списка файлов порциями.
+
+    Контрольная точка — отпечаток настроек в записи файла, который
+    сохраняется вместе с новым поколением фрагментов (см. ChunkIndex), поэтому
+    сама задача состояния не хранит: после остановки или перезапуска процесса
+    повторный запуск получает только ещё не обработанные файлы. Между файлами
+    задача уступает процессор чату: ждёт, пока *chat_busy* возвращает True,
+    но не дольше yield_to_chat_ms.
+    """
+
+    def __init__(self, files: List[dict], rebuild_one: RebuildFn, prefetch: PrefetchFn,
+                 config: RebuildConfig, chat_busy: Callable[[], bool] = lambda: False):
+        self.files = files
+        self.rebuild_one = rebuild_one
+        self.prefetch = prefetch
+        self.config = config
+        self.chat_busy = chat_busy
+        self.total = len(files)
+        self.done = 0
+        self.failed = 0
+        self.current: Optional[str] = None
+        self.state = "pending"
+        self._cancel = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("pending", "running")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="rebuild-embeddings", daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        """Остановить после текущего файла; обработанные файлы останутся отмеченными."""
+        self._cancel.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=60.0)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "current": self.current,
+        }
+
+    def run(self) -> None:
+        self.state = "running"
+        try:
+            step = max(1, self.config.batch_size)
+            for i in range(0, self.total, step):
+                batch = self.files[i:i + step]
+                texts = self.prefetch(batch)
+                for rec in batch:
+                    if self._cancel.is_set():
+                        self.state = "cancelled"
+                        return
+                    self._throttle()
+                    self._rebuild(rec, texts.get(rec["path"]))
+            self.state = "finished"
+        except Exception:
+            logger.exception("Пересоздание эмбеддингов прервано")
+            self.state = "failed"
+        finally:
+            self.current = None
+            logger.info("Пересоздание эмбеддингов: %s", self.status())
+
+    def _rebuild(self, rec: dict, text: Optional[str]) -> None:
+        self.current = rec["name"]
+        try:
+            response, status = self.rebuild_one(rec, text)
+        except Exception as e:
+            logger.exception("Ошибка пересоздания эмбеддингов для %s", rec["name"])
+            response, status = {"message": str(e)}, 500
+        if status == 200:
+            self.done += 1
+        else:
+            self.failed += 1
+            logger.warning("Не удалось пересчитать эмбеддинги для %s: %s", rec["name"],
+                           response.get("message", "Неизвестная ошибка"))
+
+    def _throttle(self) -> None:
+        if self.config.pause_ms > 0:
+            self._cancel.wait(self.config.pause_ms / 1000)
+        deadline = time.monotonic() + self.config.yield_to_chat_ms / 1000
+        while self.chat_busy() and time.monotonic() < deadline and not self._cancel.is_set():
+            time.sleep(0.02)
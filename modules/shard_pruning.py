@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+def month_start(ts: float) -> datetime:
+    """Начало месяца (UTC), в который попадает unix-время *ts*."""
+    d = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return datetime(d.year, d.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(d: datetime) -> datetime:
+    return datetime(d.year + d.month // 12, d.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def key_conditions(filters: Optional[Dict], key: str) -> Optional[List[Any]]:
+    """
+    Условия фильтра на *key*, которые обязаны выполняться (верхний уровень и $and).
+    None — фильтр содержит $or/$not на верхнем уровне, и отсечь шарды нельзя.
+    Член $and с $or (например, «любой из тегов») ничего не требует от *key*,
+    но остальные члены $and по-прежнему отсекают шарды.
+    """
+    if not filters:
+        return []
+    conditions = []
+    for k, v in filters.items():
+        if k == "$and":
+            for sub in v:
+                conditions.extend(key_conditions(sub, key) or [])
+        elif k.startswith("$"):
+            return None
+        elif k == key:
+            conditions.append(v if isinstance(v, dict) else {"$eq": v})
+    return conditions
+
+
+def month_matches(start: float, conditions: List[Dict]) -> bool:
+    """Может ли месяц, начинающийся в *start*, содержать значения, удовлетворяющие *conditions*."""
+    end = next_month(datetime.fromtimestamp(start, tz=timezone.utc)).timestamp()
+    for cond in conditions:
+        low = cond.get("$gte", cond.get("$gt", cond.get("$eq")))
+        high = cond.get("$lte", cond.get("$lt", cond.get("$eq")))
+        if low is not None and low >= end:
+            return False
+        if high is not None and high < start:
+            return False
+    return True
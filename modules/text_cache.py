@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+
+class ExtractedTextCache:
+    """
+    Сжатый дисковый кэш извлечённого текста: один файл на пару
+    (хэш содержимого, версия извлечения) — ``<dir>/<hh>/<hash>.v<version>.txt.gz``.
+    Смена версии извлечения (FileProcessor.EXTRACTOR_VERSION) делает старые
+    записи невидимыми, не требуя очистки.
+    """
+
+    def __init__(self, cache_dir: str | Path, version: str, compression: str = "gzip"):
+        self.cache_dir = Path(cache_dir)
+        self.version = version
+        compression = compression.lower()
+        if compression == "zstd" and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, кэш текста сжимается gzip")
+            compression = "gzip"
+        if compression not in ("gzip", "zstd"):
+            raise ValueError(f"Неизвестное сжатие кэша текста: {compression}")
+        self.compression = compression
+
+    def get(self, file_hash: str) -> Optional[str]:
+        path = self._path(file_hash)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return self._decompress(data).decode("utf-8")
+        except Exception as e:
+            logger.warning("Повреждённая запись кэша текста %s: %s", path, e)
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, file_hash: str, text: str) -> None:
+        path = self._path(file_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = self._compress(text.encode("utf-8"))
+        # Запись во временный файл и переименование: читатель не увидит половину записи
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def discard(self, file_hash: str) -> None:
+        """Удалить записи файла для всех версий извлечения."""
+        folder = self.cache_dir / file_hash[:2]
+        for path in folder.glob(f"{file_hash}.v*"):
+            path.unlink(missing_ok=True)
+
+    def _path(self, file_hash: str) -> Path:
+        suffix = ".gz" if self.compression == "gzip" else ".zst"
+        return self.cache_dir / file_hash[:2] / f"{file_hash}.v{self.version}.txt{suffix}"
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(payload)
+        return gzip.compress(payload, compresslevel=6)
+
+    def _decompress(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
@@ -1,10 +1,95 @@
 import re
 import logging
+from array import array
+from typing import Iterator, Tuple
+
 from config_models import TextSplitterConfig
 
+_WORD_RE = re.compile(r"\S+")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[^\S\n]*\n\s*")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+|\n[^\S\n]*\n\s*")
+# Сколько абзацев отдаётся токенизатору за один вызов
+_TOKENIZE_BATCH = 256
+
+Span = Tuple[int, int]
+
+
+def _strip_span(text: str, start: int, end: int) -> Span:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _segment_offsets(text: str, separator: re.Pattern) -> Tuple[array, array]:
+    """Границы непустых фрагментов между разделителями: массивы начал и концов."""
+    starts, ends = array("q"), array("q")
+    pos = 0
+    for match in separator.finditer(text):
+        s, e = _strip_span(text, pos, match.start())
+        if s < e:
+            starts.append(s)
+            ends.append(e)
+        pos = match.end()
+    s, e = _strip_span(text, pos, len(text))
+    if s < e:
+        starts.append(s)
+        ends.append(e)
+    return starts, ends
+
+
+def _word_offsets(text: str) -> Tuple[array, array]:
+    starts, ends = array("q"), array("q")
+    for match in _WORD_RE.finditer(text):
+        starts.append(match.start())
+        ends.append(match.end())
+    return starts, ends
+
+
+def _token_offsets(text: str, tokenizer) -> Tuple[array, array]:
+    """
+    Смещения токенов в *text*. Абзацы токенизируются пачками (быстрые
+    токенизаторы обрабатывают пачку параллельно), смещения внутри абзаца
+    переводятся в смещения исходной строки.
+    """
+    seg_starts, seg_ends = _segment_offsets(text, _PARAGRAPH_BREAK_RE)
+    starts, ends = array("q"), array("q")
+    for b in range(0, len(seg_starts), _TOKENIZE_BATCH):
+        bases = seg_starts[b:b + _TOKENIZE_BATCH]
+        texts = [text[s:e] for s, e in zip(bases, seg_ends[b:b + _TOKENIZE_BATCH])]
+        encoded = tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        for base, offsets in zip(bases, encoded["offset_mapping"]):
+            for s, e in offsets:
+                if s < e:
+                    starts.append(base + s)
+                    ends.append(base + e)
+    return starts, ends
+
+
 class TextContextSplitter:
-    def __init__(self, config: TextSplitterConfig):
+    """
+    Делит текст на контексты за один проход токенизации.
+
+    Текст один раз размечается в массивы смещений (слова, предложения или
+    абзацы — в зависимости от метода), а контексты описываются парами
+    (начало, конец) в исходной строке. Строки создаются лениво, по одной,
+    поэтому перекрывающиеся окна не копируют текст заранее.
+
+    Метод "tokens" использует токенизатор *embedder* (EmbeddingHandler):
+    контекст занимает не больше max_seq_length токенов модели, поэтому
+    encode не обрезает фрагменты.
+    """
+
+    def __init__(self, config: TextSplitterConfig, embedder=None):
         self.config = config
+        self.embedder = embedder
         self._validate_config()
 
     def update_config(self, new_config: TextSplitterConfig):
@@ -21,56 +106,95 @@ class TextContextSplitter:
         self._validate_pair(c.sentences_per_context, c.overlap_sentences)
         if c.paragraphs_per_context <= 0 or c.overlap_lines < 0:
             raise ValueError
-        
+        if c.tokens_per_context < 0 or c.overlap_tokens < 0:
+            raise ValueError
+
     def split(self, content: str) -> list[str]:
-        if not content or not content.strip():
+        return list(self.iter_split(content))
+
+    def iter_split(self, content: str) -> Iterator[str]:
+        """Ленивая версия split: по одной строке на контекст."""
+        for start, end in self.iter_spans(content):
+            yield content[start:end]
+
+    def iter_spans(self, content: str) -> Iterator[Span]:
+        """Контексты в виде пар смещений (начало, конец) в *content*."""
+        if not content or content.isspace():
             logging.warning("Empty or whitespace-only input provided")
-            return []
-        original_len = len(content)
-        content = content.replace('\r\n', '\n').replace('\r', '\n')
-        content = re.sub(r'([.!?])\s*\1+', r'\1', content)
-        content = re.sub(r'\s+', ' ', content).strip()
-        if not content:
-            logging.warning(f"Text was removed after preprocessing (original length: {original_len})")
-            return []
-        logging.debug(f"Processed text length: {len(content)}, method: {self.config.method}")
+            return iter(())
+        logging.debug(f"Text length: {len(content)}, method: {self.config.method}")
         if self.config.method == "words":
-            return self.split_by_words(content)
+            return self._word_spans(content)
         if self.config.method == "sentences":
-            return self.split_by_sentences(content)
+            return self._sentence_spans(content)
         if self.config.method == "paragraphs":
-            return self.split_by_paragraphs(content)
+            return self._paragraph_spans(content)
+        if self.config.method == "tokens":
+            return self._token_spans(content)
         raise ValueError(f"Unknown split method: {self.config.method}")
 
     def split_by_words(self, content: str) -> list[str]:
+        return [content[s:e] for s, e in self._word_spans(content)]
+
+    def split_by_sentences(self, content: str) -> list[str]:
+        return [content[s:e] for s, e in self._sentence_spans(content)]
+
+    def split_by_paragraphs(self, content: str) -> list[str]:
+        return [content[s:e] for s, e in self._paragraph_spans(content)]
+
+    def _word_spans(self, content: str) -> Iterator[Span]:
         wp, ow = self.config.words_per_context, self.config.overlap_words
-        step = wp - ow
-        words = content.split()
-        contexts = []
-        for i in range(0, len(words), step):
+        step = max(1, wp - ow)
+        starts, ends = _word_offsets(content)
+        n = len(starts)
+        for i in range(0, n, step):
             start = max(0, i - ow)
-            end = min(len(words), i + wp)
-            contexts.append(" ".join(words[start:end]))
-        return contexts
+            end = min(n, i + wp)
+            yield starts[start], ends[end - 1]
 
-    def split_by_sentences(self, content: str) -> list[str]:
+    def _sentence_spans(self, content: str) -> Iterator[Span]:
         sp, os_ = self.config.sentences_per_context, self.config.overlap_sentences
-        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", content) if s.strip()]
-        contexts = []
-        for i in range(0, len(sentences), sp):
+        starts, ends = _segment_offsets(content, _SENTENCE_BREAK_RE)
+        n = len(starts)
+        for i in range(0, n, max(1, sp)):
             start = max(0, i - os_)
-            end = min(len(sentences), i + sp)
-            contexts.append(" ".join(sentences[start:end]))
-        return contexts
+            end = min(n, i + sp)
+            yield starts[start], ends[end - 1]
 
-    def split_by_paragraphs(self, content: str) -> list[str]:
+    def _paragraph_spans(self, content: str) -> Iterator[Span]:
         pp, ol = self.config.paragraphs_per_context, self.config.overlap_lines
-        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", content.strip()) if p.strip()]
-        contexts = []
-        for i in range(0, len(paragraphs), pp):
-            chunk = paragraphs[i:i + pp]
+        starts, ends = _segment_offsets(content, _PARAGRAPH_BREAK_RE)
+        n = len(starts)
+        for i in range(0, n, pp):
+            start = starts[i]
             if i > 0 and ol > 0:
-                prev_tail = paragraphs[i - 1].split("\n")[-ol:]
-                chunk.insert(0, "\n".join(prev_tail))
-            contexts.append("\n\n".join(chunk))
-        return contexts
\ No newline at end of file
+                # Перекрытие — последние ol строк предыдущего абзаца
+                prev_start, pos = starts[i - 1], ends[i - 1]
+                for _ in range(ol):
+                    nl = content.rfind("\n", prev_start, pos)
+                    if nl == -1:
+                        pos = prev_start
+                        break
+                    pos = nl
+                start = prev_start if pos == prev_start else _strip_span(content, pos, ends[i - 1])[0]
+            yield start, ends[min(n, i + pp) - 1]
+
+    def token_budget(self) -> int:
+        """Размер контекста в токенах без служебных токенов модели."""
+        if self.embedder is None:
+            raise ValueError("Для разбиения по токенам нужна модель эмбеддингов")
+        tokenizer = self.embedder.tokenizer
+        limit = self.embedder.max_seq_length - tokenizer.num_special_tokens_to_add(pair=False)
+        budget = self.config.tokens_per_context
+        return max(1, min(budget, limit) if budget > 0 else limit)
+
+    def _token_spans(self, content: str) -> Iterator[Span]:
+        budget = self.token_budget()
+        step = max(1, budget - self.config.overlap_tokens)
+        starts, ends = _token_offsets(content, self.embedder.tokenizer)
+        n = len(starts)
+        for i in range(0, n, step):
+            end = min(n, i + budget)
+            yield starts[i], ends[end - 1]
+            if end == n:
+                break
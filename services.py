@@ -5,13 +5,14 @@ import sys
 import threading
 import signal
 import datetime as dt
+import hashlib
+import json
 import re
 import torch
 from pathlib import Path
 from typing import Dict, Any, Tuple, List
 from dataclasses import is_dataclass, asdict
 from threading import Lock
-from ruamel.yaml import YAML
 from enum import Enum
 from flask import request
 from flask_socketio import SocketIO
@@ -23,19 +24,26 @@ from modules.file_metadata_db import FileMetadataDB, File
 from modules.document_manager import DocumentManager
 from modules.embedding_handler import EmbeddingHandler
 from modules.embedding_storage import EmbeddingStorage
+from modules.chunk_index import ChunkIndex
 from modules.answer_generator import AnswerGenerator
 from modules.text_splitter import TextContextSplitter
 from modules.speech_processor import SpeechProcessor
 from modules.dialog_history import DialogHistory
+from modules.history_retention import HistoryRetention
 from modules.dialog_manager import DialogManager
+from modules.log_reader import LogReader
+from modules.compute import resources
+from modules.metrics import INGESTED_FILES, INGESTION_SECONDS, registry as metrics_registry
+from modules.rebuild_job import RebuildJob
 
 logger = logging.getLogger(__name__)
 _services: Dict[str, Any] | None = None
 _running = False
 _services_lock = Lock()
-_yaml = YAML()
-_yaml.preserve_quotes = True
+_log_reader: LogReader | None = None
 socketio: SocketIO | None = None
+_rebuild_job: RebuildJob | None = None
+_rebuild_lock = Lock()
 
 
 
@@ -64,8 +72,10 @@ def _convert_config_to_dict(obj: Any) -> Any:
 
 
 def _setup_logging(cfg: Any, socketio: SocketIO = None) -> None:
+    global _log_reader
     log_cfg = cfg.logging
     os.makedirs(os.path.dirname(log_cfg.file) or ".", exist_ok=True)
+    _log_reader = LogReader(log_cfg.file)
     logging.config.dictConfig({
         "version": 1,
         "disable_existing_loggers": False,
@@ -104,13 +114,14 @@ def minimal_init_classes(config_path: str | Path = "config.yaml", socketio: Sock
             cfg_loader = ConfigLoader(config_path)
             cfg = cfg_loader.full
             _setup_logging(cfg, socketio)
+            resources.configure(cfg.compute)
             db = DBManager(cfg.database)
             db.init_db()
             metadata_db = FileMetadataDB(db.session_scope)
             document_manager = DocumentManager(
                 cfg.document_manager, metadata_db)
-            splitter = TextContextSplitter(cfg.splitter)
             embedder = EmbeddingHandler(cfg.embedding_handler)
+            splitter = TextContextSplitter(cfg.splitter, embedder)
             storage = EmbeddingStorage(cfg.embedding_storage)
             _services = {
                 "config": cfg,
@@ -119,28 +130,33 @@ def minimal_init_classes(config_path: str | Path = "config.yaml", socketio: Sock
                 "splitter": splitter,
                 "embedder": embedder,
                 "embedding_storage": storage,
+                "chunk_index": ChunkIndex(metadata_db, storage, embedder),
             }
-
-        cfg = _services["config"]
-        document_manager = _services["document_manager"]
-        try:
-            docs_path = Path(cfg.documents_folder).resolve()
-            if docs_path.is_dir():
-                for file_path in docs_path.rglob("*"):
-                    if not file_path.is_file():
-                        continue
-                    if not document_manager.is_supported_format(file_path):
-                        continue
-                    document_manager.save_metadata(file_path)
-        except Exception as e:
-            logger.exception(
-                "Ошибка при автозагрузке файлов из папки %s: %s",
-                cfg.documents_folder, e
-            )
+            _services["chunk_index"].migrate()
+            # Папку документов сканируем один раз при создании сервисов,
+            # а не на каждый запрос админки
+            _autoload_documents(cfg, document_manager)
 
     return _services
 
 
+def _autoload_documents(cfg: Any, document_manager: DocumentManager) -> None:
+    try:
+        docs_path = Path(cfg.documents_folder).resolve()
+        if docs_path.is_dir():
+            for file_path in docs_path.rglob("*"):
+                if not file_path.is_file():
+                    continue
+                if not document_manager.is_supported_format(file_path):
+                    continue
+                document_manager.save_metadata(file_path)
+    except Exception as e:
+        logger.exception(
+            "Ошибка при автозагрузке файлов из папки %s: %s",
+            cfg.documents_folder, e
+        )
+
+
 def full_init_classes(config_path: str | Path = "config.yaml", socketio: SocketIO = None) -> Dict[str, Any]:
     global _services
     if _services is None:
@@ -148,7 +164,9 @@ def full_init_classes(config_path: str | Path = "config.yaml", socketio: SocketI
     cfg = _services["config"]
     if "dialog_manager" not in _services:
         logger.info("Инициализация приложения началась")
-        history = DialogHistory(_services["metadata_db"].session_factory)
+        history = DialogHistory(_services["metadata_db"].session_factory, cfg.dialog_history)
+        retention = HistoryRetention(_services["metadata_db"].session_factory, cfg.dialog_history, history)
+        retention.start()
         generator = AnswerGenerator(cfg.answer_generator)
         speech = SpeechProcessor(cfg.speech)
         dialog_manager = DialogManager(
@@ -158,16 +176,36 @@ def full_init_classes(config_path: str | Path = "config.yaml", socketio: SocketI
             speech,
             history,
             cfg.dialog_manager,
+            _services["chunk_index"],
         )
         _services.update({
             "generator": generator,
             "speech": speech,
             "dialog_manager": dialog_manager,
+            "history_retention": retention,
         })
         logger.info("Приложение инициализировано")
     return _services
 
 
+def index_fingerprint(cfg: Any) -> str:
+    """
+    Отпечаток настроек, от которых зависит индекс: ``<модель>:<разбиение>``.
+    При совпадении первой части векторы неизменившихся фрагментов можно не пересчитывать.
+    """
+    model = {
+        "model_path": cfg.embedding_handler.model_path,
+        "backend": cfg.embedding_handler.backend,
+        "onnx_quantize": cfg.embedding_handler.onnx_quantize,
+    }
+
+    def digest(obj: Any) -> str:
+        payload = json.dumps(_convert_config_to_dict(obj), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    return f"{digest(model)}:{digest(cfg.splitter)}"
+
+
 def safe_filename(filename: str) -> str:
     invalid_chars = r'[<>:"/\\|?*]'
     filename = re.sub(invalid_chars, '_', filename)
@@ -178,7 +216,9 @@ def safe_filename(filename: str) -> str:
     return filename
 
 
-def process_single_file(file_path: Path, services: Dict[str, Any], socketio: SocketIO = None) -> None:
+def process_single_file(file_path: Path, services: Dict[str, Any], socketio: SocketIO = None,
+                        file_hash: str | None = None, text: str | None = None,
+                        tags: List[str] | None = None) -> None:
     socketio.emit(
         'log_message',
         {
@@ -190,49 +230,97 @@ def process_single_file(file_path: Path, services: Dict[str, Any], socketio: Soc
     )
     document_manager = services["document_manager"]
     splitter = services.get("splitter")
-    embedder = services.get("embedder")
-    storage = services.get("embedding_storage")
     metadata_db = services["metadata_db"]
 
     if not file_path.is_file() or not document_manager.is_supported_format(file_path):
         logger.warning(
             "Файл %s не является файлом или не поддерживается", file_path)
+        INGESTED_FILES.inc(result="unsupported")
         return
-    try:
-        text = document_manager.get_text(file_path)
-        if not text or len(text.strip()) < 30:
-            logger.warning(
-                "Пустой или слишком короткий текст для файла: %s", file_path)
-            return
-        file_hash = document_manager.get_hash(file_path)
-        if not file_hash or metadata_db.get_file_by_hash(file_hash):
-            logger.info("Файл %s уже обработан или хэш отсутствует", file_path)
-            return
-        meta = document_manager.get_metadata(file_path)
-        metadata_db.add_file(
-            path=str(file_path),
-            file_type=meta["mime_type"],
-            size=meta["size"],
-            file_hash=file_hash,
-        )
-        for i, chunk in enumerate(splitter.split(text)):
-            emb = embedder.get_text_embedding(chunk)
-            storage.add_embedding(
-                f"{file_hash}_chunk{i}",
-                emb,
-                metadata={"source": file_path.name, "content": chunk[:300]},
-            )
-        logger.info("Файл %s успешно обработан", file_path)
-    except Exception as e:
-        logger.exception("Ошибка обработки файла %s: %s", file_path, e)
+    with resources.workload("ingestion"):
+        try:
+            if not file_hash:
+                with INGESTION_SECONDS.time(stage="hash"):
+                    file_hash = document_manager.get_hash(file_path)
+            if not file_hash or metadata_db.get_file_by_hash(file_hash):
+                logger.info("Файл %s уже обработан или хэш отсутствует", file_path)
+                INGESTED_FILES.inc(result="skipped")
+                return
+            if text is None:
+                with INGESTION_SECONDS.time(stage="extract"):
+                    text = document_manager.get_text(file_path, file_hash)
+            if not text or len(text.strip()) < 30:
+                logger.warning(
+                    "Пустой или слишком короткий текст для файла: %s", file_path)
+                INGESTED_FILES.inc(result="empty")
+                return
+            meta = document_manager.get_metadata(file_path)
+            previous = metadata_db.get_file_by_name(file_path.name)
+            if previous and Path(previous["path"]).resolve() == file_path.resolve():
+                # Тот же файл с новым содержимым: пересчитываются только изменённые фрагменты
+                file_id = previous["id"]
+                metadata_db.update_file_content(
+                    file_id, file_hash=file_hash, size=meta["size"], file_type=meta["mime_type"])
+                if tags is not None:
+                    metadata_db.set_file_tags(file_id, tags)
+                document_manager.forget_text(previous["file_hash"])
+                logger.info("Файл %s изменён, обновление индекса", file_path)
+            else:
+                file_id = metadata_db.add_file(
+                    path=str(file_path),
+                    file_type=meta["mime_type"],
+                    size=meta["size"],
+                    file_hash=file_hash,
+                    tags=tags,
+                )
+            if file_id is None:
+                INGESTED_FILES.inc(result="failed")
+                return
+            document_manager.remember_caption(file_id, file_path, file_hash, text)
+            with INGESTION_SECONDS.time(stage="index"):
+                services["chunk_index"].index_document(
+                    file_id, file_path.name, splitter.iter_split(text),
+                    fingerprint=index_fingerprint(services["config"]))
+            INGESTED_FILES.inc(result="indexed")
+            logger.info("Файл %s успешно обработан", file_path)
+        except Exception as e:
+            INGESTED_FILES.inc(result="failed")
+            logger.exception("Ошибка обработки файла %s: %s", file_path, e)
 
 
 def process_folder(folder: Path, services: Dict[str, Any], socketio: SocketIO = None) -> None:
     if not folder.exists():
         logger.warning("Папка %s не существует", folder)
         return
-    for file_path in folder.iterdir():
-        process_single_file(file_path, services, socketio)
+    document_manager = services["document_manager"]
+    hashes = {
+        file_path: document_manager.get_hash(file_path)
+        for file_path in folder.iterdir()
+        if file_path.is_file() and document_manager.is_supported_format(file_path)
+    }
+    known = services["metadata_db"].get_files_by_hashes(hashes.values())
+    for file_path, file_hash in hashes.items():
+        if file_hash in known:
+            logger.debug("Файл %s уже обработан", file_path)
+    _process_new_files(
+        {p: h for p, h in hashes.items() if h not in known}, services, socketio)
+
+
+def _process_new_files(hashes: Dict[Path, str], services: Dict[str, Any], socketio: SocketIO = None,
+                       tags: List[str] | None = None) -> Dict[Path, Exception]:
+    """Обработать новые файлы; изображения описываются одним пакетом. Возвращает ошибки по файлам."""
+    known = services["metadata_db"].get_files_by_hashes(hashes.values())
+    with resources.workload("ingestion"):
+        captions = services["document_manager"].get_image_texts(
+            [p for p, h in hashes.items() if h not in known], hashes)
+    errors = {}
+    for file_path, file_hash in hashes.items():
+        try:
+            process_single_file(file_path, services, socketio, file_hash=file_hash, text=captions.get(file_path),
+                                tags=tags)
+        except Exception as e:
+            errors[file_path] = e
+    return errors
 
 
 def build_services(config_path: str | Path = "config.yaml", socketio: SocketIO = None) -> Dict[str, Any]:
@@ -263,8 +351,10 @@ def save_config(config_path: Path, data: Dict[str, Any], socketio: SocketIO = No
         namespace='/ws/logs'
     )
     valid_devices = ["cuda:0", "cuda:1", "cpu"]
+    valid_embedding_backends = ["torch", "onnx"]
+    valid_shard_modes = ["none", "hash", "time"]
     valid_quantizations = ["fp32", "fp16", "int8", "nf4"]
-    valid_splitter_methods = ["words", "sentences", "paragraphs"]
+    valid_splitter_methods = ["words", "sentences", "paragraphs", "tokens"]
     valid_log_levels = ["INFO", "DEBUG", "WARNING", "ERROR", "CRITICAL"]
     try:
         editor = ConfigEditor(config_path)
@@ -279,6 +369,10 @@ def save_config(config_path: Path, data: Dict[str, Any], socketio: SocketIO = No
         _flat("", data)
         if "embedding_handler.device" in flat and flat["embedding_handler.device"] not in valid_devices:
             return {"status": "error", "message": f"Недопустимое устройство: {flat['embedding_handler.device']}"}, 400
+        if "embedding_handler.backend" in flat and flat["embedding_handler.backend"] not in valid_embedding_backends:
+            return {"status": "error", "message": f"Недопустимый бэкенд эмбеддингов: {flat['embedding_handler.backend']}"}, 400
+        if "embedding_storage.shard_by" in flat and flat["embedding_storage.shard_by"] not in valid_shard_modes:
+            return {"status": "error", "message": f"Недопустимый режим шардирования: {flat['embedding_storage.shard_by']}"}, 400
         if "answer_generator.device" in flat and flat["answer_generator.device"] not in valid_devices:
             return {"status": "error", "message": f"Недопустимое устройство: {flat['answer_generator.device']}"}, 400
         if "answer_generator.quantization" in flat and flat["answer_generator.quantization"] not in valid_quantizations:
@@ -326,38 +420,47 @@ def optimize_config(config_path: Path, socketio: SocketIO = None) -> Tuple[Dict[
         return {"status": "error", "message": str(e)}, 500
 
 
-def list_files(services: Dict[str, Any], socketio: SocketIO = None) -> Tuple[Dict[str, Any], int]:
+def list_files(services: Dict[str, Any], socketio: SocketIO = None, *, limit: int = 100, cursor: int | None = None,
+               sort: str = "id", order: str = "asc", file_type: str | None = None,
+               splitter_method: str | None = None, name_prefix: str | None = None) -> Tuple[Dict[str, Any], int]:
+    if not 1 <= limit <= 1000:
+        return {"status": "error", "message": "Лимит должен быть от 1 до 1000"}, 400
+    if order not in ("asc", "desc"):
+        return {"status": "error", "message": f"Недопустимый порядок сортировки: {order}"}, 400
     try:
-        with services["metadata_db"].session_factory() as session:
-            files = services["metadata_db"].get_all_files()
-            logger.info("Получено %d записей из get_all_files: %s", len(files), files) 
-            rows = []
-            seen_paths = set() 
-            for f in files:
-                if not f.get("path") or not f.get("size") or not f.get("created_at"):
-                    logger.warning("Некорректная запись в базе данных: %s", f)
-                    continue
-                if f["path"] in seen_paths:
-                    logger.warning("Обнаружен дубликат в данных: %s", f["path"])
-                    continue
-                seen_paths.add(f["path"])
-                try:
-                    row = {
-                        "name": Path(f["path"]).name,
-                        "size": f"{f['size']/1_048_576:.1f} MB",
-                        "modified": dt.datetime.fromtimestamp(f["created_at"].timestamp()).strftime("%Y-%m-%d"),
-                        "splitter_method": f["splitter_method"] or "unknown",
-                    }
-                    rows.append(row)
-                    logger.debug("Добавлен файл в ответ: %s", row)
-                except Exception as e:
-                    logger.warning("Ошибка обработки файла %s: %s", f.get("path", "unknown"), e)
-                    continue
-            logger.info("Возвращено %d файлов в ответе: %s", len(rows), rows)
-            return {"status": "success", "files": rows}, 200
+        files, next_cursor, total = services["metadata_db"].list_files(
+            limit=limit,
+            after_id=cursor,
+            sort=sort,
+            descending=order == "desc",
+            file_type=file_type,
+            splitter_method=splitter_method,
+            name_prefix=name_prefix,
+            with_total=cursor is None,
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
     except Exception as e:
         logger.exception("Ошибка получения списка файлов: %s", e)
         return {"status": "error", "message": str(e)}, 500
+    rows = []
+    for f in files:
+        if not f.get("path") or f.get("size") is None:
+            logger.warning("Некорректная запись в базе данных: id=%s", f.get("id"))
+            continue
+        rows.append({
+            "id": f["id"],
+            "name": f["name"] or Path(f["path"]).name,
+            "size": f"{f['size']/1_048_576:.1f} MB",
+            "modified": f["created_at"].strftime("%Y-%m-%d") if f["created_at"] else "-",
+            "splitter_method": f["splitter_method"] or "unknown",
+            "file_type": f["file_type"],
+        })
+    logger.debug("Возвращено %d файлов (cursor=%s, next=%s)", len(rows), cursor, next_cursor)
+    response = {"status": "success", "files": rows, "next_cursor": next_cursor}
+    if total is not None:
+        response["total"] = total
+    return response, 200
 
 
 def delete_file(filename: str, services: Dict[str, Any], socketio: SocketIO = None) -> Tuple[Dict[str, Any], int]:
@@ -372,9 +475,7 @@ def delete_file(filename: str, services: Dict[str, Any], socketio: SocketIO = No
                 },
                 namespace='/ws/logs'
             )
-            files = services["metadata_db"].get_all_files()
-            rec = next((f for f in files if Path(
-                f["path"]).name == filename), None)
+            rec = services["metadata_db"].get_file_by_name(filename)
             if not rec:
                 return {"status": "error", "message": "Файл не найден"}, 404
             documents_folder = Path(
@@ -384,14 +485,15 @@ def delete_file(filename: str, services: Dict[str, Any], socketio: SocketIO = No
                 logger.warning(
                     "Попытка удалить файл вне папки документов: %s", file_path)
                 return {"status": "error", "message": "Недопустимый путь"}, 403
-            ids = services["embedding_storage"].collection.get(
-                where={"source": {"$eq": filename}})["ids"]
-            if ids:
-                services["embedding_storage"].collection.delete(ids=ids)
-            else:
+            if not services["chunk_index"].delete_document(rec["id"], filename):
                 logger.info("Эмбеддинги для файла %s не найдены", filename)
             file_path.unlink(missing_ok=True)
-            session.query(File).filter(File.path == str(file_path)).delete()
+            services["document_manager"].forget_text(rec["file_hash"])
+            file = session.get(File, rec["id"])
+            if file is not None:
+                # Удаление через ORM: каскад снимает и строку images,
+                # внешние ключи SQLite здесь не проверяются
+                session.delete(file)
         return {"status": "success", "message": "Файл удалён"}, 200
     except Exception as e:
         logger.exception("Ошибка удаления файла")
@@ -400,66 +502,85 @@ def delete_file(filename: str, services: Dict[str, Any], socketio: SocketIO = No
 
 def rebuild_embeddings(filename: str, services: Dict[str, Any], socketio: SocketIO = None) -> Tuple[Dict[str, Any], int]:
     try:
-        with services["metadata_db"].session_factory() as session:
-            socketio.emit(
-                'log_message',
-                {
-                    'timestamp': dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'level': 'INFO',
-                    'message': 'Пересоздание эмбенддингов'
-                },
-                namespace='/ws/logs'
-            )
-            files = services["metadata_db"].get_all_files()
-            rec = next((f for f in files if Path(
-                f["path"]).name == filename), None)
-            if not rec:
-                return {"status": "error", "message": "Файл не найден"}, 404
-            text = services["document_manager"].get_text(Path(rec["path"]))
-            if not text or len(text.strip()) < 30:
-                logger.warning(
-                    "Пустой или слишком короткий текст для файла: %s", filename)
-                return {"status": "error", "message": "Пустой или слишком короткий текст"}, 400
-            old_ids = services["embedding_storage"].collection.get(
-                where={"source": {"$eq": filename}})["ids"]
-            if old_ids:
-                services["embedding_storage"].collection.delete(ids=old_ids)
-            else:
-                logger.info(
-                    "Предыдущие эмбеддинги для файла %s не найдены", filename)
-            for i, chunk in enumerate(services["splitter"].split(text)):
-                emb = services["embedder"].get_text_embedding(chunk)
-                services["embedding_storage"].add_embedding(
-                    f"{filename}_chunk{i}",
-                    emb,
-                    metadata={"source": filename, "content": chunk[:300]},
-                )
-            session.query(File).filter(File.path == str(rec["path"])).update(
-                {"splitter_method": services["splitter"].config.method}
-            )
-            session.commit()
-        return {"status": "success", "message": "Эмбеддинги пересозданы"}, 200
+        socketio.emit(
+            'log_message',
+            {
+                'timestamp': dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'level': 'INFO',
+                'message': 'Пересоздание эмбенддингов'
+            },
+            namespace='/ws/logs'
+        )
+        rec = services["metadata_db"].get_file_by_name(filename)
+        if not rec:
+            return {"status": "error", "message": "Файл не найден"}, 404
+        return _rebuild_file_embeddings(rec, services)
     except Exception as e:
         logger.exception("Ошибка пересоздания эмбеддингов")
         return {"status": "error", "message": str(e)}, 500
 
 
-def get_logs(config_path: Path, limit: int = 100) -> Tuple[Dict[str, Any], int]:
+def set_file_tags(filename: str, tags: Any, services: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        return {"status": "error", "message": "tags должен быть списком строк"}, 400
     try:
-        raw_cfg = _yaml.load(config_path.open("r", encoding="utf-8"))
-        log_file = Path(raw_cfg["logging"]["file"])
-        if not log_file.exists():
+        rec = services["metadata_db"].get_file_by_name(filename)
+        if not rec:
+            return {"status": "error", "message": "Файл не найден"}, 404
+        tags = services["chunk_index"].set_tags(rec["id"], tags)
+        return {"status": "success", "tags": tags}, 200
+    except Exception as e:
+        logger.exception("Ошибка изменения тегов файла")
+        return {"status": "error", "message": str(e)}, 500
+
+
+def _rebuild_file_embeddings(rec: Dict[str, Any], services: Dict[str, Any],
+                             text: str | None = None) -> Tuple[Dict[str, Any], int]:
+    filename = Path(rec["path"]).name
+    with resources.workload("ingestion"), services["metadata_db"].session_factory() as session:
+        if text is None:
+            text = services["document_manager"].get_text(Path(rec["path"]), rec["file_hash"])
+        services["document_manager"].remember_caption(rec["id"], Path(rec["path"]), rec["file_hash"], text)
+        if not text or len(text.strip()) < 30:
+            logger.warning(
+                "Пустой или слишком короткий текст для файла: %s", filename)
+            return {"status": "error", "message": "Пустой или слишком короткий текст"}, 400
+        # Векторы пересчитываются все, если сменилась модель (или неизвестно, какой они построены);
+        # если изменилось только разбиение, считаются лишь новые фрагменты
+        fingerprint = index_fingerprint(services["config"])
+        previous = rec.get("index_fingerprint") or ""
+        services["chunk_index"].index_document(
+            rec["id"], filename, services["splitter"].iter_split(text),
+            reembed=previous.split(":")[0] != fingerprint.split(":")[0],
+            fingerprint=fingerprint,
+        )
+        session.query(File).filter(File.id == rec["id"]).update(
+            {"splitter_method": services["splitter"].config.method}
+        )
+        session.commit()
+    return {"status": "success", "message": "Эмбеддинги пересозданы"}, 200
+
+
+def _get_log_reader(config_path: Path) -> LogReader:
+    global _log_reader
+    if _log_reader is None:
+        cfg = _services["config"] if _services is not None else ConfigLoader(config_path).full
+        _log_reader = LogReader(cfg.logging.file)
+    return _log_reader
+
+
+def get_logs(config_path: Path, limit: int = 100, after: int | None = None, level: str | None = None) -> Tuple[Dict[str, Any], int]:
+    try:
+        reader = _get_log_reader(config_path)
+        if not reader.log_file.exists():
             return {"status": "error", "message": "Файл логов не найден"}, 500
-        with log_file.open("r", encoding="utf-8", errors="ignore") as f:
-            tail = f.readlines()[-limit:]
-        parsed = []
-        for line in tail:
-            try:
-                ts, lvl, msg = line.strip().split(" ", 2)
-                parsed.append({"timestamp": ts, "level": lvl, "message": msg})
-            except ValueError:
-                continue
-        return {"status": "success", "logs": parsed}, 200
+        if after is None:
+            parsed, cursor = reader.tail(limit, level)
+        else:
+            parsed, cursor = reader.read_after(after, limit, level)
+        return {"status": "success", "logs": parsed, "cursor": cursor}, 200
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
     except Exception as e:
         logger.exception("Ошибка получения логов")
         return {"status": "error", "message": str(e)}, 500
@@ -493,15 +614,30 @@ def start_app(config_path: Path, socketio: SocketIO = None) -> Tuple[Dict[str, A
     return {"status": "success", "message": "Запущено"}, 200
 
 
+def _close_history(services: Dict[str, Any] | None) -> None:
+    retention = (services or {}).get("history_retention")
+    if retention is not None:
+        retention.stop()
+    dialog_manager = (services or {}).get("dialog_manager")
+    if dialog_manager is None:
+        return
+    try:
+        dialog_manager.history.close()
+    except Exception:
+        logger.exception("Ошибка сохранения буфера истории")
+
+
 def stop_app(socketio: SocketIO = None):
     global _services, _running
 
     try:
         _running = False
+        _close_history(_services)
         _services.update({
         "generator": None,
         "speech": None,
         "dialog_manager": None,
+        "history_retention": None,
     })
     except Exception as e:
         return {"status": "error", "message": f"Ошибка при остановке: {e}"}, 500
@@ -509,6 +645,91 @@ def stop_app(socketio: SocketIO = None):
     return {"status": "success", "message": "Остановлено"}, 200
 
 
+def _model_bytes(model: Any) -> int:
+    if model is None or not hasattr(model, "parameters"):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _process_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _service_metrics():
+    """Состояние компонентов для /metrics: снимается только в момент запроса."""
+    services = _services or {}
+    queues = []
+    batcher = getattr(services.get("embedder"), "batcher", None)
+    if batcher is not None:
+        queues.append(({"queue": "embedding_batcher"}, batcher.depth))
+    dialog_manager = services.get("dialog_manager")
+    buffer = getattr(getattr(dialog_manager, "history", None), "buffer", None)
+    if buffer is not None:
+        queues.append(({"queue": "history_write"}, buffer.depth))
+    if services.get("chunk_index") is not None:
+        queues.append(({"queue": "chunk_gc"}, services["chunk_index"].gc_depth))
+    job = _rebuild_job
+    if job is not None and job.running:
+        queues.append(({"queue": "rebuild"}, job.total - job.done - job.failed))
+
+    workloads = resources.report()["workloads"]
+    models = {
+        "embedding": getattr(services.get("embedder"), "model", None),
+        "generator": getattr(services.get("generator"), "text_model", None),
+        "qa": getattr(services.get("generator"), "qa_model", None),
+    }
+    processor = getattr(services.get("document_manager"), "processor", None)
+    models["captioner"] = getattr(getattr(processor, "image_processor", None), "model", None)
+    memory = [({"kind": "process_rss"}, _process_rss_bytes())]
+    if torch.cuda.is_available():
+        for i in range(torch.cuda.device_count()):
+            memory.append(({"kind": "cuda_allocated", "device": f"cuda:{i}"}, torch.cuda.memory_allocated(i)))
+            memory.append(({"kind": "cuda_reserved", "device": f"cuda:{i}"}, torch.cuda.memory_reserved(i)))
+    return [
+        ("assistant_queue_depth", "Длина очередей фоновой обработки", queues),
+        ("assistant_compute_threads_in_use", "Занятые потоки CPU по видам нагрузки",
+         [({"workload": name}, w["threads_in_use"]) for name, w in workloads.items()]),
+        ("assistant_compute_active_calls", "Выполняющиеся вызовы моделей по видам нагрузки",
+         [({"workload": name}, w["active_calls"]) for name, w in workloads.items()]),
+        ("assistant_compute_waits_total", "Ожидания свободных потоков с запуска процесса",
+         [({"workload": name}, w["waits"]) for name, w in workloads.items()], "counter"),
+        ("assistant_model_memory_bytes", "Память весов загруженных моделей",
+         [({"model": name}, _model_bytes(model)) for name, model in models.items() if model is not None]),
+        ("assistant_memory_bytes", "Память процесса и CUDA", memory),
+    ]
+
+
+metrics_registry.register_collector(_service_metrics)
+
+
+def get_metrics() -> str:
+    """Метрики в текстовом формате Prometheus; сервисы не инициализируются."""
+    return metrics_registry.render()
+
+
+def get_compute_status() -> Tuple[Dict[str, Any], int]:
+    return {"status": "success", **resources.report()}, 200
+
+
+def compact_history(services: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    retention = services.get("history_retention")
+    if retention is None:
+        return {"status": "error", "message": "Приложение не запущено"}, 409
+    if not retention.enabled:
+        return {"status": "error", "message": "Ограничения хранения истории не заданы"}, 400
+    try:
+        stats = retention.compact_once()
+        return {"status": "success", "archived": stats}, 200
+    except Exception as e:
+        logger.exception("Ошибка уплотнения истории")
+        return {"status": "error", "message": str(e)}, 500
+
+
 def app_status() -> Tuple[Dict[str, Any], int]:
     return {"status": "success", "running": _running}, 200
 
@@ -524,6 +745,7 @@ def shutdown_app(request_environ: Dict[str, Any], socketio: SocketIO = None) ->
             },
             namespace='/ws/logs'
         )
+        _close_history(_services)
         fn = request_environ.get("werkzeug.server.shutdown")
         if fn is not None:
             fn()
@@ -553,7 +775,9 @@ def upload_files(files: List[Any], services: Dict[str, Any], socketio: SocketIO
         success_count = 0
         errors = []
         processed_files = []
+        saved: Dict[Path, str] = {}
         overwrite = request.form.get("overwrite", "false").lower() == "true"
+        tags = [t for t in request.form.get("tags", "").split(",") if t.strip()] or None
         for file in files:
             original_filename = file.filename
             if not original_filename:
@@ -567,14 +791,18 @@ def upload_files(files: List[Any], services: Dict[str, Any], socketio: SocketIO
                               "error": "Файл уже существует"})
                 continue
             file.save(str(file_path))
-            try:
-                process_single_file(file_path, services, socketio)
-                processed_files.append(filename)
-                success_count += 1
-            except Exception as e:
-                errors.append({"filename": original_filename, "error": str(e)})
+            saved[file_path] = original_filename
+        # Обрабатываем после сохранения всех файлов, чтобы изображения описать одним пакетом
+        document_manager = services["document_manager"]
+        failed = _process_new_files({p: document_manager.get_hash(p) for p in saved}, services, socketio, tags)
+        for file_path, original_filename in saved.items():
+            if file_path in failed:
+                errors.append({"filename": original_filename, "error": str(failed[file_path])})
                 file_path.unlink(missing_ok=True)
-                logger.exception("Ошибка обработки файла %s: %s", filename, e)
+                logger.error("Ошибка обработки файла %s: %s", file_path.name, failed[file_path])
+                continue
+            processed_files.append(file_path.name)
+            success_count += 1
         message = f"Добавлено и обработано {success_count} из {len(files)} файлов"
         if errors:
             message += f". Ошибки: {len(errors)}"
@@ -594,9 +822,21 @@ def upload_files(files: List[Any], services: Dict[str, Any], socketio: SocketIO
         return {"status": "error", "message": str(e)}, 500
 
 
-def rebuild_all_embeddings(services: Dict[str, Any], socketio: SocketIO = None) -> Tuple[Dict[str, Any], int]:
+def rebuild_all_embeddings(services: Dict[str, Any], socketio: SocketIO = None,
+                           force: bool = False) -> Tuple[Dict[str, Any], int]:
+    """
+    Пересоздать эмбеддинги файлов, индекс которых построен с другими настройками.
+
+    Файлы, уже пересозданные с текущим отпечатком настроек, пропускаются, поэтому
+    прерванное пересоздание продолжается с места остановки. *force* сбрасывает
+    контрольные точки и обрабатывает все файлы.
+    """
+    global _rebuild_job
     try:
-        with services["metadata_db"].session_factory() as session:
+        with _rebuild_lock:
+            if _rebuild_job is not None and _rebuild_job.running:
+                return {"status": "success", "message": "Пересоздание уже выполняется",
+                        "progress": _rebuild_job.status()}, 202
             socketio.emit(
                 'log_message',
                 {
@@ -606,26 +846,54 @@ def rebuild_all_embeddings(services: Dict[str, Any], socketio: SocketIO = None)
                 },
                 namespace='/ws/logs'
             )
-            files = services["metadata_db"].get_all_files()
+            metadata_db = services["metadata_db"]
+            if force:
+                metadata_db.clear_index_fingerprints()
+            files = metadata_db.get_files_to_rebuild(index_fingerprint(services["config"]))
             if not files:
-                return {"status": "success", "message": "Нет файлов для пересчета эмбеддингов"}, 200
-            success_count = 0
-            for file in files:
-                filename = Path(file["path"]).name
-                response, status = rebuild_embeddings(filename, services, socketio)
-                if status == 200:
-                    success_count += 1
-                else:
-                    logger.warning("Не удалось пересчитать эмбеддинги для %s: %s", filename, response.get(
-                        "message", "Неизвестная ошибка"))
-            return {
-                "status": "success",
-                "message": f"Эмбеддинги пересозданы для {success_count} из {len(files)} файлов"
-            }, 200
+                return {"status": "success", "message": "Эмбеддинги всех файлов актуальны"}, 200
+
+            def prefetch(batch: List[Dict[str, Any]]) -> Dict[str, str]:
+                with resources.workload("ingestion"):
+                    captions = services["document_manager"].get_image_texts(
+                        [Path(f["path"]) for f in batch], {Path(f["path"]): f["file_hash"] for f in batch})
+                return {str(path): text for path, text in captions.items()}
+
+            job = RebuildJob(
+                files,
+                lambda rec, text: _rebuild_file_embeddings(rec, services, text),
+                prefetch,
+                services["config"].rebuild,
+                chat_busy=lambda: resources.busy("chat"),
+            )
+            _rebuild_job = job
+            if services["config"].rebuild.background:
+                job.start()
+                return {"status": "success",
+                        "message": f"Пересоздание эмбеддингов запущено для {len(files)} файлов",
+                        "progress": job.status()}, 202
+        job.run()
+        return {
+            "status": "success" if job.state == "finished" else "error",
+            "message": f"Эмбеддинги пересозданы для {job.done} из {job.total} файлов"
+        }, 200 if job.state == "finished" else 500
     except Exception as e:
         logger.exception("Ошибка пересоздания эмбеддингов для всех файлов")
         return {"status": "error", "message": str(e)}, 500
 
+
+def get_rebuild_status() -> Tuple[Dict[str, Any], int]:
+    if _rebuild_job is None:
+        return {"status": "success", "progress": None}, 200
+    return {"status": "success", "progress": _rebuild_job.status()}, 200
+
+
+def _cancel_rebuild() -> None:
+    job = _rebuild_job
+    if job is not None and job.running:
+        job.cancel()
+
+
 def rebuild_services(config_path: str | Path = "config.yaml", socketio: SocketIO | None = None) -> Dict[str, Any]:
     """Пересоздает только существующие сервисы из _services, используя minimal_init_classes и full_init_classes."""
     global _services, _running
@@ -635,6 +903,12 @@ def rebuild_services(config_path: str | Path = "config.yaml", socketio: SocketIO
 
     # Сохраняем копию существующих сервисов
     existing_services = dict(_services)
+    _cancel_rebuild()
+    _close_history(existing_services)
+    if existing_services.get("embedder") is not None:
+        existing_services["embedder"].close()
+    if existing_services.get("chunk_index") is not None:
+        existing_services["chunk_index"].close()
 
     _services = None
 
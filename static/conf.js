@@ -2,6 +2,7 @@ const SPLITTER_METHOD = {
   "words": "по словам",
   "sentences": "по предложениям",
   "paragraphs": "по параграфам",
+  "tokens": "по токенам",
   "unknown": "неизвестно"
 };
 
@@ -229,11 +230,20 @@ async function optimizeConfig() {
   }
 }
 
-// Обновление списка файлов
-async function loadFiles() {
+// Курсор следующей страницы списка файлов (null — страниц больше нет)
+let filesNextCursor = null;
+const FILES_PAGE_SIZE = 100;
+
+// Обновление списка файлов; append=true догружает следующую страницу
+async function loadFiles(append = false) {
+  append = append === true;
   showToast("Запрос списка файлов...", "info");
   try {
-    const response = await fetch("/api/files");
+    const params = new URLSearchParams({ limit: FILES_PAGE_SIZE });
+    if (append && filesNextCursor !== null) {
+      params.set("cursor", filesNextCursor);
+    }
+    const response = await fetch(`/api/files?${params}`);
     if (!response.ok) {
       throw new Error(`HTTP ${response.status}`);
     }
@@ -244,7 +254,14 @@ async function loadFiles() {
         showToast("Ошибка: таблица документов не найдена", "error");
         return;
       }
-      tbody.innerHTML = "";
+      if (!append) {
+        tbody.innerHTML = "";
+      }
+      filesNextCursor = data.next_cursor ?? null;
+      const loadMoreBtn = document.getElementById("load-more-files");
+      if (loadMoreBtn) {
+        loadMoreBtn.style.display = filesNextCursor === null ? "none" : "";
+      }
       data.files.forEach(file => {
         if (!file || !file.name) {
           console.warn("Пропущен некорректный файл:", file);
@@ -609,7 +626,12 @@ function init() {
 
   const refreshBtn = document.getElementById("refresh-files");
   if (refreshBtn) {
-    refreshBtn.addEventListener("click", loadFiles);
+    refreshBtn.addEventListener("click", () => loadFiles());
+  }
+
+  const loadMoreBtn = document.getElementById("load-more-files");
+  if (loadMoreBtn) {
+    loadMoreBtn.addEventListener("click", () => loadFiles(true));
   }
 
   const startBtn = document.getElementById("start-app");
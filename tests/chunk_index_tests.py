@@ -0,0 +1,320 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from config_models import DatabaseConfig
+from modules.chunk_index import ChunkIndex, build_filters, chunk_hash, estimate_jaccard, minhash_signature, scope_where
+from modules.db import DBManager
+from modules.file_metadata_db import FileMetadataDB
+from modules.models import ChunkText
+from modules.shard_pruning import key_conditions
+
+
+def matches(meta, where):
+    """Проверка метаданных фильтром where в подмножестве синтаксиса Chroma"""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(matches(meta, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(meta, sub) for sub in cond):
+                return False
+        else:
+            value = meta.get(key)
+            cond = cond if isinstance(cond, dict) else {"$eq": cond}
+            ops = {"$eq": lambda x: value == x, "$in": lambda x: value in x,
+                   "$gte": lambda x: value is not None and value >= x,
+                   "$lte": lambda x: value is not None and value <= x}
+            if not all(ops[op](x) for op, x in cond.items()):
+                return False
+    return True
+
+
+class MemoryStorage:
+    """Векторное хранилище в памяти с интерфейсом EmbeddingStorage"""
+
+    def __init__(self):
+        self.vectors = {}
+        self.exact_searched = []
+
+    def add_embeddings(self, doc_ids, embeddings, metadatas):
+        for doc_id, emb, meta in zip(doc_ids, embeddings, metadatas):
+            self.vectors[doc_id] = (emb, dict(meta))
+
+    def delete_embeddings(self, doc_ids):
+        for doc_id in doc_ids:
+            self.vectors.pop(doc_id, None)
+
+    def search_similar(self, query_embedding, top_k=5, filters=None):
+        return self._rank(query_embedding, top_k, [i for i, (_, meta) in self.vectors.items() if matches(meta, filters)])
+
+    def search_among(self, query_embedding, top_k, doc_ids, metadatas=None):
+        self.exact_searched.extend(doc_ids)
+        return self._rank(query_embedding, top_k, doc_ids)
+
+    def _rank(self, query_embedding, top_k, doc_ids):
+        scored = [(doc_id, float(-np.abs(self.vectors[doc_id][0] - query_embedding).sum()))
+                  for doc_id in doc_ids if doc_id in self.vectors]
+        return sorted(scored, key=lambda hit: -hit[1])[:top_k]
+
+    def get_metadatas(self, doc_ids):
+        return {i: dict(self.vectors[i][1]) for i in doc_ids if i in self.vectors}
+
+    def update_metadata(self, doc_ids, metadatas):
+        # Как Chroma: ключи, которых нет в новых метаданных, сохраняются
+        for doc_id, meta in zip(doc_ids, metadatas):
+            self.vectors[doc_id][1].update(meta)
+
+    def iter_metadata(self, batch_size=1000):
+        items = list(self.vectors.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            yield [i for i, _ in batch], [meta for _, (_, meta) in batch]
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.texts = []
+
+    def embed_async(self, text):
+        self.texts.append(text)
+        future = Future()
+        future.set_result(np.full(3, len(text), dtype=np.float32))
+        return future
+
+
+@pytest.fixture
+def index(tmp_path):
+    manager = DBManager(DatabaseConfig(url=f"sqlite:///{tmp_path / 'files.db'}"))
+    manager.init_db()
+    metadata_db = FileMetadataDB(manager.session_scope)
+    yield ChunkIndex(metadata_db, MemoryStorage(), CountingEmbedder(), background_gc=False)
+    manager.engine.dispose()
+
+
+def test_edit_embeds_only_changed_chunks(index):
+    """Тест: после правки документа считаются только новые фрагменты, удалённые уходят из хранилища"""
+    file_id = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    index.index_document(file_id, "a.txt", ["раз", "два", "три"])
+    embedder = index.embedder
+    embedder.texts.clear()
+
+    stats = index.index_document(file_id, "a.txt", ["раз", "два изменено", "три"])
+
+    assert embedder.texts == ["два изменено"]
+    assert stats == {"added": 1, "kept": 2, "retired": 1}
+    assert sorted(index.texts(index.storage.vectors).values()) == ["два изменено", "раз", "три"]
+    assert [pos for pos, _, _ in index.metadata_db.get_chunks(file_id)] == [0, 1, 2]
+
+
+def test_legacy_vectors_migrated_once(index):
+    """Тест: миграция привязывает векторы старой схемы к файлу и удаляет бесхозные, повторно не сканирует"""
+    storage = index.storage
+    storage.add_embeddings(["a.txt_chunk1", "a.txt_chunk0", "gone.txt_chunk0", "0" * 32],
+                           [np.zeros(3)] * 4,
+                           [{"source": "a.txt", "content": "второй"}, {"source": "a.txt", "content": "первый"},
+                            {"source": "gone.txt", "content": "x"}, {"source": "a.txt"}])
+    file_id = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+
+    index.migrate_legacy_vectors()
+
+    assert sorted(storage.vectors) == ["a.txt_chunk0", "a.txt_chunk1"]
+    assert [vid for _, _, vid in index.metadata_db.get_chunks(file_id)] == ["a.txt_chunk0", "a.txt_chunk1"]
+    assert index.texts(storage.vectors) == {"a.txt_chunk0": "первый", "a.txt_chunk1": "второй"}
+    storage.iter_metadata = None
+    index.migrate_legacy_vectors()
+
+    # Дальше векторы старой схемы живут как обычные фрагменты
+    index.index_document(file_id, "a.txt", ["новый текст"])
+    assert "a.txt_chunk0" not in storage.vectors
+    assert len(storage.vectors) == 1
+
+    assert index.delete_document(file_id, "a.txt") == 1
+    assert storage.vectors == {}
+    assert index.texts(["a.txt_chunk0"]) == {}
+    assert index.metadata_db.get_chunks(file_id) == []
+
+
+def test_generations_allocated_atomically(index):
+    """Тест: параллельные записи поколений одного файла получают разные номера"""
+    db = index.metadata_db
+    file_id = db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    with ThreadPoolExecutor(8) as pool:
+        generations = list(pool.map(lambda i: db.add_chunk_generation(file_id, [(0, "h", f"v{i}")]), range(16)))
+    assert sorted(generations) == sorted(set(generations))
+
+
+def test_identical_chunks_share_one_vector(index):
+    """Тест: общий для документов фрагмент хранится одним вектором и живёт, пока на него есть ссылки"""
+    a = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    b = index.metadata_db.add_file("docs/b.txt", file_type="text/plain", size=1, file_hash="h2")
+    index.index_document(a, "a.txt", ["Конфиденциально", "текст А"])
+    index.embedder.texts.clear()
+
+    stats = index.index_document(b, "b.txt", ["Конфиденциально", "текст Б"])
+    assert index.embedder.texts == ["текст Б"]
+    assert stats["added"] == 1
+    assert len(index.storage.vectors) == 3
+    (shared,) = [vid for vid, text in index.texts(index.storage.vectors).items() if text == "Конфиденциально"]
+    assert index.sources([shared]) == {shared: ["a.txt", "b.txt"]}
+
+    index.delete_document(a, "a.txt")
+    assert shared in index.storage.vectors
+    index.delete_document(b, "b.txt")
+    assert index.storage.vectors == {}
+
+
+def test_minhash_similarity():
+    """Тест: MinHash отличает почти одинаковые тексты от разных"""
+    base = "Настоящий документ содержит конфиденциальную информацию и не подлежит распространению без согласия"
+    near = base + " компании"
+    other = "Отчёт о продажах за третий квартал показывает рост выручки в северном регионе"
+    assert estimate_jaccard(minhash_signature(base), minhash_signature(base)) == 1.0
+    assert estimate_jaccard(minhash_signature(base), minhash_signature(near)) > 0.7
+    assert estimate_jaccard(minhash_signature(base), minhash_signature(other)) < 0.2
+
+
+def test_generation_flip_hides_old_chunks_until_gc(index):
+    """Тест: после переключения поколения старые фрагменты не видны поиску, сборщик удаляет их по id"""
+    file_id = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    index.index_document(file_id, "a.txt", ["старый текст"])
+    (old_vid,) = index.storage.vectors
+
+    index.storage.add_embeddings(["new"], [np.zeros(3)], [{"source": "a.txt", "content": "новый текст"}])
+    index.metadata_db.add_chunk_generation(file_id, [(0, "new", "new")])
+    assert index.sources([old_vid, "new"]) == {old_vid: [], "new": ["a.txt"]}
+    assert index.metadata_db.get_files_with_stale_chunks() == [file_id]
+
+    assert index.collect(file_id) == 1
+    assert set(index.storage.vectors) == {"new"}
+    assert index.metadata_db.get_files_with_stale_chunks() == []
+
+
+def test_background_gc(index):
+    """Тест: фоновый сборщик удаляет старое поколение, close дожидается очереди"""
+    gc_index = ChunkIndex(index.metadata_db, index.storage, index.embedder)
+    file_id = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    gc_index.index_document(file_id, "a.txt", ["раз", "два"])
+    gc_index.index_document(file_id, "a.txt", ["раз", "три"])
+    gc_index.close()
+    assert sorted(index.texts(index.storage.vectors).values()) == ["раз", "три"]
+    assert index.metadata_db.get_files_with_stale_chunks() == []
+
+
+def test_scoped_search(index):
+    """Тест: область поиска по файлам, типам, тегам и датам проверяется фильтром по метаданным владельца"""
+    db = index.metadata_db
+    storage = index.storage
+    a = db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1", tags=["Отчёт", " финансы "])
+    b = db.add_file("docs/b.pdf", file_type="application/pdf", size=1, file_hash="h2")
+    index.index_document(a, "a.txt", ["общий колонтитул", "текст а"])
+    index.index_document(b, "b.pdf", ["общий колонтитул", "текст бэ"])
+    ids = {text: vid for vid, text in index.texts(storage.vectors).items()}
+    common = ids["общий колонтитул"]
+    meta = storage.vectors[common][1]
+    assert meta["file_id"] == a and isinstance(meta["uploaded_at"], float)
+    assert meta["mime_type"] == "text/plain" and meta["tag:отчёт"] is True
+
+    def found(**filters):
+        storage.exact_searched.clear()
+        return {vid for vid, _ in index.search(np.zeros(3, dtype=np.float32), 10, build_filters(**filters))}
+
+    # Общий вектор принадлежит a: через b он находится точным перебором, и только он
+    assert found(file_ids=[b]) == {common, ids["текст бэ"]}
+    assert storage.exact_searched == [common]
+    assert found(mime_types=["application/pdf"]) == {common, ids["текст бэ"]}
+    assert found(tags=["ОТЧЁТ"]) == {common, ids["текст а"]}
+    assert storage.exact_searched == []
+    assert found(tags=["отч"]) == set()
+    assert found(file_ids=[a], mime_types=["application/pdf"]) == set()
+    assert found(uploaded_after=time.time() + 3600) == set()
+    assert len(found(uploaded_before=time.time() + 3600)) == 3
+
+    index.set_tags(a, ["архив"])
+    assert found(tags=["отчёт"]) == set()
+    assert found(tags=["архив"]) == {common, ids["текст а"]}
+    assert storage.vectors[common][1]["tag:отчёт"] is False
+
+    # a больше не ссылается на общий фрагмент: его владельцем становится b
+    index.index_document(a, "a.txt", ["текст а"])
+    assert storage.vectors[common][1]["file_id"] == b
+    assert storage.vectors[common][1]["mime_type"] == "application/pdf"
+    assert found(file_ids=[a]) == {ids["текст а"]}
+    assert found(file_ids=[b]) == {common, ids["текст бэ"]}
+    assert storage.exact_searched == []
+    index.delete_document(b, "b.pdf")
+    assert found(mime_types=["application/pdf"]) == set()
+
+
+def test_scope_dates_compared_in_storage_format(index):
+    """Тест: границы дат сравниваются с created_at в формате CURRENT_TIMESTAMP, с точностью до секунды"""
+    db = index.metadata_db
+    a = db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    b = db.add_file("docs/b.txt", file_type="text/plain", size=1, file_hash="h2")
+    with db.session_factory() as session:
+        # Как пишет CURRENT_TIMESTAMP: без микросекунд
+        for file_id, stamp in ((a, "2024-03-01 12:00:00"), (b, "2024-03-01 12:00:05")):
+            session.execute(text("UPDATE files SET created_at = :t WHERE id = :id"), {"t": stamp, "id": file_id})
+    index.index_document(a, "a.txt", ["общий колонтитул"])
+    index.index_document(b, "b.txt", ["общий колонтитул"])
+    noon = datetime(2024, 3, 1, 12, tzinfo=timezone.utc).timestamp()
+
+    # Общий вектор принадлежит a, поэтому b он достаётся только через таблицу chunks
+    assert set(db.get_shared_scope_vectors(uploaded_after=noon + 0.5)) == {chunk_hash("общий колонтитул")}
+    assert db.get_shared_scope_vectors(uploaded_after=noon + 5.5) == {}
+    assert db.get_shared_scope_vectors(uploaded_after=noon, uploaded_before=noon + 4.9) == {}
+    assert db.get_shared_scope_vectors(uploaded_before=noon + 5) == {}
+    assert set(db.get_shared_scope_vectors(uploaded_after=noon + 5, uploaded_before=noon + 5)) == {
+        chunk_hash("общий колонтитул")}
+
+
+def test_scope_where():
+    """Тест: фильтр Chroma по области поиска, условие на дату отсекает шарды и рядом с тегами"""
+    assert scope_where({"file_ids": [1, 2]}) == {"file_id": {"$in": [1, 2]}}
+    where = scope_where({"tags": ["a", "b"], "uploaded_after": 10.0, "uploaded_before": 20.0})
+    assert where == {"$and": [{"$or": [{"tag:a": {"$eq": True}}, {"tag:b": {"$eq": True}}]},
+                              {"uploaded_at": {"$gte": 10.0}}, {"uploaded_at": {"$lte": 20.0}}]}
+    assert key_conditions(where, "uploaded_at") == [{"$gte": 10.0}, {"$lte": 20.0}]
+
+
+def test_owner_metadata_migration(index):
+    """Тест: векторы, записанные без типа и тегов владельца, дописываются однократной миграцией"""
+    db = index.metadata_db
+    a = db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1", tags=["отчёт"])
+    index.index_document(a, "a.txt", ["текст а"])
+    (vid,) = index.storage.vectors
+    index.storage.vectors[vid] = (index.storage.vectors[vid][0], {"source": "a.txt", "file_id": a, "uploaded_at": 0.0})
+
+    index.migrate()
+
+    assert index.storage.vectors[vid][1]["mime_type"] == "text/plain"
+    assert index.storage.vectors[vid][1]["tag:отчёт"] is True
+    assert db.is_migration_applied("vector_owners")
+
+
+def test_build_filters():
+    """Тест: фильтры запроса нормализуются в область поиска"""
+    assert build_filters() is None
+    assert build_filters(file_ids=[3, 3]) == {"file_ids": [3]}
+    assert build_filters(tags=["A", "b"], uploaded_after=10) == {"tags": ["a", "b"], "uploaded_after": 10.0}
+    assert build_filters(tags=[" "]) is None
+    assert build_filters(mime_types=["application/pdf"]) == {"mime_types": ["application/pdf"]}
+
+
+def test_chunk_text_store_roundtrip(index):
+    """Тест: полный текст фрагмента хранится отдельно, длинный — сжатым, и читается пачкой"""
+    long_text = "Длинный фрагмент документа. " * 100
+    file_id = index.metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    index.index_document(file_id, "a.txt", [long_text, "короткий"])
+    assert all("content" not in m for _, m in index.storage.vectors.values())
+    assert sorted(index.texts(list(index.storage.vectors) + ["unknown"]).values()) == sorted([long_text, "короткий"])
+    with index.metadata_db.session_factory() as session:
+        rows = {r.compressed: len(r.data) for r in session.query(ChunkText)}
+    assert rows[False] == len("короткий".encode("utf-8"))
+    assert rows[True] < len(long_text.encode("utf-8")) // 10
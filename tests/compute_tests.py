@@ -0,0 +1,60 @@
+import threading
+import time
+
+from config_models import ComputeConfig
+from modules.compute import ComputeResources
+
+
+def test_budgets_split_between_workloads():
+    """Тест: потоки делятся между чатом и индексацией, модели ограничены бюджетом"""
+    res = ComputeResources(ComputeConfig(total_threads=8, chat_share=0.25, embedding_threads=4))
+    assert res.budgets == {"chat": 2, "ingestion": 6}
+    assert res.threads_for("embedding", "chat") == 2
+    assert res.threads_for("embedding", "ingestion") == 4
+    assert res.threads_for("generator", "ingestion") == 6
+
+
+def test_workload_context_is_per_thread():
+    """Тест: вид нагрузки задаётся для текущего потока"""
+    res = ComputeResources(ComputeConfig(total_threads=4))
+    seen = []
+    with res.workload("ingestion"):
+        t = threading.Thread(target=lambda: seen.append(res.current_workload()))
+        t.start()
+        t.join()
+        assert res.current_workload() == "ingestion"
+    assert seen == ["chat"]
+    assert res.current_workload() == "chat"
+
+
+def test_slot_waits_for_budget():
+    """Тест: вызовы сверх бюджета ждут освобождения потоков"""
+    res = ComputeResources(ComputeConfig(total_threads=4, chat_share=0.5, embedding_threads=2))
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def call():
+        with res.slot("embedding"):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 1
+    report = res.report()["workloads"]["chat"]
+    assert report["threads_in_use"] == 0 and report["waits"] >= 1
+
+
+def test_gpu_calls_skip_budget():
+    """Тест: вызовы на GPU не занимают процессорные потоки"""
+    res = ComputeResources(ComputeConfig(total_threads=2))
+    with res.slot("generator", device="cuda:0") as n:
+        assert n == 0
+        assert res.report()["workloads"]["chat"]["threads_in_use"] == 0
@@ -0,0 +1,76 @@
+import pytest
+from config_models import DatabaseConfig, DialogHistoryConfig
+from modules.db import DBManager
+from modules.dialog_history import DialogHistory
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Фикстура с временной SQLite-базой"""
+    manager = DBManager(DatabaseConfig(url=f"sqlite:///{tmp_path / 'history.db'}"))
+    manager.init_db()
+    yield manager
+    manager.engine.dispose()
+
+
+@pytest.fixture
+def history(db):
+    """Фикстура истории с отложенной записью и большим интервалом сброса"""
+    h = DialogHistory(db.session_scope, DialogHistoryConfig(flush_batch_size=100, flush_interval_ms=60_000))
+    yield h
+    h.close()
+
+
+def test_fetch_reads_through_buffer(history):
+    """Тест: несохранённые записи видны в fetch_latest"""
+    history.save("u1", "q1", "a1")
+    history.save("u2", "q2", "a2")
+    assert history.buffer.depth == 2
+    assert [e["user"] for e in history.fetch_latest("u1")] == ["q1"]
+
+
+def test_flush_writes_batch_without_duplicates(history, db):
+    """Тест: после сброса записи берутся из БД без дублей"""
+    for i in range(3):
+        history.save("u1", f"q{i}", f"a{i}")
+    assert history.buffer.flush() == 3
+    assert history.buffer.depth == 0
+    history.save("u1", "q3", "a3")
+    entries = history.fetch_latest("u1", limit=3)
+    assert [e["user"] for e in entries] == ["q1", "q2", "q3"]
+
+
+def test_clear_drops_buffered_records(history):
+    """Тест: очистка истории учитывает записи в буфере"""
+    history.save("u1", "q1", "a1")
+    history.clear_user_history("u1")
+    history.buffer.flush()
+    assert history.fetch_latest("u1") == []
+
+
+def test_close_flushes(db):
+    """Тест: остановка буфера сохраняет остаток"""
+    h = DialogHistory(db.session_scope, DialogHistoryConfig(flush_batch_size=100, flush_interval_ms=60_000))
+    h.save("u1", "q1", "a1")
+    h.close()
+    assert [e["user"] for e in DialogHistory(db.session_scope).fetch_latest("u1")] == ["q1"]
+
+
+def test_cache_populated_on_save(history):
+    """Тест: кэш подгружается при чтении и пополняется при сохранении"""
+    history.save("u1", "q1", "a1")
+    history.fetch_latest("u1")
+    history.save("u1", "q2", "a2")
+    assert [e["user"] for e in history.cache.get("u1")] == ["q1", "q2"]
+    history.clear_user_history("u1")
+    assert history.cache.get("u1") == []
+
+
+def test_etag_changes_with_history(history):
+    """Тест: ETag меняется только при изменении истории"""
+    history.save("u1", "q1", "a1")
+    _, etag1 = history.fetch_latest_with_etag("u1")
+    _, etag2 = history.fetch_latest_with_etag("u1")
+    history.save("u1", "q2", "a2")
+    _, etag3 = history.fetch_latest_with_etag("u1")
+    assert etag1 == etag2 != etag3
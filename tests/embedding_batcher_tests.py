@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+import pytest
+from modules.embedding_batcher import EmbeddingBatcher
+
+
+class RecordingEncoder:
+    """Кодировщик-заглушка: эмбеддинг — длина текста, вызовы запоминаются"""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts, normalize, workload):
+        with self.lock:
+            self.calls.append(list(texts))
+        return [np.array([len(t)], dtype=float) for t in texts]
+
+
+def test_concurrent_requests_share_batch():
+    """Тест: запросы из разных потоков объединяются в один вызов encode"""
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=200)
+    results = {}
+
+    def worker(i):
+        results[i] = batcher.submit("x" * (16 + i)).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+    assert [results[i][0] for i in range(8)] == [16 + i for i in range(8)]
+    assert len(encoder.calls) == 1
+
+
+def test_length_buckets_split_batches():
+    """Тест: короткие и длинные тексты кодируются отдельными batch"""
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=50)
+    futures = [batcher.submit(t) for t in ("ab", "cd", "x" * 500)]
+    assert [f.result(timeout=5)[0] for f in futures] == [2, 2, 500]
+    batcher.close()
+    assert sorted(encoder.calls, key=len) == [["x" * 500], ["ab", "cd"]]
+
+
+def test_workloads_not_mixed():
+    """Тест: запросы чата и индексации кодируются разными batch"""
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=50)
+    futures = [batcher.submit("ab", workload="chat"), batcher.submit("cd", workload="ingestion")]
+    for f in futures:
+        f.result(timeout=5)
+    batcher.close()
+    assert sorted(encoder.calls) == [["ab"], ["cd"]]
+
+
+def test_encode_error_reaches_callers():
+    """Тест: ошибка модели передаётся во все Future batch"""
+    def failing(texts, normalize, workload):
+        raise RuntimeError("boom")
+
+    batcher = EmbeddingBatcher(failing, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit("text").result(timeout=5)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit("text")
+
+
+def test_blocked_workload_does_not_delay_other():
+    """Тест: пока вызов чата ждёт бюджета, batch индексации выполняется своим диспетчером"""
+    release = threading.Event()
+    calls = []
+
+    def encode(texts, normalize, workload):
+        if workload == "chat":
+            release.wait(timeout=5)
+        calls.append(workload)
+        return [np.zeros(1) for _ in texts]
+
+    batcher = EmbeddingBatcher(encode, max_wait_ms=1)
+    chat = batcher.submit("вопрос", workload="chat")
+    ingestion = batcher.submit("фрагмент", workload="ingestion")
+    ingestion.result(timeout=2)
+    assert not chat.done()
+    release.set()
+    chat.result(timeout=5)
+    batcher.close()
+    assert calls == ["ingestion", "chat"]
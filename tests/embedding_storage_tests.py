@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from config_models import EmbeddingStorageConfig
+from modules.chunk_index import build_filters, scope_where
+from modules.embedding_storage import EmbeddingStorage
+
+
+def _ts(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = EmbeddingStorage(EmbeddingStorageConfig(
+        db_path=str(tmp_path / "chroma"), collection_name="docs", embedding_dim=3,
+        similarity_threshold=-1.0, shard_by="time"))
+    yield storage
+    storage.close()
+
+
+class QueryCounter:
+    """Шарды, которые поиск выбрал для опроса"""
+
+    def __init__(self, storage, monkeypatch):
+        self.queried = []
+        prune, ids_by_shard = storage._prune, storage._ids_by_shard
+
+        def pruned(filters):
+            shards = prune(filters)
+            self.queried.extend(collection.name for collection in shards if collection.count())
+            return shards
+
+        def grouped(doc_ids, metadatas=None):
+            groups = ids_by_shard(doc_ids, metadatas)
+            self.queried.extend(groups)
+            return groups
+
+        monkeypatch.setattr(storage, "_prune", pruned)
+        monkeypatch.setattr(storage, "_ids_by_shard", grouped)
+
+
+def test_scope_dates_prune_time_shards(storage, monkeypatch):
+    """Тест: поиск с областью по датам опрашивает только шарды подходящих месяцев, по обоим путям"""
+    months = [_ts(2024, 1, 10), _ts(2024, 2, 10), _ts(2024, 3, 10)]
+    storage.add_embeddings(
+        ["jan", "feb", "mar"],
+        [np.array([1.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), np.array([0.0, 0.0, 1.0])],
+        [{"source": f"{i}.txt", "file_id": i, "uploaded_at": ts} for i, ts in enumerate(months)])
+    counter = QueryCounter(storage, monkeypatch)
+    query = np.array([1.0, 1.0, 1.0], dtype=np.float32)
+
+    where = scope_where(build_filters(uploaded_after=_ts(2024, 3, 1)))
+    assert [doc_id for doc_id, _ in storage.search_similar(query, top_k=3, filters=where)] == ["mar"]
+    assert counter.queried == ["docs__t_202403"]
+
+    counter.queried.clear()
+    assert len(storage.search_similar(query, top_k=3)) == 3
+    assert sorted(counter.queried) == ["docs__t_202401", "docs__t_202402", "docs__t_202403"]
+
+    # Точный перебор по списку id читает только шарды, указанные метаданными
+    counter.queried.clear()
+    hits = storage.search_among(query, 3, ["feb"], [{"uploaded_at": months[1]}])
+    assert [doc_id for doc_id, _ in hits] == ["feb"]
+    assert counter.queried == ["docs__t_202402"]
@@ -0,0 +1,76 @@
+import pytest
+from config_models import DatabaseConfig
+from modules.db import DBManager
+from modules.file_metadata_db import FileMetadataDB
+from modules.models import File, Image
+
+
+@pytest.fixture
+def metadata_db(tmp_path):
+    """Фикстура с временной SQLite-базой"""
+    manager = DBManager(DatabaseConfig(url=f"sqlite:///{tmp_path / 'files.db'}"))
+    manager.init_db()
+    yield FileMetadataDB(manager.session_scope)
+    manager.engine.dispose()
+
+
+def test_caption_cache_keyed_by_hash_and_model(metadata_db):
+    """Тест: описание находится по хэшу файла и только для той же модели"""
+    file_id = metadata_db.add_file("docs/cat.png", file_type="image/png", size=10, file_hash="h1")
+    metadata_db.save_image_caption(file_id, file_hash="h1", caption_model="blip", caption="Image: cat.png\ncat",
+                                   width=4, height=3, thumbnail=b"png")
+    assert metadata_db.get_cached_captions(["h1", "h2"], "blip") == {"h1": "Image: cat.png\ncat"}
+    assert metadata_db.get_cached_captions(["h1"], "blip-large") == {}
+    with metadata_db.session_factory() as session:
+        image = session.get(Image, file_id)
+        assert (image.width, image.height, image.thumbnail) == (4, 3, b"png")
+
+
+def test_caption_cache_replaced_for_new_model(metadata_db):
+    """Тест: повторное сохранение заменяет описание и модель"""
+    file_id = metadata_db.add_file("docs/cat.png", file_type="image/png", size=10, file_hash="h1")
+    metadata_db.save_image_caption(file_id, file_hash="h1", caption_model="blip", caption="old")
+    metadata_db.save_image_caption(file_id, file_hash="h1", caption_model="blip-large", caption="new")
+    assert metadata_db.get_cached_captions(["h1"], "blip") == {}
+    assert metadata_db.get_cached_captions(["h1"], "blip-large") == {"h1": "new"}
+
+
+def test_rebuild_checkpoint_by_fingerprint(metadata_db):
+    """Тест: файл, переключённый на новое поколение с отпечатком, не попадает в пересоздание"""
+    a = metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    b = metadata_db.add_file("docs/b.txt", file_type="text/plain", size=1, file_hash="h2")
+    assert [f["id"] for f in metadata_db.get_files_to_rebuild("m:s")] == [a, b]
+    metadata_db.add_chunk_generation(a, [(0, "x", "x")], fingerprint="m:s")
+    assert [f["id"] for f in metadata_db.get_files_to_rebuild("m:s")] == [b]
+    assert [f["id"] for f in metadata_db.get_files_to_rebuild("m:s2")] == [a, b]
+    metadata_db.clear_index_fingerprints()
+    assert len(metadata_db.get_files_to_rebuild("m:s")) == 2
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_list_files_pages_by_created_at(metadata_db, descending):
+    """Тест: постраничный обход по created_at возвращает каждый файл ровно один раз"""
+    ids = [metadata_db.add_file(f"docs/{i}.txt", file_type="text/plain", size=i, file_hash=f"h{i}")
+           for i in range(28)]
+    with metadata_db.session_factory() as session:
+        # Старые записи без даты
+        session.query(File).filter(File.id.in_(ids[:3])).update({File.created_at: None}, synchronize_session=False)
+
+    seen, cursor = [], None
+    for _ in range(10):
+        page, cursor, _ = metadata_db.list_files(limit=5, after_id=cursor, sort="created_at", descending=descending)
+        seen += [f["id"] for f in page]
+        if cursor is None:
+            break
+    assert sorted(seen) == ids
+    assert len(seen) == len(ids)
+    nulls = seen[:3] if not descending else seen[-3:]
+    assert sorted(nulls) == ids[:3]
+
+
+def test_list_files_deleted_cursor(metadata_db):
+    """Тест: курсор на удалённый файл — ошибка, а не пустая страница"""
+    file_id = metadata_db.add_file("docs/a.txt", file_type="text/plain", size=1, file_hash="h1")
+    metadata_db.delete_file(file_id)
+    with pytest.raises(ValueError):
+        metadata_db.list_files(after_id=file_id, sort="created_at")
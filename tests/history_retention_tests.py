@@ -0,0 +1,52 @@
+import datetime as dt
+
+import pytest
+from config_models import DatabaseConfig, DialogHistoryConfig
+from modules.db import DBManager
+from modules.dialog_history import DialogHistory
+from modules.history_retention import HistoryRetention
+from modules.models import Dialog
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Фикстура с временной SQLite-базой"""
+    manager = DBManager(DatabaseConfig(url=f"sqlite:///{tmp_path / 'history.db'}"))
+    manager.init_db()
+    yield manager
+    manager.engine.dispose()
+
+
+def _config(tmp_path, **kwargs):
+    return DialogHistoryConfig(write_behind=False, archive_dir=str(tmp_path / "archive"),
+                               compaction_chunk_size=3, **kwargs)
+
+
+def test_per_user_cap(db, tmp_path):
+    """Тест: реплики сверх лимита переносятся в архив"""
+    config = _config(tmp_path, retention_max_turns_per_user=2)
+    history = DialogHistory(db.session_scope, config)
+    for i in range(7):
+        history.save("u1", f"q{i}", f"a{i}")
+    history.save("u2", "x", "y")
+    retention = HistoryRetention(db.session_scope, config, history)
+    assert retention.compact_once() == {"expired": 0, "over_limit": 5}
+    assert [e["user"] for e in history.fetch_latest("u1")] == ["q5", "q6"]
+    assert len(history.fetch_latest("u2")) == 1
+    archived = retention.archive.read(next((tmp_path / "archive").iterdir()))
+    assert [r["user_text"] for r in archived] == ["q0", "q1", "q2", "q3", "q4"]
+
+
+def test_max_age(db, tmp_path):
+    """Тест: устаревшие реплики удаляются, свежие остаются"""
+    config = _config(tmp_path, retention_max_age_days=30)
+    old = dt.datetime(2020, 1, 15)
+    with db.session_scope() as session:
+        for i in range(5):
+            session.add(Dialog(user_id="u1", timestamp=old, user_text=f"old{i}", assistant_text="a"))
+    history = DialogHistory(db.session_scope, config)
+    history.save("u1", "new", "a")
+    retention = HistoryRetention(db.session_scope, config, history)
+    assert retention.compact_once()["expired"] == 5
+    assert [e["user"] for e in history.fetch_latest("u1")] == ["new"]
+    assert (tmp_path / "archive" / "dialogs-2020-01.jsonl.gz").exists()
@@ -0,0 +1,62 @@
+import pytest
+from modules.log_reader import LogReader
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    """Фикстура с лог-файлом, содержащим многострочную запись"""
+    lines = []
+    for i in range(500):
+        level = "ERROR" if i % 100 == 0 else "INFO"
+        lines.append(f"2025-01-01 10:00:{i % 60:02d} {level:<8} [app] message {i}")
+    lines.append("2025-01-01 10:01:00 ERROR    [app] failure")
+    lines.append("Traceback (most recent call last):")
+    lines.append("  ValueError: boom")
+    path = tmp_path / "app.log"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def test_tail_returns_last_records(log_file):
+    """Тест чтения последних записей маленькими блоками"""
+    reader = LogReader(log_file, block_size=128)
+    records, cursor = reader.tail(limit=3)
+    assert [r["message"].split("\n")[0] for r in records] == [
+        "[app] message 498", "[app] message 499", "[app] failure"]
+    assert records[-1]["message"].endswith("ValueError: boom")
+    assert cursor == log_file.stat().st_size
+
+
+def test_tail_level_filter(log_file):
+    """Тест фильтрации по минимальному уровню"""
+    reader = LogReader(log_file, block_size=256)
+    records, _ = reader.tail(limit=10, level="error")
+    assert len(records) == 6
+    assert all(r["level"] == "ERROR" for r in records)
+    assert records[0]["message"] == "[app] message 0"
+
+
+def test_read_after_cursor(log_file):
+    """Тест инкрементального чтения после курсора"""
+    reader = LogReader(log_file)
+    _, cursor = reader.tail(limit=1)
+    with log_file.open("a", encoding="utf-8") as f:
+        f.write("2025-01-01 10:02:00 WARNING  [app] new one\n")
+        f.write("2025-01-01 10:02:01 INFO     [app] partial")
+    records, new_cursor = reader.read_after(cursor)
+    assert [r["message"] for r in records] == ["[app] new one"]
+    assert reader.read_after(new_cursor) == ([], new_cursor)
+
+
+def test_read_after_rotated_file(log_file):
+    """Тест: курсор за концом файла (ротация) возвращает хвост"""
+    reader = LogReader(log_file)
+    records, cursor = reader.read_after(10 ** 9, limit=2)
+    assert len(records) == 2
+    assert cursor == log_file.stat().st_size
+
+
+def test_unknown_level(log_file):
+    """Тест неизвестного уровня логирования"""
+    with pytest.raises(ValueError):
+        LogReader(log_file).tail(level="LOUD")
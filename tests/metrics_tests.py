@@ -0,0 +1,63 @@
+import pytest
+
+from modules.metrics import MetricsRegistry, cache_lookup, registry
+
+
+def test_histogram_render():
+    """Тест: гистограмма выдаётся кумулятивными корзинами с суммой и числом наблюдений"""
+    reg = MetricsRegistry()
+    hist = reg.histogram("stage_seconds", "Этапы", ("stage",), buckets=(0.1, 1.0))
+    hist.observe(0.05, stage="embed")
+    hist.observe(0.5, stage="embed")
+    hist.observe(5.0, stage="embed")
+    with hist.time(stage="search"):
+        pass
+
+    lines = reg.render().splitlines()
+    assert lines[:2] == ["# HELP stage_seconds Этапы", "# TYPE stage_seconds histogram"]
+    assert 'stage_seconds_bucket{stage="embed",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="embed"} 5.55' in lines
+    assert 'stage_seconds_count{stage="embed"} 3' in lines
+    assert hist.count(stage="search") == 1
+    assert reg.histogram("stage_seconds", "Этапы", ("stage",)) is hist
+
+
+def test_counter_labels_and_collectors():
+    """Тест: счётчик проверяет метки, сборщики вызываются при выдаче, сбой сборщика не мешает остальным"""
+    reg = MetricsRegistry()
+    counter = reg.counter("files_total", "Файлы", ("result",))
+    counter.inc(result="indexed")
+    counter.inc(2, result="indexed")
+    with pytest.raises(ValueError):
+        counter.inc(stage="x")
+    with pytest.raises(ValueError):
+        reg.histogram("files_total", "Файлы")
+
+    calls = []
+
+    def queues():
+        calls.append(1)
+        return [("queue_depth", "Очереди", [({"queue": 'a"b'}, 3)]),
+                ("waits_total", "Ожидания", [({}, 7)], "counter")]
+
+    reg.register_collector(lambda: 1 / 0)
+    reg.register_collector(queues)
+    assert calls == []
+    text = reg.render()
+    assert 'files_total{result="indexed"} 3' in text
+    assert "# TYPE queue_depth gauge" in text
+    assert 'queue_depth{queue="a\\"b"} 3' in text
+    assert "# TYPE waits_total counter" in text
+    assert "waits_total 7" in text
+    assert calls == [1]
+
+
+def test_cache_hit_ratio():
+    """Тест: доля попаданий в кэш считается из счётчика обращений"""
+    for hit in (True, True, True, False):
+        cache_lookup("metrics_test", hit)
+    text = registry.render()
+    assert 'assistant_cache_requests_total{cache="metrics_test",result="hit"} 3' in text
+    assert 'assistant_cache_hit_ratio{cache="metrics_test"} 0.75' in text
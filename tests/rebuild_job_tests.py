@@ -0,0 +1,45 @@
+import time
+
+from config_models import RebuildConfig
+from modules.rebuild_job import RebuildJob
+
+
+def _files(n):
+    return [{"id": i, "name": f"f{i}.txt", "path": f"docs/f{i}.txt"} for i in range(n)]
+
+
+def test_runs_in_batches_and_counts_failures():
+    """Тест: текст берётся из порции prefetch, ошибки файла не останавливают задачу"""
+    prefetched, seen = [], []
+
+    def prefetch(batch):
+        prefetched.append([f["id"] for f in batch])
+        return {f["path"]: f"text {f['id']}" for f in batch}
+
+    def rebuild_one(rec, text):
+        seen.append(text)
+        if rec["id"] == 2:
+            raise RuntimeError("boom")
+        return {"status": "success"}, 200
+
+    job = RebuildJob(_files(5), rebuild_one, prefetch, RebuildConfig(batch_size=2))
+    job.run()
+    assert prefetched == [[0, 1], [2, 3], [4]]
+    assert seen == [f"text {i}" for i in range(5)]
+    assert job.status() == {"state": "finished", "total": 5, "done": 4, "failed": 1, "current": None}
+
+
+def test_cancel_and_yield_to_chat():
+    """Тест: отмена в фоне останавливает задачу, ожидание чата ограничено yield_to_chat_ms"""
+    cfg = RebuildConfig(batch_size=10, yield_to_chat_ms=30)
+    t0 = time.monotonic()
+    job = RebuildJob(_files(3), lambda rec, text: ({}, 200), lambda batch: {}, cfg, chat_busy=lambda: True)
+    job.run()
+    assert job.done == 3
+    assert 0.09 <= time.monotonic() - t0 < 1.0
+
+    job = RebuildJob(_files(1000), lambda rec, text: (time.sleep(0.001), ({}, 200))[1], lambda batch: {}, cfg)
+    job.start()
+    job.cancel()
+    assert job.state == "cancelled"
+    assert job.done < 1000
@@ -0,0 +1,160 @@
+import hashlib
+from concurrent.futures import Future
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import services
+from config_models import DatabaseConfig, EmbeddingHandlerConfig
+from modules.chunk_index import ChunkIndex
+from modules.db import DBManager
+from modules.file_metadata_db import FileMetadataDB
+
+
+class MemoryStorage:
+    def __init__(self):
+        self.vectors = {}
+        self.metadatas = {}
+
+    def add_embeddings(self, doc_ids, embeddings, metadatas):
+        self.vectors.update(zip(doc_ids, embeddings))
+        self.metadatas.update(zip(doc_ids, metadatas))
+
+    def delete_embeddings(self, doc_ids):
+        for doc_id in doc_ids:
+            self.vectors.pop(doc_id, None)
+            self.metadatas.pop(doc_id, None)
+
+    def get_metadatas(self, doc_ids):
+        return {i: self.metadatas[i] for i in doc_ids if i in self.metadatas}
+
+    def update_metadata(self, doc_ids, metadatas):
+        for doc_id, meta in zip(doc_ids, metadatas):
+            self.metadatas[doc_id] = {**self.metadatas[doc_id], **meta}
+
+    def iter_metadata(self, batch_size=1000):
+        return iter(())
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.texts = []
+
+    def embed_async(self, text):
+        self.texts.append(text)
+        future = Future()
+        future.set_result(np.zeros(3, dtype=np.float32))
+        return future
+
+
+class TextDocumentManager:
+    """DocumentManager для .txt без обработчиков форматов; метаданные пишет так же, как настоящий"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def is_supported_format(self, file_path):
+        return Path(file_path).suffix == ".txt"
+
+    def get_hash(self, file_path):
+        return hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+
+    def get_metadata(self, file_path):
+        return {"mime_type": "text/plain", "size": Path(file_path).stat().st_size}
+
+    def save_metadata(self, file_path):
+        meta = self.get_metadata(file_path)
+        meta["hash"] = self.get_hash(file_path)
+        self.db.upsert_metadata(str(file_path), meta)
+
+    def get_text(self, file_path, file_hash=None):
+        return Path(file_path).read_text(encoding="utf-8")
+
+    def get_image_texts(self, file_paths, hashes=None):
+        return {}
+
+    def remember_caption(self, *args):
+        pass
+
+    def forget_text(self, file_hash):
+        pass
+
+
+class LineSplitter:
+    def iter_split(self, text):
+        return iter(text.splitlines())
+
+
+class NullSocket:
+    def emit(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def svc(tmp_path):
+    manager = DBManager(DatabaseConfig(url=f"sqlite:///{tmp_path / 'files.db'}"))
+    manager.init_db()
+    metadata_db = FileMetadataDB(manager.session_scope)
+    docs = tmp_path / "documents"
+    docs.mkdir()
+    yield {
+        "config": SimpleNamespace(documents_folder=str(docs),
+                                  embedding_handler=EmbeddingHandlerConfig(device="cpu", model_path="model"),
+                                  splitter={"method": "lines"}),
+        "metadata_db": metadata_db,
+        "document_manager": TextDocumentManager(metadata_db),
+        "splitter": LineSplitter(),
+        "chunk_index": ChunkIndex(metadata_db, MemoryStorage(), CountingEmbedder(), background_gc=False),
+    }
+    manager.engine.dispose()
+
+
+def _start(svc):
+    """Как build_services: автозагрузка метаданных папки, затем её обработка."""
+    services._autoload_documents(svc["config"], svc["document_manager"])
+    services.process_folder(Path(svc["config"].documents_folder), svc, NullSocket())
+
+
+def test_file_edited_in_place_reindexed_on_start(svc):
+    """Тест: файл, изменённый между запусками, переиндексируется, его старые фрагменты уходят из индекса"""
+    path = Path(svc["config"].documents_folder) / "a.txt"
+    path.write_text("Первая строка договора поставки.\nСтарая строка про сроки оплаты счёта.", encoding="utf-8")
+    # Файл загружен и проиндексирован, перезапуск без изменений ничего не пересчитывает
+    services.process_single_file(path, svc, NullSocket())
+    index = svc["chunk_index"]
+    index.embedder.texts.clear()
+    _start(svc)
+    assert index.embedder.texts == []
+    (rec,) = svc["metadata_db"].get_all_files()
+    assert sorted(index.texts(index.storage.vectors).values()) == [
+        "Первая строка договора поставки.", "Старая строка про сроки оплаты счёта."]
+
+    path.write_text("Первая строка договора поставки.\nНовая строка про сроки оплаты счёта.", encoding="utf-8")
+    _start(svc)
+
+    (updated,) = svc["metadata_db"].get_all_files()
+    assert updated["id"] == rec["id"]
+    assert updated["file_hash"] == svc["document_manager"].get_hash(path)
+    assert index.embedder.texts == ["Новая строка про сроки оплаты счёта."]
+    assert sorted(index.texts(index.storage.vectors).values()) == [
+        "Новая строка про сроки оплаты счёта.", "Первая строка договора поставки."]
+
+
+def test_delete_file_removes_image_row(svc):
+    """Тест: удаление файла снимает и его строку images (каскад ORM, внешние ключи SQLite выключены)"""
+    path = Path(svc["config"].documents_folder) / "a.txt"
+    path.write_text("Описание изображения кошки на подоконнике у окна.", encoding="utf-8")
+    services.process_single_file(path, svc, NullSocket())
+    db = svc["metadata_db"]
+    (rec,) = db.get_all_files()
+    db.save_image_caption(rec["id"], file_hash=rec["file_hash"], caption_model="blip", caption="cat")
+
+    result, status = services.delete_file("a.txt", svc, NullSocket())
+
+    assert status == 200, result
+    assert db.get_all_files() == []
+    assert db.get_image_metadata(rec["id"]) is None
+    assert db.get_cached_captions([rec["file_hash"]], "blip") == {}
+    assert not path.exists()
@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+from modules.shard_pruning import key_conditions, month_matches, month_start, next_month
+
+
+def _ts(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_month_boundaries():
+    """Тест: начало месяца и следующий месяц, в том числе через границу года"""
+    assert month_start(_ts(2024, 3, 15, 12, 30)) == datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert month_start(_ts(2024, 3, 1)) == datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert next_month(datetime(2024, 11, 1, tzinfo=timezone.utc)) == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert next_month(datetime(2024, 12, 1, tzinfo=timezone.utc)) == datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_key_conditions():
+    """Тест: условия на ключ собираются с верхнего уровня и из $and; $or наверху отключает отсечение, внутри $and пропускается"""
+    assert key_conditions(None, "uploaded_at") == []
+    assert key_conditions({"source": "a.txt"}, "uploaded_at") == []
+    assert key_conditions({"uploaded_at": 5}, "uploaded_at") == [{"$eq": 5}]
+    assert key_conditions({"$and": [
+        {"uploaded_at": {"$gte": 1}},
+        {"$and": [{"uploaded_at": {"$lt": 9}}, {"source": "a.txt"}]},
+    ]}, "uploaded_at") == [{"$gte": 1}, {"$lt": 9}]
+    assert key_conditions({"$or": [{"uploaded_at": 1}, {"uploaded_at": 2}]}, "uploaded_at") is None
+    assert key_conditions({"$and": [{"$or": [{"uploaded_at": 1}]}]}, "uploaded_at") == []
+    assert key_conditions({"$and": [{"$or": [{"tag:a": True}, {"tag:b": True}]}, {"uploaded_at": {"$gte": 3}}]},
+                          "uploaded_at") == [{"$gte": 3}]
+
+
+def test_month_matches():
+    """Тест: шард месяца опрашивается, только если интервал фильтра с ним пересекается"""
+    march = _ts(2024, 3, 1)
+    assert month_matches(march, [])
+    assert month_matches(march, [{"$gte": _ts(2024, 3, 31, 23)}])
+    assert not month_matches(march, [{"$gte": _ts(2024, 4, 1)}])
+    assert month_matches(march, [{"$lte": march}])
+    assert not month_matches(march, [{"$lte": _ts(2024, 2, 29, 23)}])
+    assert month_matches(march, [{"$eq": _ts(2024, 3, 10)}])
+    assert not month_matches(march, [{"$eq": _ts(2024, 4, 10)}])
+    assert not month_matches(march, [{"$gte": _ts(2024, 1, 1)}, {"$lte": _ts(2024, 2, 1)}])
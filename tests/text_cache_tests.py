@@ -0,0 +1,23 @@
+from modules.text_cache import ExtractedTextCache
+
+
+def test_roundtrip_and_version(tmp_path):
+    """Тест: текст читается по хэшу только для той же версии извлечения"""
+    cache = ExtractedTextCache(tmp_path, version="1")
+    assert cache.get("abcdef") is None
+    cache.put("abcdef", "Текст документа\n" * 100)
+    assert cache.get("abcdef") == "Текст документа\n" * 100
+    assert ExtractedTextCache(tmp_path, version="2").get("abcdef") is None
+    assert list(tmp_path.rglob("*.tmp")) == []
+
+
+def test_discard_and_corrupted_entry(tmp_path):
+    """Тест: удаление записей и повреждённый файл кэша"""
+    cache = ExtractedTextCache(tmp_path, version="1")
+    cache.put("abcdef", "text")
+    ExtractedTextCache(tmp_path, version="2").put("abcdef", "text v2")
+    cache.discard("abcdef")
+    assert list(tmp_path.rglob("abcdef*")) == []
+    cache.put("123456", "text")
+    next(tmp_path.rglob("123456*")).write_bytes(b"garbage")
+    assert cache.get("123456") is None
@@ -0,0 +1,95 @@
+import re
+import pytest
+from config_models import TextSplitterConfig
+from modules.text_splitter import TextContextSplitter
+
+
+def make_splitter(method, **kwargs):
+    params = dict(method=method, words_per_context=3, overlap_words=1, sentences_per_context=1,
+                  overlap_sentences=0, paragraphs_per_context=1, overlap_lines=0)
+    params.update(kwargs)
+    return TextContextSplitter(TextSplitterConfig(**params))
+
+
+@pytest.fixture
+def sample_text():
+    """Фикстура с тестовым текстом"""
+    return ("First sentence. Second sentence! Third sentence?\n\n"
+            "First paragraph line 1\nFirst paragraph line 2\nFirst paragraph line 3\n\n"
+            "Second paragraph line 1\nSecond paragraph line 2\n\n\n"
+            "Third paragraph single line.")
+
+
+def test_split_by_words_windows():
+    """Тест окон по словам: 3 слова + 1 перекрытие"""
+    text = "one two  three\nfour five six seven eight nine ten"
+    contexts = make_splitter("words").split(text)
+    assert contexts[0] == "one two  three"
+    assert contexts[1] == "two  three\nfour five"
+    assert contexts[-1] == "eight nine ten"
+
+
+def test_spans_point_into_source(sample_text):
+    """Тест: контексты — срезы исходного текста по смещениям"""
+    splitter = make_splitter("sentences", sentences_per_context=2, overlap_sentences=1)
+    spans = list(splitter.iter_spans(sample_text))
+    assert [sample_text[s:e] for s, e in spans] == splitter.split(sample_text)
+    assert splitter.split(sample_text)[0] == "First sentence. Second sentence!"
+
+
+def test_split_by_sentences_paragraph_break(sample_text):
+    """Тест: разрыв абзаца завершает предложение"""
+    contexts = make_splitter("sentences").split(sample_text)
+    assert contexts[:3] == ["First sentence.", "Second sentence!", "Third sentence?"]
+    assert contexts[3].startswith("First paragraph line 1\n")
+
+
+def test_split_by_paragraphs_keeps_breaks(sample_text):
+    """Тест: абзацы сохраняются, перекрытие берёт строки предыдущего абзаца"""
+    assert len(make_splitter("paragraphs").split(sample_text)) == 4
+    contexts = make_splitter("paragraphs", overlap_lines=1).split(sample_text)
+    assert contexts[2].startswith("First paragraph line 3\n\nSecond paragraph line 1")
+
+
+def test_lazy_and_empty_input():
+    """Тест граничных случаев и ленивой выдачи"""
+    splitter = make_splitter("words")
+    assert splitter.split("   \n ") == []
+    assert next(splitter.iter_split("a b c d e")) == "a b c"
+    with pytest.raises(ValueError):
+        make_splitter("letters").split("text")
+
+
+class FakeTokenizer:
+    """Токенизатор «слово = токен» с offset_mapping, как у быстрых токенизаторов"""
+
+    def __call__(self, texts, **kwargs):
+        return {"offset_mapping": [[m.span() for m in re.finditer(r"\S+", t)] for t in texts]}
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+
+class FakeEmbedder:
+    tokenizer = FakeTokenizer()
+    max_seq_length = 6
+
+
+def test_split_by_tokens_respects_model_limit():
+    """Тест: окна не длиннее max_seq_length без служебных токенов, с перекрытием"""
+    splitter = TextContextSplitter(
+        TextSplitterConfig(method="tokens", words_per_context=3, overlap_words=1, sentences_per_context=1,
+                           overlap_sentences=0, paragraphs_per_context=1, overlap_lines=0, overlap_tokens=1),
+        FakeEmbedder(),
+    )
+    text = "t1 t2 t3\n\nt4 t5 t6 t7"
+    assert splitter.token_budget() == 4
+    assert splitter.split(text) == ["t1 t2 t3\n\nt4", "t4 t5 t6 t7"]
+    splitter.config.tokens_per_context = 2
+    assert splitter.split(text)[-1] == "t6 t7"
+
+
+def test_split_by_tokens_requires_embedder():
+    """Тест: без модели метод tokens недоступен"""
+    with pytest.raises(ValueError):
+        make_splitter("tokens").split("some text")
@@ -1,13 +1,63 @@
 import logging
+from datetime import datetime, timezone
 from itertools import zip_longest
-from flask import request, jsonify, send_file, render_template
+from flask import request, jsonify, send_file, render_template, make_response
 from io import BytesIO
 from werkzeug.exceptions import NotFound
 import mimetypes
 
+from modules.chunk_index import build_filters
+
 logger = logging.getLogger(__name__)
 
 
+def _with_etag(response, etag: str):
+    response.set_etag(etag)
+    # Клиент кэширует ответ, но всегда перепроверяет его по ETag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(etag: str):
+    return _with_etag(make_response("", 304), etag)
+
+
+def _timestamp(value):
+    """Unix-время из числа или даты ISO 8601 (без пояса — UTC)."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _parse_filters(raw):
+    """Фильтры запроса /api/message -> область поиска (build_filters); ValueError при ошибке."""
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+
+    def str_list(key):
+        values = raw.get(key) or []
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{key} must be a list of strings")
+        return values
+
+    file_ids = raw.get("file_ids") or []
+    if not isinstance(file_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in file_ids):
+        raise ValueError("file_ids must be a list of integers")
+    after, before = raw.get("uploaded_after"), raw.get("uploaded_before")
+    return build_filters(
+        file_ids=file_ids,
+        mime_types=str_list("mime_types"),
+        tags=str_list("tags"),
+        uploaded_after=_timestamp(after) if after is not None else None,
+        uploaded_before=_timestamp(before) if before is not None else None,
+    )
+
+
 def register_routes(app, dialog_manager):
     @app.errorhandler(Exception)
     def handle_global_exception(error):
@@ -28,13 +78,18 @@ def register_routes(app, dialog_manager):
             return jsonify({"error": "user_id is required"}), 400
         if not question:
             return jsonify({"error": "Question cannot be empty."}), 400
+        try:
+            filters = _parse_filters(data.get("filters"))
+        except ValueError as exc:
+            return jsonify({"error": f"Invalid filters: {exc}"[:200]}), 400
 
         try:
             response = dialog_manager.answer_text(
                 user_id=user_id,
                 question=question,
                 request_source_info=show_src,
-                request_fragments=show_frag
+                request_fragments=show_frag,
+                filters=filters,
             )
         except Exception as exc:
             return jsonify({"error": "Failed to process request.", "details": str(exc)[:100]}), 500
@@ -72,13 +127,16 @@ def register_routes(app, dialog_manager):
             return jsonify({"error": "user_id is required"}), 400
 
         try:
-            entries = dialog_manager.history.fetch_latest(
+            entries, etag = dialog_manager.history.fetch_latest_with_etag(
                 user_id=user_id, limit=30)
+            if request.if_none_match.contains(etag):
+                return _not_modified(etag)
             messages = []
             for entry in reversed(entries):
                 messages.append({"sender": "user", "text": entry["user"]})
                 messages.append({"sender": "bot", "text": entry["assistant"]})
-            return jsonify({"messages": messages}), 200
+            response = make_response(jsonify({"messages": messages}), 200)
+            return _with_etag(response, etag)
         except Exception as e:
             logger.exception(
                 "Error fetching history for user_id=%s: %s", user_id, str(e)[:100])
@@ -167,18 +225,23 @@ def register_routes(app, dialog_manager):
     def index():
         user_id = (request.args.get("user_id") or "guest").strip()[:50]
         logger.info("Main page request for user_id=%s", user_id)
+        messages = []
         try:
-            entries = dialog_manager.history.fetch_latest(user_id=user_id, limit=30)
-            messages = []
+            entries, etag = dialog_manager.history.fetch_latest_with_etag(user_id=user_id, limit=30)
+            # Страница зависит и от флагов отображения, поэтому они входят в ETag
+            etag = f"{etag}-{int(bool(dialog_manager.show_text_source_info))}{int(bool(dialog_manager.show_text_fragments))}"
+            if request.if_none_match.contains(etag):
+                return _not_modified(etag)
             for entry in reversed(entries):
                 messages.append({"sender": "user", "text": entry["user"]})
                 messages.append({"sender": "bot", "text": entry["assistant"]})
-            return render_template(
+            response = make_response(render_template(
                 "chat/index.html",
                 messages=messages,
                 show_text_source_info=dialog_manager.show_text_source_info,
                 show_text_fragments=dialog_manager.show_text_fragments
-            )
+            ))
+            return _with_etag(response, etag)
         except Exception as e:
             logger.exception("Error rendering main page for user_id=%s: %s", user_id, str(e)[:100])
             return render_template(